@@ -0,0 +1,184 @@
+"""
+Pooled, reusable HTTP clients for AI provider calls.
+
+Every Ollama and OpenAI-compatible request goes through this module so each API
+and Celery worker process keeps one keep-alive connection pool per
+(provider, endpoint, key) instead of paying a fresh TCP/TLS handshake per call.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Max connections kept alive per pool (per endpoint + key)
+AI_POOL_MAXSIZE = int(os.getenv("AI_POOL_MAXSIZE", "10"))
+# Max distinct pools kept per process; least recently used pools are dropped
+AI_POOL_MAX_CLIENTS = int(os.getenv("AI_POOL_MAX_CLIENTS", "32"))
+# How long Ollama keeps a model loaded after a generation. While it stays
+# loaded the runner reuses the KV cache for a prompt prefix identical to the
+# previous request's, so scan prompts put their fixed text first.
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+PoolKey = Tuple[str, str, str]
+
+_lock = threading.Lock()
+_pools: "OrderedDict[PoolKey, Any]" = OrderedDict()
+_pool_uses: Dict[PoolKey, int] = {}
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _key_fingerprint(api_key: Optional[str]) -> str:
+    """Short, non-reversible fingerprint so raw keys never appear in stats or logs."""
+    if not api_key:
+        return "-"
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+
+def _normalize_endpoint(endpoint: Optional[str]) -> str:
+    return (endpoint or "").rstrip("/")
+
+
+def _close_client(client: Any) -> None:
+    try:
+        client.close()
+    except Exception as e:
+        logger.debug(f"Error closing pooled AI client: {e}")
+
+
+def _get_or_create(key: PoolKey, factory) -> Any:
+    """Return the pooled client for key, creating it (and evicting LRU pools) on a miss."""
+    with _lock:
+        client = _pools.get(key)
+        if client is not None:
+            _pools.move_to_end(key)
+            _pool_uses[key] = _pool_uses.get(key, 0) + 1
+            _stats["hits"] += 1
+            return client
+
+        _stats["misses"] += 1
+        client = factory()
+        _pools[key] = client
+        _pool_uses[key] = 1
+
+        while len(_pools) > AI_POOL_MAX_CLIENTS:
+            # Not closed: another thread may still be mid-request on it. Its
+            # connections are released when the last user drops the client.
+            old_key, _ = _pools.popitem(last=False)
+            _pool_uses.pop(old_key, None)
+            _stats["evictions"] += 1
+            logger.info(f"Evicted AI connection pool for {old_key[0]} at {old_key[1] or 'default'}")
+
+        logger.info(f"Created AI connection pool for {key[0]} at {key[1] or 'default'} (maxsize={AI_POOL_MAXSIZE})")
+        return client
+
+
+def _new_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=AI_POOL_MAXSIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_http_session(provider: str, endpoint: Optional[str], api_key: Optional[str] = None) -> requests.Session:
+    """Return the keep-alive requests.Session for a provider endpoint."""
+    key = (provider, _normalize_endpoint(endpoint), _key_fingerprint(api_key))
+    return _get_or_create(key, _new_session)
+
+
+def get_ollama_session(endpoint: str) -> requests.Session:
+    """Return the keep-alive requests.Session for an Ollama endpoint."""
+    return get_http_session("ollama", endpoint)
+
+
+def ollama_post(endpoint: str, path: str, payload: Dict[str, Any], timeout: float, stream: bool = False) -> requests.Response:
+    """
+    POST to an Ollama API path (e.g. "/api/generate") over the pooled session.
+
+    Generation requests get keep_alive=OLLAMA_KEEP_ALIVE unless they set one.
+    """
+    url = f"{_normalize_endpoint(endpoint)}{path}"
+    if path in ("/api/generate", "/api/chat") and OLLAMA_KEEP_ALIVE and "keep_alive" not in payload:
+        payload = {**payload, "keep_alive": OLLAMA_KEEP_ALIVE}
+    return get_ollama_session(endpoint).post(url, json=payload, timeout=timeout, stream=stream)
+
+
+def ollama_get(endpoint: str, path: str, timeout: float) -> requests.Response:
+    """GET an Ollama API path (e.g. "/api/tags") over the pooled session."""
+    url = f"{_normalize_endpoint(endpoint)}{path}"
+    return get_ollama_session(endpoint).get(url, timeout=timeout)
+
+
+def get_openai_client(api_key: Optional[str], base_url: Optional[str] = None):
+    """Return a cached OpenAI client whose underlying httpx pool is bounded and reused."""
+    key = ("openai-sdk", _normalize_endpoint(base_url), _key_fingerprint(api_key))
+
+    def factory():
+        import httpx
+        from openai import OpenAI, DefaultHttpxClient
+
+        http_client = DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=AI_POOL_MAXSIZE,
+                max_keepalive_connections=AI_POOL_MAXSIZE,
+            )
+        )
+        return OpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
+    return _get_or_create(key, factory)
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Snapshot of pool hit/miss counters and the pools currently open in this process."""
+    with _lock:
+        total = _stats["hits"] + _stats["misses"]
+        return {
+            "pid": os.getpid(),
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "evictions": _stats["evictions"],
+            "hit_rate": round(_stats["hits"] / total, 4) if total else 0.0,
+            "max_pools": AI_POOL_MAX_CLIENTS,
+            "pool_maxsize": AI_POOL_MAXSIZE,
+            "pools": [
+                {
+                    "provider": provider,
+                    "endpoint": endpoint or "default",
+                    "key_fingerprint": fingerprint,
+                    "uses": _pool_uses.get((provider, endpoint, fingerprint), 0),
+                }
+                for (provider, endpoint, fingerprint) in _pools.keys()
+            ],
+        }
+
+
+def close_all() -> None:
+    """Close every pooled client (used on shutdown)."""
+    with _lock:
+        clients = list(_pools.values())
+        _pools.clear()
+        _pool_uses.clear()
+    for client in clients:
+        _close_client(client)
+
+
+def _reset_after_fork() -> None:
+    # Celery prefork children inherit the parent's sockets; drop them without
+    # closing so the parent's connections are left intact.
+    global _lock
+    _lock = threading.Lock()
+    _pools.clear()
+    _pool_uses.clear()
+    for k in _stats:
+        _stats[k] = 0
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
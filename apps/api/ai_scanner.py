@@ -2,18 +2,97 @@
 AI-powered compliance scanning using OpenAI GPT models.
 Analyzes evidence documents against compliance requirements.
 """
-import json
+import contextvars
 import logging
 import os
-from typing import List, Dict, Any, Optional
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Any, Optional, Tuple
 from openai import OpenAI
 from pydantic import BaseModel, Field
 from models import Control, Requirement, Settings
-from database import SessionLocal
 from crypto import decrypt_secret, is_encrypted
+from ai_clients import get_openai_client as _pooled_openai_client
+from provider_health import provider_health
+from settings_cache import settings_cache
+from llm_cache import llm_cache, cached_chat_completion, cached_ollama_generate, stream_ollama_generate, structured_chat_completion
+from llm_json import IncrementalArrayParser, extract_json, json_reply_check, ollama_format
+from llm_metrics import llm_call_site
+from prompt_packer import PromptBudget, context_window
 
 logger = logging.getLogger(__name__)
 
+# Evaluate each requirement of a control with its own request instead of one giant prompt
+SCAN_FANOUT = os.getenv("SCAN_FANOUT", "true").lower() == "true"
+# Max requirement requests in flight per control scan
+SCAN_FANOUT_CONCURRENCY = int(os.getenv("SCAN_FANOUT_CONCURRENCY", "4"))
+# Stream Ollama generations so requirements are stored as soon as they are produced
+OLLAMA_STREAMING = os.getenv("OLLAMA_STREAMING", "true").lower() == "true"
+# Wall-clock limit for one streamed scan generation; partial results are kept
+OLLAMA_STREAM_DEADLINE_SECONDS = float(os.getenv("OLLAMA_STREAM_DEADLINE_SECONDS", "300"))
+# Output tokens reserved per requirement in a scan prompt (plus a fixed allowance for gaps)
+SCAN_OUTPUT_TOKENS_PER_REQUIREMENT = int(os.getenv("SCAN_OUTPUT_TOKENS_PER_REQUIREMENT", "600"))
+# System message / JSON schema suffix added around the scan prompt by the provider call
+_SCAN_PROVIDER_OVERHEAD_TOKENS = 400
+
+# Fixed head of every scan prompt. Kept byte-identical across scans (no
+# per-control text) so Ollama can reuse the KV cache for it; see
+# ComplianceScanner._build_scan_prompt for the rest of the layout.
+SCAN_PROMPT_INSTRUCTIONS = """
+COMPLIANCE SCANNING TASK
+
+You are analyzing evidence documents to determine compliance with a security control. The control, its
+requirements and the evidence documents follow these instructions.
+
+ANALYSIS INSTRUCTIONS:
+
+1. For each requirement, analyze the evidence and determine:
+   - OUTCOME: PASS (fully satisfies), PARTIAL (partially satisfies), FAIL (contradicts), or NOT_FOUND (no evidence)
+   - CONFIDENCE: 0.0 to 1.0 based on strength and clarity of evidence
+   - RATIONALE: Clear explanation of your assessment
+   - CITATIONS: Direct quotes from evidence (max 30 words each)
+
+2. For any requirement that is PARTIAL, FAIL, or NOT_FOUND, identify gaps and recommend specific actions.
+
+3. BE EXTREMELY STRICT with confidence scores. Use the following guidelines:
+   - 0.9-1.0: Only for PERFECT, unambiguous, comprehensive evidence with explicit policy statements
+   - 0.7-0.8: Strong evidence with clear documentation and multiple supporting sources
+   - 0.5-0.6: Weak or partial evidence, screenshots without context, or ambiguous documentation
+   - 0.3-0.4: Minimal evidence, uncertain relevance, or requires significant interpretation
+   - 0.0-0.2: No clear evidence or highly questionable relevance
+
+4. Screenshots alone should receive LOW confidence (0.3-0.5) unless they clearly show comprehensive compliance
+   with context and supporting documentation.
+
+5. Be HIGHLY CRITICAL: If evidence is unclear, incomplete, ambiguous, or requires assumptions, assign LOW confidence.
+
+6. Never hallucinate - only cite evidence that actually exists in the provided documents.
+
+7. Require EXPLICIT, DETAILED evidence. Generic statements or vague references should receive very low scores.
+
+You must respond with valid JSON only, following this exact schema:
+{
+  "requirements": [
+    {
+      "requirement_id": "string (use the UUID Requirement ID given for the requirement)",
+      "outcome": "PASS|PARTIAL|FAIL|NOT_FOUND", 
+      "confidence": 0.0-1.0,
+      "rationale": "string explanation",
+      "citations": [{"document_id": "string", "document_name": "string", "page_num": 1, "quote": "string max 30 words"}]
+    }
+  ],
+  "gaps": [
+    {
+      "requirement_id": "string",
+      "summary": "string describing what is missing", 
+      "recommended_actions": [{"title": "string", "detail": "string", "priority": "HIGH|MEDIUM|LOW"}]
+    }
+  ]
+}
+"""
+SCAN_PROMPT_SUFFIX = "\nRespond only with valid JSON following the schema above. No additional text.\n"
+
 
 def get_or_create_settings(db, org_id):
     """Return the Settings row for an org, creating it from env defaults if missing.
@@ -58,10 +137,13 @@ def _resolve_api_key(raw_key: Optional[str]) -> Optional[str]:
 # The OpenAI SDK requires an api_key parameter, so we provide this dummy value for local endpoints.
 LOCAL_AI_PLACEHOLDER_KEY = os.getenv('LOCAL_AI_PLACEHOLDER_KEY', 'sk-local-endpoint-no-auth')
 
-def create_chat_completion_safe(client, model, messages, temperature=None):
+def create_chat_completion_safe(client, model, messages, temperature=None, org_id=None, json_schema=None, validate=None):
     """
     Create a chat completion with safe fallbacks for different endpoint capabilities.
     Some OpenAI-compatible endpoints don't support all features.
+    Deterministic calls are answered from the org's LLM response cache when possible;
+    validate(text) decides whether a reply is cached.
+    With json_schema, structured output is requested where the endpoint supports it.
     """
     # Base parameters
     params = {
@@ -73,8 +155,11 @@ def create_chat_completion_safe(client, model, messages, temperature=None):
     if temperature is not None:
         params["temperature"] = temperature
     
-    # Make request - LM Studio and similar don't support JSON mode
-    return client.chat.completions.create(**params)
+    if json_schema is not None:
+        # Falls back to JSON mode / plain text on endpoints without structured outputs
+        return structured_chat_completion(client, schema=json_schema, org_id=org_id, validate=validate, **params)
+
+    return cached_chat_completion(client, org_id=org_id, validate=validate, **params)
 
 # Initialize OpenAI client lazily
 client = None
@@ -85,70 +170,60 @@ def get_vision_clients_for_dual_validation(org_id):
     Dual vision validation requires BOTH OpenAI and Ollama to be properly configured.
     If only one provider is configured, returns empty dict to signal dual mode is unavailable.
     """
-    db = SessionLocal()
-    try:
-        settings = get_or_create_settings(db, org_id)
-
-        clients = {}
-
-        # Check if OpenAI is properly configured (has valid API key)
-        resolved_key = _resolve_api_key(settings.openai_api_key)
-        openai_configured = bool(resolved_key and resolved_key != 'your_openai_api_key_here')
+    settings = settings_cache.get(org_id)
 
-        # Check if Ollama is properly configured
-        ollama_configured = bool(settings.ollama_endpoint)
+    clients = {}
 
-        # Dual vision requires BOTH providers to be configured
-        if not (openai_configured and ollama_configured):
-            if not openai_configured and ollama_configured:
-                logger.info("Dual vision unavailable: OpenAI not configured (no API key). Using Ollama single model mode.")
-            elif openai_configured and not ollama_configured:
-                logger.info("Dual vision unavailable: Ollama not configured. Using OpenAI single model mode.")
-            else:
-                logger.info("Dual vision unavailable: Neither OpenAI nor Ollama properly configured.")
-            return clients
+    # Check if OpenAI is properly configured (has valid API key)
+    resolved_key = _resolve_api_key(settings.openai_api_key)
+    openai_configured = bool(resolved_key and resolved_key != 'your_openai_api_key_here')
 
-        # Get OpenAI GPT-4o client
-        try:
-            from openai import OpenAI
-            clients['openai'] = {
-                'client': OpenAI(
-                    api_key=_resolve_api_key(settings.openai_api_key),
-                    base_url=settings.openai_endpoint
-                ),
-                'model': settings.openai_vision_model or 'gpt-4o',
-                'type': 'openai'
-            }
-            logger.info(f"Initialized OpenAI vision client with model {clients['openai']['model']}")
-        except Exception as e:
-            logger.error(f"Failed to initialize OpenAI vision client: {e}")
-            return {}  # Can't do dual vision without OpenAI
-
-        # Get Ollama vision client
-        try:
-            import requests
-            endpoint = settings.ollama_endpoint
-            model = settings.ollama_vision_model or 'qwen2-vl'
-
-            # Test connection
-            response = requests.get(f"{endpoint}/api/tags", timeout=5)
-            if response.status_code == 200:
-                clients['ollama'] = {
-                    'endpoint': endpoint,
-                    'model': model,
-                    'type': 'ollama'
-                }
-                logger.info(f"Initialized Ollama vision client with model {model}")
-            else:
-                logger.error(f"Ollama connection test failed: {response.status_code}")
-                return {}  # Can't do dual vision without Ollama
-        except Exception as e:
-            logger.error(f"Failed to initialize Ollama vision client: {e}")
-            return {}  # Can't do dual vision without Ollama
+    # Check if Ollama is properly configured
+    ollama_configured = bool(settings.ollama_endpoint)
 
+    # Dual vision requires BOTH providers to be configured
+    if not (openai_configured and ollama_configured):
+        if not openai_configured and ollama_configured:
+            logger.info("Dual vision unavailable: OpenAI not configured (no API key). Using Ollama single model mode.")
+        elif openai_configured and not ollama_configured:
+            logger.info("Dual vision unavailable: Ollama not configured. Using OpenAI single model mode.")
+        else:
+            logger.info("Dual vision unavailable: Neither OpenAI nor Ollama properly configured.")
         return clients
-    finally:
-        db.close()
+
+    # Get OpenAI GPT-4o client
+    try:
+        clients['openai'] = {
+            'client': _pooled_openai_client(
+                api_key=_resolve_api_key(settings.openai_api_key),
+                base_url=settings.openai_endpoint
+            ),
+            'model': settings.openai_vision_model or 'gpt-4o',
+            'type': 'openai'
+        }
+        logger.info(f"Initialized OpenAI vision client with model {clients['openai']['model']}")
+    except Exception as e:
+        logger.error(f"Failed to initialize OpenAI vision client: {e}")
+        return {}  # Can't do dual vision without OpenAI
+
+    # Get Ollama vision client
+    try:
+        endpoint = settings.ollama_endpoint
+        model = settings.ollama_vision_model or 'qwen2-vl'
+
+        # Test connection (cached liveness; fails fast while the circuit is open)
+        provider_health.check_ollama(endpoint, timeout=5)
+        clients['ollama'] = {
+            'endpoint': endpoint,
+            'model': model,
+            'type': 'ollama'
+        }
+        logger.info(f"Initialized Ollama vision client with model {model}")
+    except Exception as e:
+        logger.error(f"Failed to initialize Ollama vision client: {e}")
+        return {}  # Can't do dual vision without Ollama
+
+    return clients
 
 def get_ai_client(org_id=None):
     """Get AI client based on an organisation's configured provider.
@@ -156,62 +231,57 @@ def get_ai_client(org_id=None):
     org_id is required in normal multi-tenant operation. When None (system/test
     context with no org), falls back to environment-variable configuration.
     """
-    db = SessionLocal()
-    try:
-        # Get (or lazily create) this org's settings; None => env fallback
-        settings = get_or_create_settings(db, org_id) if org_id is not None else None
-        provider = settings.ai_provider if settings is not None else os.getenv('AI_PROVIDER', 'ollama')
+    # This org's settings from the process cache (created on first use); None => env fallback
+    settings = settings_cache.get(org_id) if org_id is not None else None
+    provider = settings.ai_provider if settings is not None else os.getenv('AI_PROVIDER', 'ollama')
+
+    if provider == 'openai':
+        # Get settings from database or fallback to environment
+        if settings:
+            api_key = _resolve_api_key(settings.openai_api_key)
+            base_url = settings.openai_endpoint
+        else:
+            api_key = os.getenv('OPENAI_API_KEY')
+            base_url = os.getenv('OPENAI_ENDPOINT')
+
+        # Only require API key if using default OpenAI endpoint
+        if (not api_key or api_key == 'your_openai_api_key_here') and not base_url:
+            raise ValueError("OPENAI_API_KEY not configured. Please set a valid OpenAI API key for default OpenAI endpoint.")
 
-        if provider == 'openai':
+        # Use placeholder key for custom endpoints that don't require authentication
+        if (not api_key or api_key == 'your_openai_api_key_here') and base_url:
+            api_key = LOCAL_AI_PLACEHOLDER_KEY
+
+        try:
+            openai_client = _pooled_openai_client(api_key=api_key, base_url=base_url)
+        except Exception as e:
+            logger.error(f"Failed to initialize OpenAI client: {e}")
+            raise
+        provider_health.ensure_not_open("openai", str(openai_client.base_url))
+        return openai_client
+    elif provider == 'ollama':
+        try:
             # Get settings from database or fallback to environment
             if settings:
-                api_key = _resolve_api_key(settings.openai_api_key)
-                base_url = settings.openai_endpoint
+                endpoint = settings.ollama_endpoint or 'http://host.docker.internal:11434'
+                model = settings.ollama_model or 'qwen2.5:14b'
+                context_size = settings.ollama_context_size or 131072
             else:
-                api_key = os.getenv('OPENAI_API_KEY')
-                base_url = os.getenv('OPENAI_ENDPOINT')
-
-            # Only require API key if using default OpenAI endpoint
-            if (not api_key or api_key == 'your_openai_api_key_here') and not base_url:
-                raise ValueError("OPENAI_API_KEY not configured. Please set a valid OpenAI API key for default OpenAI endpoint.")
+                endpoint = os.getenv('OLLAMA_ENDPOINT', 'http://host.docker.internal:11434')
+                model = os.getenv('OLLAMA_MODEL', 'qwen2.5:14b')
+                context_size = int(os.getenv("OLLAMA_CONTEXT_SIZE", "131072"))
 
-            # Use placeholder key for custom endpoints that don't require authentication
-            if (not api_key or api_key == 'your_openai_api_key_here') and base_url:
-                api_key = LOCAL_AI_PLACEHOLDER_KEY
+            logger.info(f"Connecting to Ollama at {endpoint} with model {model}")
 
-            try:
-                from openai import OpenAI
-                return OpenAI(api_key=api_key, base_url=base_url)
-            except Exception as e:
-                logger.error(f"Failed to initialize OpenAI client: {e}")
-                raise
-        elif provider == 'ollama':
-            try:
-                import requests
+            # Test connection (cached liveness; fails fast while the circuit is open)
+            provider_health.check_ollama(endpoint, timeout=5)
 
-                # Get settings from database or fallback to environment
-                if settings:
-                    endpoint = settings.ollama_endpoint or 'http://host.docker.internal:11434'
-                    model = settings.ollama_model or 'qwen2.5:14b'
-                else:
-                    endpoint = os.getenv('OLLAMA_ENDPOINT', 'http://host.docker.internal:11434')
-                    model = os.getenv('OLLAMA_MODEL', 'qwen2.5:14b')
-
-                logger.info(f"Connecting to Ollama at {endpoint} with model {model}")
-
-                # Test connection
-                response = requests.get(f"{endpoint}/api/tags", timeout=5)
-                if response.status_code != 200:
-                    raise ValueError(f"Cannot connect to Ollama at {endpoint}")
-
-                return {'endpoint': endpoint, 'model': model, 'type': 'ollama'}
-            except Exception as e:
-                logger.error(f"Failed to initialize Ollama client: {e}")
-                raise
-        else:
-            raise ValueError(f"Unknown AI provider: {provider}")
-    finally:
-        db.close()
+            return {'endpoint': endpoint, 'model': model, 'type': 'ollama', 'context_size': context_size}
+        except Exception as e:
+            logger.error(f"Failed to initialize Ollama client: {e}")
+            raise
+    else:
+        raise ValueError(f"Unknown AI provider: {provider}")
 
 def get_openai_client(org_id):
     """Legacy function for backward compatibility."""
@@ -227,7 +297,8 @@ class Citation(BaseModel):
 class RequirementResult(BaseModel):
     """Result of scanning a single requirement."""
     requirement_id: str = Field(description="ID of the requirement being evaluated")
-    outcome: str = Field(description="PASS, PARTIAL, FAIL, or NOT_FOUND")
+    outcome: str = Field(description="PASS, PARTIAL, FAIL, or NOT_FOUND",
+                         json_schema_extra={"enum": ["PASS", "PARTIAL", "FAIL", "NOT_FOUND"]})
     confidence: float = Field(description="Confidence score between 0.0 and 1.0")
     rationale: str = Field(description="Explanation of the outcome")
     citations: List[Citation] = Field(description="Evidence citations supporting this outcome")
@@ -236,7 +307,8 @@ class RecommendedAction(BaseModel):
     """Recommended action to address a compliance gap."""
     title: str = Field(description="Short title of the recommended action")
     detail: str = Field(description="Detailed description of what needs to be done")
-    priority: str = Field(description="HIGH, MEDIUM, or LOW priority")
+    priority: str = Field(description="HIGH, MEDIUM, or LOW priority",
+                          json_schema_extra={"enum": ["HIGH", "MEDIUM", "LOW"]})
 
 class Gap(BaseModel):
     """Compliance gap identified during scanning."""
@@ -249,6 +321,21 @@ class ScanResponse(BaseModel):
     requirements: List[RequirementResult] = Field(description="Results for each requirement")
     gaps: List[Gap] = Field(description="Identified compliance gaps")
 
+# Output schema sent to the provider so replies are valid ScanResponse JSON
+SCAN_RESPONSE_SCHEMA = ScanResponse.model_json_schema()
+
+_has_scan_json = json_reply_check(("requirements",))
+
+def _valid_scan_reply(text: str) -> bool:
+    """Cache validate callback: only replies that parse into a ScanResponse are cached."""
+    if not _has_scan_json(text):
+        return False
+    try:
+        ScanResponse(**extract_json(text, required_keys=("requirements",)))
+        return True
+    except Exception:
+        return False
+
 class ComplianceScanner:
     """
     AI-powered compliance scanner that analyzes evidence against requirements.
@@ -259,7 +346,11 @@ class ComplianceScanner:
         self.prompt_version = "v1.0"
     
     def scan_control(self, control: Control, requirements: List[Requirement],
-                    evidence_texts: List[Dict[str, Any]], org_id=None) -> Dict[str, Any]:
+                    evidence_texts: List[Dict[str, Any]], org_id=None,
+                    fanout: Optional[bool] = None,
+                    evidence_by_requirement: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                    on_result: Optional[Callable[[Dict[str, Any], int], None]] = None,
+                    cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
         """
         Scan a compliance control against provided evidence.
 
@@ -268,260 +359,387 @@ class ComplianceScanner:
             requirements: List of requirements for the control
             evidence_texts: List of evidence text excerpts with metadata
             org_id: Organisation whose AI settings should be used
+            fanout: Evaluate each requirement with its own request, in parallel
+                (defaults to SCAN_FANOUT)
+            evidence_by_requirement: Evidence selected per requirement ID; in
+                fan-out mode each requirement's prompt only carries its own
+            on_result: Called with each partial result dict and the number of
+                requirements completed so far, as soon as that part is finished
+            cancel: Once set, requirements not yet sent are skipped and the
+                results finished so far are returned
 
         Returns:
             Dictionary with requirements results and gaps
         """
-        try:
-            # Build the prompt
-            prompt = self._build_scan_prompt(control, requirements, evidence_texts)
+        if fanout is None:
+            fanout = SCAN_FANOUT
+        result_dict: Dict[str, List[Any]] = {
+            "requirements": [],
+            "gaps": []
+        }
+
+        # Cache hits and misses of this scan alone, including its fan-out threads
+        with llm_cache.tally() as cache_counts:
+            try:
+                logger.info(f"Starting AI scan for control {control.code} with {len(requirements)} requirements"
+                            f"{' (fan-out)' if fanout and len(requirements) > 1 else ''}")
 
-            logger.info(f"Starting AI scan for control {control.code} with {len(requirements)} requirements")
+                # Call AI provider (OpenAI or Ollama)
+                ai_client = get_ai_client(org_id)
 
-            # Call AI provider (OpenAI or Ollama)
-            ai_client = get_ai_client(org_id)
+                if fanout and len(requirements) > 1:
+                    self._scan_requirements_fanout(ai_client, control, requirements, evidence_texts,
+                                                   org_id, result_dict, on_result, evidence_by_requirement, cancel)
+                elif cancel is not None and cancel.is_set():
+                    logger.warning(f"AI scan of control {control.code} cancelled before it started")
+                else:
+                    prompt = self._build_scan_prompt(control, requirements, evidence_texts,
+                                                     context_tokens=context_window(ai_client))
+                    streamed = set()
+
+                    def on_requirement(req_result: RequirementResult):
+                        # Streamed providers hand over each requirement as it completes
+                        if not on_result or req_result.requirement_id in streamed:
+                            return
+                        streamed.add(req_result.requirement_id)
+                        on_result(self._to_result_dict(ScanResponse(requirements=[req_result], gaps=[])), len(streamed))
+
+                    partial = self._to_result_dict(self._request_scan(ai_client, prompt, org_id, on_requirement))
+                    result_dict["requirements"].extend(partial["requirements"])
+                    result_dict["gaps"].extend(partial["gaps"])
+                    if on_result:
+                        on_result({
+                            "requirements": [r for r in partial["requirements"] if r["requirement_id"] not in streamed],
+                            "gaps": partial["gaps"],
+                        }, len(requirements))
+
+                logger.info(f"AI scan completed for control {control.code} (LLM cache: {llm_cache.summary(cache_counts)})")
+                return result_dict
 
-            if isinstance(ai_client, dict) and ai_client.get('type') == 'ollama':
-                # Handle Ollama
-                response = self._call_ollama(ai_client, prompt, org_id)
-            else:
-                # Handle OpenAI - use standard chat completions with JSON
-                response = create_chat_completion_safe(
-                    client=ai_client,
-                    model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "You are a compliance expert that analyzes evidence documents against security control requirements. You must respond with valid JSON only."
-                        },
-                        {
-                            "role": "user", 
-                            "content": prompt + "\n\nRespond with valid JSON only following the exact schema provided."
-                        }
-                    ],
-                    temperature=0.1  # Low temperature for consistent results
-                )
-            
-            # Parse the structured response
-            if isinstance(ai_client, dict) and ai_client.get('type') == 'ollama':
-                scan_result = response  # Already parsed for Ollama
-            else:
-                # Parse OpenAI JSON response
-                try:
-                    response_text = response.choices[0].message.content.strip()
-                    json_data = json.loads(response_text)
-                    scan_result = ScanResponse(**json_data)
-                except (json.JSONDecodeError, Exception) as e:
-                    logger.error(f"Failed to parse OpenAI response: {e}")
-                    # Return empty result on parse failure
-                    scan_result = ScanResponse(requirements=[], gaps=[])
-            
-            # Convert to dictionary format expected by worker
-            result_dict: Dict[str, List[Any]] = {
-                "requirements": [],
-                "gaps": []
-            }
-            
-            for req_result in scan_result.requirements:
-                result_dict["requirements"].append({
-                    "requirement_id": req_result.requirement_id,
-                    "outcome": req_result.outcome,
-                    "confidence": req_result.confidence,
-                    "rationale": req_result.rationale,
-                    "citations": [
-                        {
-                            "document_id": c.document_id,
-                            "document_name": c.document_name,
-                            "page_num": c.page_num,
-                            "quote": c.quote
-                        }
-                        for c in req_result.citations
-                    ]
-                })
-            
-            for gap in scan_result.gaps:
-                result_dict["gaps"].append({
-                    "requirement_id": gap.requirement_id,
-                    "summary": gap.summary,
-                    "recommended_actions": [
-                        {
-                            "title": a.title,
-                            "detail": a.detail,
-                            "priority": a.priority
-                        }
-                        for a in gap.recommended_actions
-                    ]
-                })
-            
-            logger.info(f"AI scan completed for control {control.code}")
-            return result_dict
-            
-        except Exception as e:
-            logger.error(f"Error during AI scan: {str(e)}")
-            # Return empty results on failure
-            return {
-                "requirements": [],
-                "gaps": []
-            }
-    
-    def _build_scan_prompt(self, control: Control, requirements: List[Requirement], 
-                          evidence_texts: List[Dict[str, Any]]) -> str:
+            except Exception as e:
+                logger.error(f"Error during AI scan: {str(e)}")
+                # Return whatever finished before the failure
+                return result_dict
+
+    def _scan_requirements_fanout(self, ai_client, control: Control, requirements: List[Requirement],
+                                  evidence_texts: List[Dict[str, Any]], org_id,
+                                  result_dict: Dict[str, List[Any]],
+                                  on_result: Optional[Callable[[Dict[str, Any], int], None]],
+                                  evidence_by_requirement: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                                  cancel: Optional[threading.Event] = None) -> None:
         """
-        Build the prompt for AI scanning.
+        Evaluate each requirement with its own request on a bounded thread pool.
+
+        Prompts are built up front so worker threads never touch ORM objects
+        (the caller's session may expire them when it commits progress).
+        A failed or unparseable requirement is logged and skipped; the rest
+        of the control still completes. Once cancel is set, requirements not
+        yet sent are dropped.
+
+        Streamed (Ollama) replies report their requirement as soon as its
+        result object is complete, before the rest of the reply (gaps) has
+        been generated. Worker threads only queue events; on_result is always
+        called from this thread.
         """
-        prompt = f"""
-COMPLIANCE SCANNING TASK
+        evidence_by_requirement = evidence_by_requirement or {}
+        context_tokens = context_window(ai_client)
+        jobs = [
+            (str(req.id), req.req_code,
+             self._build_scan_prompt(control, [req], evidence_by_requirement.get(str(req.id), evidence_texts),
+                                     context_tokens=context_tokens))
+            for req in requirements
+        ]
+        workers = max(1, min(SCAN_FANOUT_CONCURRENCY, len(jobs)))
+        completed = 0
+        # ("requirement", req_id, RequirementResult) while streaming, ("done", future, None) at the end
+        events: "queue.Queue[Tuple[str, Any, Any]]" = queue.Queue()
+        streamed = set()
+
+        def request(req_id: str, prompt: str) -> ScanResponse:
+            def on_requirement(req_result: RequirementResult):
+                events.put(("requirement", req_id, req_result))
+            return self._request_scan(ai_client, prompt, org_id, on_requirement)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan-fanout") as executor:
+            futures = {}
+            for req_id, req_code, prompt in jobs:
+                # In a copy of this context, so the scan's cache tally counts the request
+                future = executor.submit(contextvars.copy_context().run, request, req_id, prompt)
+                futures[future] = (req_id, req_code)
+                future.add_done_callback(lambda f: events.put(("done", f, None)))
+
+            remaining = len(futures)
+            while remaining:
+                kind, item, req_result = events.get()
+                if cancel is not None and cancel.is_set():
+                    for queued in futures:
+                        queued.cancel()
+                    logger.warning(f"AI scan of control {control.code} cancelled after {completed} of "
+                                   f"{len(jobs)} requirements")
+                    break
+
+                if kind == "requirement":
+                    if item in streamed:
+                        continue
+                    streamed.add(item)
+                    completed += 1
+                    partial = self._to_result_dict(ScanResponse(requirements=[req_result], gaps=[]),
+                                                   requirement_id=item)
+                else:
+                    remaining -= 1
+                    req_id, req_code = futures[item]
+                    was_streamed = req_id in streamed
+                    if not was_streamed:
+                        completed += 1
+                    try:
+                        partial = self._to_result_dict(item.result(), requirement_id=req_id)
+                    except Exception as e:
+                        logger.error(f"AI scan failed for requirement {req_code} of control {control.code}: {e}")
+                        # Still report it as finished so progress reaches every requirement
+                        partial = {"requirements": [], "gaps": []}
+                    if was_streamed:
+                        # Already reported; only its gaps are new
+                        partial["requirements"] = []
+                        if not partial["gaps"]:
+                            continue
+
+                result_dict["requirements"].extend(partial["requirements"])
+                result_dict["gaps"].extend(partial["gaps"])
+                if on_result:
+                    on_result(partial, completed)
+
+    @llm_call_site("scan")
+    def _request_scan(self, ai_client, prompt: str, org_id=None,
+                      on_requirement: Optional[Callable[[RequirementResult], None]] = None) -> ScanResponse:
+        """Send one scan prompt to the configured provider and parse the structured response."""
+        if isinstance(ai_client, dict) and ai_client.get('type') == 'ollama':
+            # Handle Ollama
+            return self._call_ollama(ai_client, prompt, org_id, on_requirement)
+
+        # Handle OpenAI - use standard chat completions with JSON
+        response = create_chat_completion_safe(
+            client=ai_client,
+            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are a compliance expert that analyzes evidence documents against security control requirements. You must respond with valid JSON only."
+                },
+                {
+                    "role": "user", 
+                    "content": prompt + "\n\nRespond with valid JSON only following the exact schema provided."
+                }
+            ],
+            temperature=0.1,  # Low temperature for consistent results
+            org_id=org_id,
+            json_schema=SCAN_RESPONSE_SCHEMA,
+            validate=_valid_scan_reply
+        )
+
+        # Parse OpenAI JSON response
+        try:
+            json_data = extract_json(response.choices[0].message.content, required_keys=("requirements",))
+            if json_data is None:
+                raise ValueError("no JSON object in response")
+            return ScanResponse(**json_data)
+        except Exception as e:
+            logger.error(f"Failed to parse OpenAI response: {e}")
+            # Return empty result on parse failure
+            return ScanResponse(requirements=[], gaps=[])
 
-You are analyzing evidence documents to determine compliance with the security control "{control.code}: {control.title}".
+    @staticmethod
+    def _to_result_dict(scan_result: ScanResponse, requirement_id: Optional[str] = None) -> Dict[str, List[Any]]:
+        """
+        Convert a ScanResponse to the dictionary format expected by the worker.
 
-CONTROL DESCRIPTION:
-{control.description}
+        When the prompt covered a single requirement, requirement_id pins every
+        result and gap to it, since models often echo the code or a placeholder
+        instead of the UUID.
+        """
+        result_dict: Dict[str, List[Any]] = {
+            "requirements": [],
+            "gaps": []
+        }
+
+        req_results = scan_result.requirements[:1] if requirement_id else scan_result.requirements
+        for req_result in req_results:
+            result_dict["requirements"].append({
+                "requirement_id": requirement_id or req_result.requirement_id,
+                "outcome": req_result.outcome,
+                "confidence": req_result.confidence,
+                "rationale": req_result.rationale,
+                "citations": [
+                    {
+                        "document_id": c.document_id,
+                        "document_name": c.document_name,
+                        "page_num": c.page_num,
+                        "quote": c.quote
+                    }
+                    for c in req_result.citations
+                ]
+            })
+
+        for gap in scan_result.gaps:
+            result_dict["gaps"].append({
+                "requirement_id": requirement_id or gap.requirement_id,
+                "summary": gap.summary,
+                "recommended_actions": [
+                    {
+                        "title": a.title,
+                        "detail": a.detail,
+                        "priority": a.priority
+                    }
+                    for a in gap.recommended_actions
+                ]
+            })
 
-REQUIREMENTS TO EVALUATE:
-"""
-        
-        # Add requirements
-        for req in requirements:
-            prompt += f"\nRequirement ID: {req.id}"
-            prompt += f"\n{req.req_code}: {req.text}"
-            if req.guidance:
-                prompt += f"\n  Guidance: {req.guidance}"
-            prompt += f"\n  Maturity Level: {req.maturity_level}"
-            prompt += "\n"
-        
-        # Add evidence
-        prompt += "\nEVIDENCE DOCUMENTS:\n"
-        
-        for i, evidence in enumerate(evidence_texts):
-            prompt += f"\nDocument {i+1}: {evidence['document_name']} (Page {evidence['page_num']})\n"
-            # Allow much larger evidence with expanded context window
-            text = evidence['text']
-            if len(text) > 15000:  # Increased from 2000 to 15000 characters
-                text = text[:15000] + "... [truncated]"
-            prompt += f"Content: {text}\n"
-        
-        # Add instructions
-        prompt += """
-ANALYSIS INSTRUCTIONS:
+        return result_dict
 
-1. For each requirement, analyze the evidence and determine:
-   - OUTCOME: PASS (fully satisfies), PARTIAL (partially satisfies), FAIL (contradicts), or NOT_FOUND (no evidence)
-   - CONFIDENCE: 0.0 to 1.0 based on strength and clarity of evidence
-   - RATIONALE: Clear explanation of your assessment
-   - CITATIONS: Direct quotes from evidence (max 30 words each)
-
-2. For any requirement that is PARTIAL, FAIL, or NOT_FOUND, identify gaps and recommend specific actions.
+    def _build_scan_prompt(self, control: Control, requirements: List[Requirement], 
+                          evidence_texts: List[Dict[str, Any]],
+                          context_tokens: Optional[int] = None) -> str:
+        """
+        Build the prompt for AI scanning.
 
-3. BE EXTREMELY STRICT with confidence scores. Use the following guidelines:
-   - 0.9-1.0: Only for PERFECT, unambiguous, comprehensive evidence with explicit policy statements
-   - 0.7-0.8: Strong evidence with clear documentation and multiple supporting sources
-   - 0.5-0.6: Weak or partial evidence, screenshots without context, or ambiguous documentation
-   - 0.3-0.4: Minimal evidence, uncertain relevance, or requires significant interpretation
-   - 0.0-0.2: No clear evidence or highly questionable relevance
+        Laid out most-stable first so Ollama can reuse its KV cache across
+        calls: the fixed instructions and schema (identical for every scan),
+        then the control and its requirements (identical for every scan of
+        the control, whatever the evidence), then the evidence. Requirements
+        are sorted so their block doesn't depend on query order.
 
-4. Screenshots alone should receive LOW confidence (0.3-0.5) unless they clearly show comprehensive compliance
-   with context and supporting documentation.
+        Requirements are always included; evidence (assumed best-first) fills
+        whatever is left of the context window after the rest and the output
+        reservation, and anything that doesn't fit is logged.
+        """
+        prefix = SCAN_PROMPT_INSTRUCTIONS + self._scan_prompt_control_block(control, requirements)
+
+        output_tokens = SCAN_OUTPUT_TOKENS_PER_REQUIREMENT * len(requirements) + 300
+        if context_tokens is None:
+            context_tokens = int(os.getenv("OLLAMA_CONTEXT_SIZE", "131072"))
+        budget = PromptBudget(context_tokens, min(output_tokens, context_tokens // 2))
+        budget.reserve(prefix)
+        budget.reserve(SCAN_PROMPT_SUFFIX)
+        budget.reserve_tokens(_SCAN_PROVIDER_OVERHEAD_TOKENS)
+
+        evidence_blocks = budget.fit_items(
+            "evidence",
+            list(enumerate(evidence_texts)),
+            lambda item: f"\nDocument {item[0]+1}: {item[1]['document_name']} (Page {item[1]['page_num']})\nContent: {item[1]['text']}\n",
+            truncate_last=True,
+        )
+
+        if budget.lossy:
+            logger.warning(f"Scan prompt for {control.code} exceeds context budget: {budget.summary()}")
+        else:
+            logger.debug(f"Scan prompt for {control.code}: {budget.summary()}")
 
-5. Be HIGHLY CRITICAL: If evidence is unclear, incomplete, ambiguous, or requires assumptions, assign LOW confidence.
+        return prefix + "\nEVIDENCE DOCUMENTS:\n" + "".join(evidence_blocks) + SCAN_PROMPT_SUFFIX
 
-6. Never hallucinate - only cite evidence that actually exists in the provided documents.
+    @staticmethod
+    def _scan_prompt_control_block(control: Control, requirements: List[Requirement]) -> str:
+        """The control and requirements section; depends only on the catalog."""
+        block = f"""
+CONTROL UNDER ASSESSMENT: "{control.code}: {control.title}"
 
-7. Require EXPLICIT, DETAILED evidence. Generic statements or vague references should receive very low scores.
+CONTROL DESCRIPTION:
+{control.description}
 
-You must respond with valid JSON only, following this exact schema:
-{
-  "requirements": [
-    {
-      "requirement_id": "string (use the UUID Requirement ID provided above)",
-      "outcome": "PASS|PARTIAL|FAIL|NOT_FOUND", 
-      "confidence": 0.0-1.0,
-      "rationale": "string explanation",
-      "citations": [{"document_id": "string", "document_name": "string", "page_num": 1, "quote": "string max 30 words"}]
-    }
-  ],
-  "gaps": [
-    {
-      "requirement_id": "string",
-      "summary": "string describing what is missing", 
-      "recommended_actions": [{"title": "string", "detail": "string", "priority": "HIGH|MEDIUM|LOW"}]
-    }
-  ]
-}
+REQUIREMENTS TO EVALUATE:
 """
-        
-        return prompt
-
-    def _call_ollama(self, client_config: Dict, prompt: str, org_id=None) -> ScanResponse:
-        """Call Ollama API and parse response."""
-        import requests
-        import json
-
+        for req in sorted(requirements, key=lambda r: (r.req_code or "", str(r.id))):
+            block += f"\nRequirement ID: {req.id}"
+            block += f"\n{req.req_code}: {req.text}"
+            if req.guidance:
+                block += f"\n  Guidance: {req.guidance}"
+            block += f"\n  Maturity Level: {req.maturity_level}"
+            block += "\n"
+        return block
+
+    @llm_call_site("scan")
+    def _call_ollama(self, client_config: Dict, prompt: str, org_id=None,
+                     on_requirement: Optional[Callable[[RequirementResult], None]] = None) -> ScanResponse:
+        """Call Ollama API and parse response, streaming requirements to on_requirement when enabled."""
         endpoint = client_config['endpoint']
         model = client_config['model']
 
         # Get context size from this org's settings (env fallback when no org)
-        if org_id is not None:
-            db = SessionLocal()
-            try:
-                settings = get_or_create_settings(db, org_id)
-                context_size = settings.ollama_context_size or 131072
-            finally:
-                db.close()
+        if client_config.get('context_size'):
+            context_size = client_config['context_size']
+        elif org_id is not None:
+            context_size = settings_cache.get(org_id).ollama_context_size or 131072
         else:
             context_size = int(os.getenv("OLLAMA_CONTEXT_SIZE", "131072"))
         
-        # Add JSON schema instruction to prompt
-        json_prompt = prompt + """
-
-You must respond with valid JSON only, following this exact schema:
-{
-  "requirements": [
-    {
-      "requirement_id": "string",
-      "outcome": "PASS|PARTIAL|FAIL|NOT_FOUND", 
-      "confidence": 0.0-1.0,
-      "rationale": "string explanation",
-      "citations": [{"document_id": "string", "document_name": "string", "page_num": 1, "quote": "string"}]
-    }
-  ],
-  "gaps": [
-    {
-      "requirement_id": "string",
-      "summary": "string", 
-      "recommended_actions": [{"title": "string", "detail": "string", "priority": "HIGH|MEDIUM|LOW"}]
-    }
-  ]
-}
-
-Respond only with valid JSON. No additional text."""
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": False,
+            "format": ollama_format(SCAN_RESPONSE_SCHEMA),
+            "options": {
+                "temperature": 0.1,
+                "top_p": 0.9,
+                "num_ctx": context_size  # Use context size from database settings
+            }
+        }
 
         try:
-            response = requests.post(
-                f"{endpoint}/api/generate",
-                json={
-                    "model": model,
-                    "prompt": json_prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.1,
-                        "top_p": 0.9,
-                        "num_ctx": context_size  # Use context size from database settings
-                    }
-                },
-                timeout=300  # 5 minutes timeout for large models
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
-            
-            result = response.json()
+            parser = None
+            if OLLAMA_STREAMING:
+                # Emit each requirement as soon as its JSON object is complete
+                def emit(item: Dict[str, Any]):
+                    try:
+                        req_result = RequirementResult(**item)
+                    except Exception as e:
+                        logger.warning(f"Skipping invalid streamed requirement: {e}")
+                        return
+                    if on_requirement:
+                        on_requirement(req_result)
+
+                parser = IncrementalArrayParser("requirements", on_item=emit)
+                result, complete = stream_ollama_generate(
+                    endpoint,
+                    payload,
+                    parser.feed,
+                    timeout=300,  # Per-read timeout; covers model load before the first token
+                    deadline_seconds=OLLAMA_STREAM_DEADLINE_SECONDS,
+                    org_id=org_id,
+                    validate=_valid_scan_reply
+                )
+                if not complete:
+                    logger.warning(f"Ollama stream incomplete; {len(parser.items)} requirements received before cut-off")
+            else:
+                response = cached_ollama_generate(
+                    endpoint,
+                    payload,
+                    timeout=300,  # 5 minutes timeout for large models
+                    org_id=org_id,
+                    validate=_valid_scan_reply
+                )
+                
+                if response.status_code != 200:
+                    raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
+                
+                result = response.json()
             response_text = result.get('response', '').strip()
             
-            # Try to parse JSON response
+            # Schema-constrained output is normally bare JSON; recover it from prose otherwise
+            json_data = extract_json(response_text, required_keys=("requirements",))
             try:
-                json_data = json.loads(response_text)
+                if json_data is None:
+                    raise ValueError("no JSON object in response")
                 return ScanResponse(**json_data)
-            except json.JSONDecodeError:
+            except ValueError:
+                if parser is not None and parser.items:
+                    # Truncated stream: keep the requirements that did complete
+                    logger.warning(f"Ollama response incomplete; keeping {len(parser.items)} streamed requirements")
+                    partial = []
+                    for item in parser.items:
+                        try:
+                            partial.append(RequirementResult(**item))
+                        except Exception:
+                            continue
+                    return ScanResponse(requirements=partial, gaps=[])
+
                 # If JSON parsing fails, create a fallback response
                 logger.warning(f"Failed to parse Ollama JSON response: {response_text[:200]}...")
                 return ScanResponse(
@@ -0,0 +1,148 @@
+"""
+Micro-benchmark: recovering the JSON answer from model replies.
+
+Compares llm_json.extract_json with the regex-based extractor it replaced
+(reproduced below as legacy_extract_json) on replies shaped like thinking-model
+output: long reasoning prose with stray braces and quotes, followed by the
+answer object. Timings are the best of --repeat runs; the last column says
+whether each extractor returned the actual answer.
+
+Run from apps/api:
+    python benchmarks/bench_json_extraction.py [--reasoning-kb 64] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_json import extract_json  # noqa: E402
+
+
+def legacy_extract_json(response_text):
+    """The multi-pass regex extractor previously in main.py, minus logging."""
+    if not response_text:
+        return None
+    response_text = response_text.strip()
+    try:
+        parsed = json.loads(response_text)
+        if isinstance(parsed, dict):
+            return parsed
+    except json.JSONDecodeError:
+        pass
+
+    json_patterns = [
+        r'\{[^{}]*"document_type"[^{}]*\}',
+        r'\{[^{}]*"selected_control_number"[^{}]*\}',
+        r'\{[^{}]*"suggestions"[^{}]*\[[^\]]*\][^{}]*\}',
+        r'\{.*?"suggestions".*?\[.*?\].*?\}',
+        r'\{[\s\S]*?\}',
+    ]
+    for pattern in json_patterns:
+        for match in re.findall(pattern, response_text, re.DOTALL):
+            try:
+                parsed = json.loads(match.strip())
+                if isinstance(parsed, dict):
+                    return parsed
+            except json.JSONDecodeError:
+                continue
+
+    for pattern in (r'```json\s*(\{.*?\})\s*```', r'```\s*(\{.*?\})\s*```'):
+        for match in re.findall(pattern, response_text, re.DOTALL):
+            try:
+                parsed = json.loads(match.strip())
+                if isinstance(parsed, dict):
+                    return parsed
+            except json.JSONDecodeError:
+                continue
+
+    try:
+        return json.loads(response_text)
+    except json.JSONDecodeError:
+        pass
+    try:
+        start = response_text.find('{')
+        end = response_text.rfind('}')
+        if start >= 0 and end > start:
+            return json.loads(response_text[start:end + 1])
+    except (json.JSONDecodeError, ValueError):
+        pass
+    return None
+
+
+SUGGESTIONS = {
+    "suggestions": [
+        {
+            "control_code": f"EE-{i}",
+            "control_title": f"Control {i}",
+            "framework_name": "Essential Eight",
+            "confidence": 0.8,
+            "reasoning": "Policy states \"MFA is enforced\" for {all} remote access.",
+        }
+        for i in range(1, 6)
+    ]
+}
+
+VALIDATION = {
+    "outcome": "PARTIAL",
+    "confidence": 0.55,
+    "rationale": "MFA covers remote access but not privileged users.",
+    "findings": ["Remote access requires MFA"],
+    "recommendations": ["Extend MFA to privileged accounts"],
+}
+
+REASONING_LINE = (
+    'Looking at the document, the "MFA policy" section mentions {remote access} and the '
+    "admin's note lists {VPN, email. We need to map it carefully.\n"
+)
+EXAMPLE_LINE = 'The expected shape is {"outcome": "PASS", "confidence": 1.0} but check first.\n'
+
+
+def make_cases(reasoning_kb: int):
+    """name -> (reply text, the answer object extract_json should return)."""
+    suggestions = json.dumps(SUGGESTIONS, indent=2)
+    validation = json.dumps(VALIDATION, indent=2)
+    reasoning = REASONING_LINE * max(1, (reasoning_kb * 1024) // len(REASONING_LINE))
+    unbalanced = ("Considering option {A and option {B without closing them. " * 2000)[: reasoning_kb * 1024]
+    return {
+        "bare JSON": (suggestions, SUGGESTIONS),
+        "fenced JSON": (f"Here is the result:\n```json\n{suggestions}\n```\n", SUGGESTIONS),
+        "reasoning + suggestions": (f"<think>\n{reasoning}</think>\n{suggestions}", SUGGESTIONS),
+        "reasoning + validation": (f"<think>\n{reasoning}</think>\n{validation}", VALIDATION),
+        "unbalanced + validation": (f"{unbalanced}\n{validation}", VALIDATION),
+        "example + validation": (f"{EXAMPLE_LINE}{reasoning}\n{validation}", VALIDATION),
+        # A brace after the answer defeats the last-object fast path and forces the full scan
+        "validation + trailing note": (f"{reasoning}\n{validation}\nNote: confidence is in {{0..1}}.", VALIDATION),
+    }
+
+
+def bench(fn, text, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(text)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reasoning-kb", type=int, default=64, help="size of the reasoning prose (KiB)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case; the best time is reported")
+    args = parser.parse_args()
+
+    print(f"{'case':<26} {'size':>9} {'legacy ms':>11} {'new ms':>9} {'speedup':>8}  correct (legacy/new)")
+    for name, (text, expected) in make_cases(args.reasoning_kb).items():
+        legacy_time, legacy_result = bench(legacy_extract_json, text, args.repeat)
+        new_time, new_result = bench(extract_json, text, args.repeat)
+        speedup = legacy_time / new_time if new_time else float("inf")
+        print(f"{name:<26} {len(text):>9} {legacy_time * 1000:>11.2f} {new_time * 1000:>9.2f} {speedup:>7.1f}x"
+              f"  {legacy_result == expected}/{new_result == expected}")
+
+
+if __name__ == "__main__":
+    main()
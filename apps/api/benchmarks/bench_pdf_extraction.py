@@ -0,0 +1,80 @@
+"""
+Benchmark: serial vs process-pool PDF text extraction.
+
+Builds a synthetic policy PDF (--pages pages of numbered sections, default
+500) with PyMuPDF and extracts it with TextExtractor serially and with the
+page-range process pool at each --workers size. The first parallel run of a
+pool size includes starting its processes and is reported separately.
+Every run is checked against the serial output.
+
+Run from apps/api:
+    python benchmarks/bench_pdf_extraction.py [--pages 500] [--workers 2 4 8] [--pages-per-task 25]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # noqa: E402
+
+from text_extraction import TextExtractor  # noqa: E402
+
+PARAGRAPH = (
+    "{section}.{n} Privileged accounts are reviewed every quarter by the system owner. Accounts that "
+    "have not been used for 45 days are disabled automatically, and multi-factor authentication is "
+    "enforced for all remote and privileged access to corporate systems and data repositories."
+)
+
+
+def make_pdf(pages: int) -> bytes:
+    doc = fitz.open()
+    for page_num in range(1, pages + 1):
+        page = doc.new_page()
+        text = f"Access Control Policy - Section {page_num}\n\n" + "\n\n".join(
+            PARAGRAPH.format(section=page_num, n=n) for n in range(1, 7)
+        )
+        page.insert_textbox(fitz.Rect(56, 56, 540, 790), text, fontsize=10)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def timed(extractor, data):
+    """(seconds, pages without their per-page timings, which differ run to run)."""
+    started = time.perf_counter()
+    pages = extractor.extract_text(data, "synthetic.pdf", "application/pdf")
+    elapsed = time.perf_counter() - started
+    return elapsed, [{k: v for k, v in page.items() if k != "seconds"} for page in pages]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=500, help="pages in the synthetic PDF")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8], help="pool sizes to compare")
+    parser.add_argument("--pages-per-task", type=int, default=25, help="pages per pool task")
+    parser.add_argument("--repeat", type=int, default=2, help="warm runs per configuration; the best is reported")
+    args = parser.parse_args()
+
+    data = make_pdf(args.pages)
+    print(f"{args.pages}-page PDF, {len(data) / 1024:.0f} KiB, {os.cpu_count()} CPUs")
+
+    serial_time, expected = timed(TextExtractor(workers=1), data)
+    print(f"{'configuration':<22} {'cold s':>8} {'warm s':>8} {'speedup':>8}  pages ok")
+    print(f"{'serial':<22} {'':>8} {serial_time:>8.2f} {1.0:>7.1f}x  {len(expected)}")
+
+    for workers in args.workers:
+        extractor = TextExtractor(parallel_min_pages=1, workers=workers, pages_per_task=args.pages_per_task)
+        cold_time, pages = timed(extractor, data)
+        ok = pages == expected
+        warm_time = float("inf")
+        for _ in range(args.repeat):
+            elapsed, pages = timed(extractor, data)
+            warm_time = min(warm_time, elapsed)
+            ok = ok and pages == expected
+        print(f"{f'pool x{workers}':<22} {cold_time:>8.2f} {warm_time:>8.2f} {serial_time / warm_time:>7.1f}x  {ok}")
+
+
+if __name__ == "__main__":
+    main()
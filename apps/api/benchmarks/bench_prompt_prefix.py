@@ -0,0 +1,267 @@
+"""
+Benchmark: Ollama prompt evaluation with the prefix-first scan prompt.
+
+Ollama keeps the KV cache of the last prompt for as long as the model stays
+loaded and only evaluates the part of a new prompt after the longest prefix
+it shares with that one. This sends a fan-out scan (one request per
+requirement, each with its own evidence, for a few controls) built with the
+previous prompt layout (reproduced below as legacy_scan_prompt: control and
+requirement, evidence, then instructions and a second copy of the schema)
+and with ComplianceScanner._build_scan_prompt, and totals the
+prompt_eval_count / prompt_eval_duration Ollama reports.
+
+By default the requests go to a stand-in server that models the prefix cache
+at --prompt-tps tokens per second, with whitespace-separated words as
+tokens; --endpoint points the benchmark at a real Ollama instead.
+
+Run from apps/api:
+    python benchmarks/bench_prompt_prefix.py [--controls 3] [--requirements 6] [--endpoint URL --model NAME]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_clients import ollama_post  # noqa: E402
+from ai_scanner import ComplianceScanner  # noqa: E402
+
+_TOKEN_RE = re.compile(r"\S+")
+
+LEGACY_INSTRUCTIONS = """
+ANALYSIS INSTRUCTIONS:
+
+1. For each requirement, analyze the evidence and determine:
+   - OUTCOME: PASS (fully satisfies), PARTIAL (partially satisfies), FAIL (contradicts), or NOT_FOUND (no evidence)
+   - CONFIDENCE: 0.0 to 1.0 based on strength and clarity of evidence
+   - RATIONALE: Clear explanation of your assessment
+   - CITATIONS: Direct quotes from evidence (max 30 words each)
+
+2. For any requirement that is PARTIAL, FAIL, or NOT_FOUND, identify gaps and recommend specific actions.
+
+3. BE EXTREMELY STRICT with confidence scores. Use the following guidelines:
+   - 0.9-1.0: Only for PERFECT, unambiguous, comprehensive evidence with explicit policy statements
+   - 0.7-0.8: Strong evidence with clear documentation and multiple supporting sources
+   - 0.5-0.6: Weak or partial evidence, screenshots without context, or ambiguous documentation
+   - 0.3-0.4: Minimal evidence, uncertain relevance, or requires significant interpretation
+   - 0.0-0.2: No clear evidence or highly questionable relevance
+
+4. Screenshots alone should receive LOW confidence (0.3-0.5) unless they clearly show comprehensive compliance
+   with context and supporting documentation.
+
+5. Be HIGHLY CRITICAL: If evidence is unclear, incomplete, ambiguous, or requires assumptions, assign LOW confidence.
+
+6. Never hallucinate - only cite evidence that actually exists in the provided documents.
+
+7. Require EXPLICIT, DETAILED evidence. Generic statements or vague references should receive very low scores.
+
+You must respond with valid JSON only, following this exact schema:
+{
+  "requirements": [
+    {
+      "requirement_id": "string (use the UUID Requirement ID provided above)",
+      "outcome": "PASS|PARTIAL|FAIL|NOT_FOUND",
+      "confidence": 0.0-1.0,
+      "rationale": "string explanation",
+      "citations": [{"document_id": "string", "document_name": "string", "page_num": 1, "quote": "string max 30 words"}]
+    }
+  ],
+  "gaps": [
+    {
+      "requirement_id": "string",
+      "summary": "string describing what is missing",
+      "recommended_actions": [{"title": "string", "detail": "string", "priority": "HIGH|MEDIUM|LOW"}]
+    }
+  ]
+}
+"""
+
+LEGACY_OLLAMA_SUFFIX = """
+
+You must respond with valid JSON only, following this exact schema:
+{
+  "requirements": [
+    {
+      "requirement_id": "string",
+      "outcome": "PASS|PARTIAL|FAIL|NOT_FOUND",
+      "confidence": 0.0-1.0,
+      "rationale": "string explanation",
+      "citations": [{"document_id": "string", "document_name": "string", "page_num": 1, "quote": "string"}]
+    }
+  ],
+  "gaps": [
+    {
+      "requirement_id": "string",
+      "summary": "string",
+      "recommended_actions": [{"title": "string", "detail": "string", "priority": "HIGH|MEDIUM|LOW"}]
+    }
+  ]
+}
+
+Respond only with valid JSON. No additional text."""
+
+
+def legacy_scan_prompt(control, requirements, evidence_texts):
+    """The scan prompt as _build_scan_prompt and _call_ollama used to assemble it (no budget trimming)."""
+    prompt = f"""
+COMPLIANCE SCANNING TASK
+
+You are analyzing evidence documents to determine compliance with the security control "{control.code}: {control.title}".
+
+CONTROL DESCRIPTION:
+{control.description}
+
+REQUIREMENTS TO EVALUATE:
+"""
+    for req in requirements:
+        prompt += f"\nRequirement ID: {req.id}"
+        prompt += f"\n{req.req_code}: {req.text}"
+        if req.guidance:
+            prompt += f"\n  Guidance: {req.guidance}"
+        prompt += f"\n  Maturity Level: {req.maturity_level}"
+        prompt += "\n"
+    prompt += "\nEVIDENCE DOCUMENTS:\n"
+    for i, ev in enumerate(evidence_texts):
+        prompt += f"\nDocument {i+1}: {ev['document_name']} (Page {ev['page_num']})\nContent: {ev['text']}\n"
+    return prompt + LEGACY_INSTRUCTIONS + LEGACY_OLLAMA_SUFFIX
+
+
+def make_workload(n_controls, n_requirements, evidence_words):
+    """[(control, requirement, evidence)] in the order a fan-out scan sends them."""
+    filler = ("Access to privileged accounts is reviewed quarterly and multi-factor authentication "
+              "is enforced for remote access to corporate systems. ").split()
+    work = []
+    for c in range(n_controls):
+        control = SimpleNamespace(
+            code=f"ML{c + 1}-AC",
+            title=f"Restrict administrative privileges ({c + 1})",
+            description="Requests for privileged access to systems and applications are validated when "
+                        "first requested, and privileged accounts are prevented from accessing the internet.",
+        )
+        for r in range(n_requirements):
+            req = SimpleNamespace(
+                id=uuid.UUID(int=c * 1000 + r), req_code=f"{control.code}-{r + 1:02d}",
+                text=f"Privileged access requirement {r + 1}: accounts are reviewed and disabled after 45 days.",
+                guidance="Check account review records and automated disablement.", maturity_level=(r % 3) + 1,
+            )
+            evidence = [
+                {"document_name": f"policy-{c}-{r}-{d}.pdf", "page_num": d + 1,
+                 "text": " ".join(filler[(i + r + d) % len(filler)] for i in range(evidence_words))}
+                for d in range(3)
+            ]
+            work.append((control, req, evidence))
+    return work
+
+
+class StandInOllama(BaseHTTPRequestHandler):
+    """Minimal /api/generate that models Ollama's single-slot prompt cache."""
+
+    lock = threading.Lock()
+    cached = {}  # model -> (tokens of the last prompt, unload deadline)
+    prompt_tps = 2000.0
+    load_seconds = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        model = body.get("model", "")
+        tokens = _TOKEN_RE.findall(body.get("prompt", ""))
+        keep_alive = body.get("keep_alive", "5m")
+        seconds = {"s": 1, "m": 60, "h": 3600}.get(str(keep_alive)[-1:], 1)
+        keep_seconds = float(str(keep_alive).rstrip("smh") or 0) * seconds
+
+        with self.lock:
+            previous, deadline = self.cached.get(model, ([], 0.0))
+            now = time.monotonic()
+            load = 0.0
+            if now > deadline:
+                previous, load = [], self.load_seconds
+            shared = 0
+            for a, b in zip(previous, tokens):
+                if a != b:
+                    break
+                shared += 1
+            evaluated = len(tokens) - shared
+            eval_seconds = evaluated / self.prompt_tps
+            time.sleep(load + eval_seconds)
+            self.cached[model] = (tokens, now + keep_seconds)
+
+        reply = json.dumps({
+            "model": model, "done": True, "response": '{"requirements": [], "gaps": []}',
+            "load_duration": int(load * 1e9), "prompt_eval_count": evaluated,
+            "prompt_eval_duration": int(eval_seconds * 1e9), "eval_count": 8, "eval_duration": 1000000,
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+
+def run(endpoint, model, prompts):
+    """Send prompts in order; totals of (prompt tokens evaluated, eval seconds, wall seconds)."""
+    evaluated = eval_seconds = 0
+    started = time.perf_counter()
+    for prompt in prompts:
+        response = ollama_post(endpoint, "/api/generate", {
+            "model": model, "prompt": prompt, "stream": False,
+            "options": {"temperature": 0.1, "num_predict": 8},
+        }, timeout=600)
+        response.raise_for_status()
+        data = response.json()
+        evaluated += data.get("prompt_eval_count", 0)
+        eval_seconds += data.get("prompt_eval_duration", 0) / 1e9
+    return evaluated, eval_seconds, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--controls", type=int, default=3, help="controls scanned")
+    parser.add_argument("--requirements", type=int, default=6, help="requirements per control (one request each)")
+    parser.add_argument("--evidence-words", type=int, default=120, help="words per evidence excerpt (3 per request)")
+    parser.add_argument("--prompt-tps", type=float, default=2000.0, help="stand-in prompt evaluation speed")
+    parser.add_argument("--load-seconds", type=float, default=0.0, help="stand-in model load time after unload")
+    parser.add_argument("--endpoint", help="real Ollama endpoint instead of the stand-in")
+    parser.add_argument("--model", default="stand-in", help="model name sent with each request")
+    args = parser.parse_args()
+
+    server = None
+    endpoint = args.endpoint
+    if not endpoint:
+        StandInOllama.prompt_tps = args.prompt_tps
+        StandInOllama.load_seconds = args.load_seconds
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StandInOllama)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+
+    work = make_workload(args.controls, args.requirements, args.evidence_words)
+    scanner = ComplianceScanner()
+    layouts = {
+        "legacy (evidence first)": [legacy_scan_prompt(c, [r], ev) for c, r, ev in work],
+        "prefix-first": [scanner._build_scan_prompt(c, [r], ev) for c, r, ev in work],
+    }
+
+    total_tokens = {name: sum(len(_TOKEN_RE.findall(p)) for p in prompts) for name, prompts in layouts.items()}
+    print(f"{len(work)} requests against {endpoint}")
+    print(f"{'layout':<24} {'words':>11} {'evaluated':>10} {'eval s':>8} {'wall s':>8}")
+    for name, prompts in layouts.items():
+        if server:
+            StandInOllama.cached.clear()
+        evaluated, eval_seconds, wall = run(endpoint, args.model, prompts)
+        print(f"{name:<24} {total_tokens[name]:>11} {evaluated:>10} {eval_seconds:>8.2f} {wall:>8.2f}")
+
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Benchmark: document analysis and scan throughput against the fake provider.
+
+Runs the real Celery task bodies (process_document_ai_analysis, then
+process_scan) in-process on a thread pool, with an organisation's AI
+settings pointed at benchmarks/fake_llm_server.py, and reports
+documents/min, scans/min and p50/p95 task latency. The org's settings are
+restored afterwards.
+
+Needs the same DATABASE_URL / MinIO / Redis environment as the worker, an
+org with uploaded documents, and evidence linked to some controls. Tasks
+write their usual results (document-control links, scans), so point it at
+a scratch database. Repeated identical prompts are answered by the LLM
+response cache; set LLM_CACHE_ENABLED=false to send every call to the fake.
+
+Fake server options (--latency, --tps, --error-rate, --replay, ...) are
+passed through to an in-process fake; --fake-url uses one already running.
+
+Run from apps/api:
+    python benchmarks/bench_throughput.py --org-id ORG [--provider ollama] [--documents 20] [--scans 20]
+        [--concurrency 4] [--fake-url http://127.0.0.1:11435] [fake server options]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from database import SessionLocal  # noqa: E402
+from llm_metrics import llm_metrics  # noqa: E402
+from models import Control, Document, DocumentControlLink, EvidenceLink, Scan, Settings  # noqa: E402
+from settings_cache import settings_cache  # noqa: E402
+from worker_tasks import process_document_ai_analysis, process_scan  # noqa: E402
+
+import fake_llm_server  # noqa: E402
+
+_PROVIDER_FIELDS = ("ai_provider", "ollama_endpoint", "openai_endpoint", "use_dual_vision_validation")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def point_org_at(org_id, provider: str, base_url: str):
+    """Switch the org to the fake provider; returns the previous values of the changed fields."""
+    db = SessionLocal()
+    try:
+        settings = db.query(Settings).filter(Settings.org_id == org_id).first()
+        if settings is None:
+            sys.exit(f"No settings row for org {org_id}")
+        previous = {field: getattr(settings, field) for field in _PROVIDER_FIELDS}
+        settings.ai_provider = provider
+        settings.ollama_endpoint = base_url
+        settings.openai_endpoint = f"{base_url}/v1"
+        settings.use_dual_vision_validation = False
+        db.commit()
+    finally:
+        db.close()
+    settings_cache.invalidate(org_id)
+    return previous
+
+
+def restore_org(org_id, previous) -> None:
+    db = SessionLocal()
+    try:
+        settings = db.query(Settings).filter(Settings.org_id == org_id).first()
+        for field, value in previous.items():
+            setattr(settings, field, value)
+        db.commit()
+    finally:
+        db.close()
+    settings_cache.invalidate(org_id)
+
+
+def pick_documents(org_id, limit: int) -> List[str]:
+    db = SessionLocal()
+    try:
+        documents = (db.query(Document.id).filter(Document.org_id == org_id)
+                     .order_by(Document.created_at.desc()).limit(limit).all())
+        return [str(d.id) for d in documents]
+    finally:
+        db.close()
+
+
+def create_scans(org_id, count: int) -> List[str]:
+    """Pending scans for controls with linked evidence, cycling through them until count."""
+    db = SessionLocal()
+    try:
+        manual = db.query(EvidenceLink.control_id).filter(EvidenceLink.org_id == org_id)
+        linked = (db.query(DocumentControlLink.control_id)
+                  .join(Document, DocumentControlLink.document_id == Document.id)
+                  .filter(Document.org_id == org_id))
+        control_ids = sorted({row.control_id for row in manual.union(linked).all()}, key=str)
+        if not control_ids:
+            return []
+        controls = db.query(Control).filter(Control.id.in_(control_ids)).all()
+        scans = [Scan(org_id=org_id, control_id=controls[i % len(controls)].id, status='pending')
+                 for i in range(count)]
+        db.add_all(scans)
+        db.commit()
+        return [str(s.id) for s in scans]
+    finally:
+        db.close()
+
+
+def run_tasks(name: str, items: List[str], task: Callable[[str], object],
+              concurrency: int) -> Tuple[int, List[float], float]:
+    """Run task over items; returns (failures, per-task latencies, wall seconds)."""
+    latencies: List[float] = []
+    failures = 0
+
+    def timed(item):
+        started = time.perf_counter()
+        try:
+            task(item)
+            return True, time.perf_counter() - started
+        except Exception as e:
+            print(f"  {name} {item} failed: {e}", file=sys.stderr)
+            return False, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"bench-{name}") as pool:
+        for ok, latency in pool.map(timed, items):
+            latencies.append(latency)
+            failures += 0 if ok else 1
+    return failures, latencies, time.perf_counter() - started
+
+
+def report(name: str, count: int, failures: int, latencies: List[float], wall: float) -> None:
+    per_minute = (count - failures) / wall * 60 if wall else 0.0
+    print(f"{name:<10} {count:>6} {failures:>6} {per_minute:>9.1f} {percentile(latencies, 50):>8.2f} "
+          f"{percentile(latencies, 95):>8.2f} {wall:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--org-id", required=True, help="org whose documents and controls are used")
+    parser.add_argument("--provider", choices=["ollama", "openai"], default="ollama")
+    parser.add_argument("--documents", type=int, default=20, help="most recent documents to analyse (0 to skip)")
+    parser.add_argument("--scans", type=int, default=20, help="scans to create and run (0 to skip)")
+    parser.add_argument("--concurrency", type=int, default=4, help="tasks run at once")
+    parser.add_argument("--fake-url", help="use a fake server that is already running")
+    args, fake_args = parser.parse_known_args()
+
+    server = None
+    base_url = args.fake_url
+    if not base_url:
+        fake_options = fake_llm_server.build_parser().parse_args(["--port", "0", *fake_args])
+        server = fake_llm_server.start_server(fake_options)
+        base_url = f"http://{fake_options.host}:{server.server_address[1]}"
+    elif fake_args:
+        parser.error(f"fake server options need an in-process fake: {' '.join(fake_args)}")
+
+    previous = point_org_at(args.org_id, args.provider, base_url)
+    try:
+        print(f"{args.provider} via {base_url}, concurrency {args.concurrency}")
+        print(f"{'task':<10} {'count':>6} {'failed':>6} {'per min':>9} {'p50 s':>8} {'p95 s':>8} {'wall s':>8}")
+        if args.documents:
+            documents = pick_documents(args.org_id, args.documents)
+            failures, latencies, wall = run_tasks(
+                "documents", documents, lambda d: process_document_ai_analysis(d, args.org_id), args.concurrency)
+            report("documents", len(documents), failures, latencies, wall)
+        if args.scans:
+            scans = create_scans(args.org_id, args.scans)
+            if not scans:
+                print("scans: no controls with linked evidence in this org")
+            else:
+                failures, latencies, wall = run_tasks("scans", scans, process_scan, args.concurrency)
+                report("scans", len(scans), failures, latencies, wall)
+    finally:
+        restore_org(args.org_id, previous)
+
+    print(f"\nLLM calls: {llm_metrics.summary()}")
+    print(f"Fake provider: {requests.get(f'{base_url}/_fake/stats', timeout=5).json()}")
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
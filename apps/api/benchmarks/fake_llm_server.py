@@ -0,0 +1,449 @@
+"""
+Fake LLM provider for offline benchmarks.
+
+Speaks enough of both provider APIs for the app to run against it:
+
+    Ollama  GET /api/tags, POST /api/generate (streamed or not)
+    OpenAI  GET /v1/models, POST /v1/chat/completions (streamed or not)
+
+Replies come from a recordings file when the request was recorded (same
+model, prompt/messages and output schema), otherwise from the first
+recording with the same output schema, otherwise they are synthesised from
+the schema the request asked for. Synthesised scan replies use the
+requirement IDs found in the prompt and mapping/suggestion replies the
+control numbers and codes, so the app stores real results.
+
+Timing and failures are configurable: a base latency distribution per
+request, prompt and generation token rates (tokens estimated at 4 chars),
+and HTTP 500 / 429 / hang / malformed-reply injection. GET /_fake/stats
+returns request counts by path and outcome.
+
+Recording: with --record FILE and --upstream-ollama / --upstream-openai,
+requests are forwarded (non-streamed) to the real provider, appended to
+FILE and replayed to the caller with the configured timing.
+
+Run from apps/api:
+    python benchmarks/fake_llm_server.py --port 11435 [--replay recordings.jsonl]
+        [--latency lognormal:0.8,0.4] [--tps 40] [--prompt-tps 1500]
+        [--error-rate 0.01] [--rate-limit-rate 0.01] [--hang-rate 0] [--malformed-rate 0]
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+import requests
+
+_REQUIREMENT_ID_RE = re.compile(r"Requirement ID: ([0-9a-fA-F-]{36})")
+_CONTROL_NUMBER_RE = re.compile(r'"number": (\d+)')
+_CONTROL_CODE_RE = re.compile(r'"code": "([^"]+)"')
+_CHARS_PER_TOKEN = 4
+_STREAM_CHUNK_CHARS = 16
+
+
+def parse_distribution(spec: str):
+    """Sampler for "fixed:S", "uniform:A,B", "normal:MEAN,SD" or "lognormal:MEDIAN,SIGMA" (seconds)."""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // _CHARS_PER_TOKEN)
+
+
+def request_key(model: str, prompt: Any, schema: Any) -> str:
+    """Recording key: model, prompt (or messages) and output schema."""
+    material = json.dumps({"model": model, "prompt": prompt, "schema": schema}, sort_keys=True, default=str)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def schema_title(schema: Any) -> Optional[str]:
+    return schema.get("title") if isinstance(schema, dict) else None
+
+
+class SchemaFaker:
+    """Minimal valid instance of a JSON schema, filled from hints in the prompt."""
+
+    def __init__(self, rng: random.Random, prompt: str):
+        self.rng = rng
+        self.requirement_ids = _REQUIREMENT_ID_RE.findall(prompt)
+        self.control_numbers = [int(n) for n in _CONTROL_NUMBER_RE.findall(prompt)]
+        self.control_codes = _CONTROL_CODE_RE.findall(prompt)
+        self.defs: Dict[str, Any] = {}
+
+    def instance(self, schema: Dict[str, Any]) -> Any:
+        self.defs = schema.get("$defs", {})
+        return self._value(schema, None)
+
+    def _resolve(self, schema: Dict[str, Any]) -> Dict[str, Any]:
+        ref = schema.get("$ref")
+        if ref:
+            return self._resolve(self.defs.get(ref.rsplit("/", 1)[-1], {}))
+        return schema
+
+    def _value(self, schema: Dict[str, Any], name: Optional[str], index: int = 0) -> Any:
+        schema = self._resolve(schema)
+        if "enum" in schema:
+            return self.rng.choice(schema["enum"])
+        kind = schema.get("type")
+        if kind == "object" or "properties" in schema:
+            return {key: self._value(sub, key, index) for key, sub in schema.get("properties", {}).items()}
+        if kind == "array":
+            items = self._resolve(schema.get("items", {}))
+            properties = items.get("properties", {})
+            if "requirement_id" in properties and self.requirement_ids:
+                count = len(self.requirement_ids)
+            elif ("number" in properties and self.control_numbers) or ("control_code" in properties and self.control_codes):
+                count = min(3, len(self.control_numbers) or len(self.control_codes))
+            else:
+                count = self.rng.randint(1, 3)
+            return [self._value(items, name, i) for i in range(count)]
+        if kind == "integer":
+            if name == "number" and self.control_numbers:
+                return self.control_numbers[index % len(self.control_numbers)]
+            return 1
+        if kind == "number":
+            return round(self.rng.uniform(0.5, 0.95), 2)
+        if kind == "boolean":
+            return True
+        if name == "requirement_id" and self.requirement_ids:
+            return self.requirement_ids[index % len(self.requirement_ids)]
+        if name == "control_code" and self.control_codes:
+            return self.control_codes[index % len(self.control_codes)]
+        return f"synthetic {name or 'value'} {index + 1}"
+
+
+class FakeProvider:
+    """Reply selection, timing and failure injection shared by all handler threads."""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.rng_lock = threading.Lock()
+        self.latency = parse_distribution(args.latency)
+        self.recordings: Dict[str, Dict[str, Any]] = {}
+        self.by_schema: Dict[str, Dict[str, Any]] = {}
+        self.record_lock = threading.Lock()
+        self.stats: Counter = Counter()
+        self.stats_lock = threading.Lock()
+        if args.replay:
+            self._load(args.replay)
+
+    def _load(self, path: str) -> None:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.recordings[entry["key"]] = entry
+                    self.by_schema.setdefault(entry.get("schema_title") or "", entry)
+        print(f"Loaded {len(self.recordings)} recordings from {path}", file=sys.stderr)
+
+    def count(self, name: str) -> None:
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def roll(self) -> float:
+        with self.rng_lock:
+            return self.rng.random()
+
+    def sample_latency(self) -> float:
+        with self.rng_lock:
+            return self.latency(self.rng)
+
+    def injected_failure(self) -> Optional[str]:
+        """The failure to inject into this request (error, rate_limited, hang, malformed), if any."""
+        roll = self.roll()
+        for outcome, rate in (("error", self.args.error_rate), ("rate_limited", self.args.rate_limit_rate),
+                              ("hang", self.args.hang_rate), ("malformed", self.args.malformed_rate)):
+            if roll < rate:
+                return outcome
+            roll -= rate
+        return None
+
+    def reply_text(self, provider: str, model: str, prompt_key: Any, prompt_text: str,
+                   schema: Any, upstream_request) -> str:
+        """The model's reply for a request: recorded, forwarded-and-recorded, or synthesised."""
+        key = request_key(model, prompt_key, schema)
+        entry = self.recordings.get(key)
+        if entry is not None:
+            self.count("replay_exact")
+            return entry["response"]
+
+        if self.args.record and upstream_request is not None:
+            text = upstream_request()
+            entry = {"key": key, "provider": provider, "model": model,
+                     "schema_title": schema_title(schema), "response": text}
+            with self.record_lock:
+                self.recordings[key] = entry
+                self.by_schema.setdefault(entry["schema_title"] or "", entry)
+                with open(self.args.record, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+            self.count("recorded")
+            return text
+
+        entry = self.by_schema.get(schema_title(schema) or "") if schema_title(schema) else None
+        if entry is not None:
+            self.count("replay_schema")
+            return entry["response"]
+
+        self.count("synthesised")
+        if isinstance(schema, dict):
+            with self.rng_lock:
+                return json.dumps(SchemaFaker(self.rng, prompt_text).instance(schema))
+        return json.dumps({"response": "synthetic reply"})
+
+    def timing(self, prompt_text: str, reply: str):
+        """(seconds before the first token, seconds per generated chunk, prompt tokens, reply tokens)."""
+        prompt_tokens = estimate_tokens(prompt_text)
+        reply_tokens = estimate_tokens(reply)
+        first_token = self.sample_latency() + prompt_tokens / self.args.prompt_tps
+        chunk_seconds = (_STREAM_CHUNK_CHARS / _CHARS_PER_TOKEN) / self.args.tps
+        return first_token, chunk_seconds, prompt_tokens, reply_tokens
+
+
+class Handler(BaseHTTPRequestHandler):
+    provider: FakeProvider = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    # -- plumbing ---------------------------------------------------------
+
+    def _json(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self) -> None:
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _body(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _fail(self, outcome: str) -> bool:
+        """Apply an injected failure; True if the request has been answered."""
+        self.provider.count(f"{self.path}:{outcome}")
+        if outcome == "error":
+            self._json(500, {"error": "injected server error"})
+        elif outcome == "rate_limited":
+            self._json(429, {"error": "injected rate limit"}, {"Retry-After": "1"})
+        elif outcome == "hang":
+            time.sleep(self.provider.args.hang_seconds)
+            self.close_connection = True
+        else:
+            return False
+        return True
+
+    # -- routes -----------------------------------------------------------
+
+    def do_GET(self):
+        models = self.provider.args.models
+        if self.path == "/api/tags":
+            self._json(200, {"models": [{"name": m, "model": m, "size": 0, "details": {}} for m in models]})
+        elif self.path == "/v1/models":
+            self._json(200, {"object": "list", "data": [{"id": m, "object": "model", "owned_by": "fake"} for m in models]})
+        elif self.path == "/_fake/stats":
+            with self.provider.stats_lock:
+                self._json(200, dict(self.provider.stats))
+        else:
+            self._json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path == "/api/generate":
+            self._ollama_generate(self._body())
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            self._openai_chat(self._body())
+        else:
+            self._json(404, {"error": f"unknown path {self.path}"})
+
+    def _ollama_generate(self, body: Dict[str, Any]) -> None:
+        provider = self.provider
+        model = body.get("model", "")
+        prompt = body.get("prompt", "")
+        schema = body.get("format")
+        failure = provider.injected_failure()
+        if failure and self._fail(failure):
+            return
+
+        def upstream():
+            forwarded = {**body, "stream": False}
+            response = requests.post(f"{provider.args.upstream_ollama}/api/generate", json=forwarded, timeout=900)
+            response.raise_for_status()
+            return response.json().get("response", "")
+
+        reply = provider.reply_text("ollama", model, prompt, prompt, schema,
+                                    upstream if provider.args.upstream_ollama else None)
+        if failure == "malformed":
+            reply = "I could not produce JSON for this request " + reply[: len(reply) // 2]
+        first_token, chunk_seconds, prompt_tokens, reply_tokens = provider.timing(prompt, reply)
+        started = time.monotonic()
+        time.sleep(first_token)
+        final = {
+            "model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"), "done": True, "done_reason": "stop",
+            "prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(prompt_tokens / provider.args.prompt_tps * 1e9),
+            "eval_count": reply_tokens, "load_duration": 0,
+        }
+
+        if body.get("stream", True):
+            self._start_stream("application/x-ndjson")
+            for i in range(0, len(reply), _STREAM_CHUNK_CHARS):
+                piece = {"model": model, "response": reply[i:i + _STREAM_CHUNK_CHARS], "done": False}
+                self._write_chunk((json.dumps(piece) + "\n").encode())
+                time.sleep(chunk_seconds)
+            final.update(response="", eval_duration=int((time.monotonic() - started - first_token) * 1e9),
+                         total_duration=int((time.monotonic() - started) * 1e9))
+            self._write_chunk((json.dumps(final) + "\n").encode())
+            self._end_stream()
+        else:
+            time.sleep(chunk_seconds * (len(reply) / _STREAM_CHUNK_CHARS))
+            final.update(response=reply, eval_duration=int((time.monotonic() - started - first_token) * 1e9),
+                         total_duration=int((time.monotonic() - started) * 1e9))
+            self._json(200, final)
+        provider.count(f"{self.path}:ok")
+
+    def _openai_chat(self, body: Dict[str, Any]) -> None:
+        provider = self.provider
+        model = body.get("model", "")
+        messages = body.get("messages", [])
+        prompt_text = "\n".join(m.get("content") if isinstance(m.get("content"), str)
+                                else json.dumps(m.get("content")) for m in messages)
+        response_format = body.get("response_format") or {}
+        schema = (response_format.get("json_schema") or {}).get("schema")
+        failure = provider.injected_failure()
+        if failure and self._fail(failure):
+            return
+
+        def upstream():
+            forwarded = {**body, "stream": False}
+            headers = {"Authorization": self.headers.get("Authorization", "")}
+            response = requests.post(f"{provider.args.upstream_openai}/chat/completions", json=forwarded,
+                                     headers=headers, timeout=900)
+            response.raise_for_status()
+            return response.json()["choices"][0]["message"]["content"] or ""
+
+        reply = provider.reply_text("openai", model, messages, prompt_text, schema,
+                                    upstream if provider.args.upstream_openai else None)
+        if failure == "malformed":
+            reply = "I could not produce JSON for this request " + reply[: len(reply) // 2]
+        first_token, chunk_seconds, prompt_tokens, reply_tokens = provider.timing(prompt_text, reply)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": reply_tokens,
+                 "total_tokens": prompt_tokens + reply_tokens}
+        time.sleep(first_token)
+
+        if body.get("stream"):
+            self._start_stream("text/event-stream")
+            for i in range(0, len(reply), _STREAM_CHUNK_CHARS):
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": reply[i:i + _STREAM_CHUNK_CHARS]},
+                                      "finish_reason": None}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                time.sleep(chunk_seconds)
+            last = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+            self._write_chunk(f"data: {json.dumps(last)}\n\n".encode())
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._end_stream()
+        else:
+            time.sleep(chunk_seconds * (len(reply) / _STREAM_CHUNK_CHARS))
+            self._json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+        provider.count(f"{self.path}:ok")
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping pooled keep-alive connections is routine here
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--models", nargs="+", default=["qwen2.5:14b", "qwen2-vl", "gpt-4o-mini", "gpt-4o"],
+                        help="models listed by /api/tags and /v1/models")
+    parser.add_argument("--replay", help="recordings (JSONL) to answer from")
+    parser.add_argument("--record", help="append forwarded requests and replies to this JSONL file")
+    parser.add_argument("--upstream-ollama", help="real Ollama to forward unrecorded requests to (with --record)")
+    parser.add_argument("--upstream-openai", help="real OpenAI base URL, e.g. https://api.openai.com/v1 (with --record)")
+    parser.add_argument("--latency", default="lognormal:0.5,0.4", help="base latency per request (see parse_distribution)")
+    parser.add_argument("--prompt-tps", type=float, default=1500.0, help="prompt tokens evaluated per second")
+    parser.add_argument("--tps", type=float, default=40.0, help="reply tokens generated per second")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share answered with HTTP 429")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="share that hang for --hang-seconds, then drop")
+    parser.add_argument("--hang-seconds", type=float, default=120.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share answered with broken JSON")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser
+
+
+def start_server(args) -> ThreadingHTTPServer:
+    """Start the fake provider on a daemon thread; the bound port is server.server_address[1]."""
+    handler = type("FakeLLMHandler", (Handler,), {"provider": FakeProvider(args)})
+    server = FakeLLMServer((args.host, args.port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-llm").start()
+    return server
+
+
+def main():
+    args = build_parser().parse_args()
+    if args.record and not (args.upstream_ollama or args.upstream_openai):
+        sys.exit("--record needs --upstream-ollama and/or --upstream-openai")
+    server = start_server(args)
+    print(f"Fake LLM provider on http://{args.host}:{server.server_address[1]} "
+          f"(Ollama: /api/*, OpenAI base URL: /v1)", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
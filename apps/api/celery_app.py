@@ -29,13 +29,14 @@ celery_app.conf.update(
     task_routes={
         'worker_tasks.extract_document_text': {'queue': 'extraction'},
         'worker_tasks.process_scan': {'queue': 'ai_tasks'},  # AI-intensive scanning
+        'worker_tasks.process_framework_scan': {'queue': 'ai_tasks'},  # Framework-wide batch scans
         'worker_tasks.process_document_ai_analysis': {'queue': 'ai_tasks'},  # AI-intensive analysis
         'worker_tasks.cleanup_old_scans': {'queue': 'celery'},  # Lightweight tasks
     },
 
     # Define queues
     task_queues=(
-        Queue('ai_tasks', routing_key='ai_tasks'),      # AI tasks (concurrency=1)
+        Queue('ai_tasks', routing_key='ai_tasks'),      # AI tasks (ai-worker: AI_WORKER_PROCESSES, default 1)
         Queue('extraction', routing_key='extraction'),  # Text extraction
         Queue('celery', routing_key='celery'),          # Default queue
     ),
@@ -0,0 +1,323 @@
+"""
+Adaptive (AIMD) concurrency limits for AI provider endpoints.
+
+Every model call made through provider_health's guarded_* helpers first
+takes a slot from the limiter of its (provider, endpoint). Each limiter
+starts at AI_CONCURRENCY_INITIAL in-flight calls and adapts:
+
+- additive increase: each successful call while the limit is in use adds
+  1/limit, i.e. about +1 per limit's worth of calls, as long as the p95
+  latency of the recent window stays under the target and the error rate
+  under AI_CONCURRENCY_MAX_ERROR_RATE;
+- multiplicative decrease: a timeout, 429 or 503 (or an unhealthy window)
+  multiplies the limit by AI_CONCURRENCY_BACKOFF, at most once per cooldown
+  so one burst of failures doesn't collapse it to the minimum.
+
+Bounds and targets can be set per endpoint with AI_CONCURRENCY_ENDPOINTS,
+a JSON object keyed by "provider" or "provider@endpoint", e.g.
+{"ollama@http://ollama:11434": {"max": 4, "p95_target_seconds": 90}}.
+
+State is per process, like provider_health. Processes publish a snapshot to
+Redis so the API's admin endpoint can show the AI worker's limits as well.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple, cast
+
+logger = logging.getLogger(__name__)
+
+AI_CONCURRENCY_ENABLED = os.getenv("AI_CONCURRENCY_ENABLED", "true").lower() == "true"
+AI_CONCURRENCY_MIN = int(os.getenv("AI_CONCURRENCY_MIN", "1"))
+AI_CONCURRENCY_MAX = int(os.getenv("AI_CONCURRENCY_MAX", "8"))
+AI_CONCURRENCY_INITIAL = int(os.getenv("AI_CONCURRENCY_INITIAL", "2"))
+AI_CONCURRENCY_P95_TARGET_SECONDS = float(os.getenv("AI_CONCURRENCY_P95_TARGET_SECONDS", "60"))
+AI_CONCURRENCY_MAX_ERROR_RATE = float(os.getenv("AI_CONCURRENCY_MAX_ERROR_RATE", "0.1"))
+AI_CONCURRENCY_BACKOFF = float(os.getenv("AI_CONCURRENCY_BACKOFF", "0.5"))
+AI_CONCURRENCY_WINDOW = int(os.getenv("AI_CONCURRENCY_WINDOW", "20"))
+AI_CONCURRENCY_COOLDOWN_SECONDS = float(os.getenv("AI_CONCURRENCY_COOLDOWN_SECONDS", "10"))
+# How long a call may queue for a slot before giving up
+AI_CONCURRENCY_WAIT_SECONDS = float(os.getenv("AI_CONCURRENCY_WAIT_SECONDS", "600"))
+AI_CONCURRENCY_ENDPOINTS = os.getenv("AI_CONCURRENCY_ENDPOINTS", "")
+
+# Redis keys holding each process's published snapshot
+SNAPSHOT_KEY_PREFIX = "ai_concurrency:"
+_SNAPSHOT_TTL_SECONDS = 60
+_SNAPSHOT_INTERVAL_SECONDS = 5
+# Samples needed before latency or error rate can change the limit
+_MIN_SAMPLES = 5
+
+OK = "ok"
+ERROR = "error"
+OVERLOAD = "overload"
+
+
+class ConcurrencyLimitTimeout(Exception):
+    """Raised when no slot for an endpoint freed up within AI_CONCURRENCY_WAIT_SECONDS."""
+
+
+def _endpoint_overrides() -> Dict[str, Dict[str, Any]]:
+    if not AI_CONCURRENCY_ENDPOINTS:
+        return {}
+    try:
+        overrides = json.loads(AI_CONCURRENCY_ENDPOINTS)
+        if isinstance(overrides, dict):
+            return {str(k).rstrip("/"): v for k, v in overrides.items() if isinstance(v, dict)}
+    except json.JSONDecodeError as e:
+        logger.error(f"AI_CONCURRENCY_ENDPOINTS is not valid JSON, ignoring it: {e}")
+    return {}
+
+
+def classify_exception(exc: BaseException) -> str:
+    """OVERLOAD for timeouts and rate limits, ERROR for anything else."""
+    import requests
+
+    if isinstance(exc, requests.exceptions.Timeout):
+        return OVERLOAD
+    try:
+        import openai
+    except ImportError:
+        return ERROR
+    if isinstance(exc, (openai.APITimeoutError, openai.RateLimitError)):
+        return OVERLOAD
+    if isinstance(exc, openai.APIStatusError) and exc.status_code == 503:
+        return OVERLOAD
+    return ERROR
+
+
+def classify_status(status_code: int) -> str:
+    if status_code in (429, 503):
+        return OVERLOAD
+    return ERROR if status_code >= 500 else OK
+
+
+class AdaptiveLimiter:
+    """AIMD limit on in-flight calls to one provider endpoint."""
+
+    def __init__(self, provider: str, endpoint: str, min_limit: int = AI_CONCURRENCY_MIN,
+                 max_limit: int = AI_CONCURRENCY_MAX, initial: int = AI_CONCURRENCY_INITIAL,
+                 p95_target_seconds: float = AI_CONCURRENCY_P95_TARGET_SECONDS,
+                 max_error_rate: float = AI_CONCURRENCY_MAX_ERROR_RATE,
+                 backoff: float = AI_CONCURRENCY_BACKOFF, window: int = AI_CONCURRENCY_WINDOW,
+                 cooldown_seconds: float = AI_CONCURRENCY_COOLDOWN_SECONDS):
+        self.provider = provider
+        self.endpoint = endpoint
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.p95_target_seconds = float(p95_target_seconds)
+        self.max_error_rate = float(max_error_rate)
+        self.backoff = float(backoff)
+        self.cooldown_seconds = float(cooldown_seconds)
+        self.in_flight = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._outcomes: Deque[str] = deque(maxlen=window)
+        self._last_decrease = 0.0
+        self._stats = {"calls": 0, "errors": 0, "overloads": 0, "increases": 0, "decreases": 0, "timeouts": 0}
+
+    def acquire(self, timeout: float = AI_CONCURRENCY_WAIT_SECONDS) -> None:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.in_flight >= int(self.limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise ConcurrencyLimitTimeout(
+                            f"No {self.provider} slot at {self.endpoint or 'default'} within {timeout:.0f}s "
+                            f"(limit {int(self.limit)}, {self.in_flight} in flight)"
+                        )
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+            finally:
+                self.waiting -= 1
+
+    def release(self, latency: float, outcome: str) -> None:
+        with self._cond:
+            # Only a limit that was actually reached has proven anything about capacity
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self._stats["calls"] += 1
+            self._outcomes.append(outcome)
+            if outcome == OK:
+                self._latencies.append(latency)
+            elif outcome == OVERLOAD:
+                self._stats["overloads"] += 1
+            else:
+                self._stats["errors"] += 1
+
+            if outcome == OVERLOAD or not self._healthy():
+                self._decrease(f"{outcome}, p95 {self.p95():.1f}s, error rate {self.error_rate():.0%}")
+            elif outcome == OK and saturated and self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self._stats["increases"] += 1
+            self._cond.notify_all()
+
+    def _healthy(self) -> bool:
+        if len(self._outcomes) < _MIN_SAMPLES:
+            return True
+        if self.error_rate() > self.max_error_rate:
+            return False
+        return len(self._latencies) < _MIN_SAMPLES or self.p95() <= self.p95_target_seconds
+
+    def _decrease(self, reason: str) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown_seconds or self.limit <= self.min_limit:
+            return
+        previous = self.limit
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        self._last_decrease = now
+        self._stats["decreases"] += 1
+        logger.warning(f"AI concurrency for {self.provider} at {self.endpoint or 'default'} "
+                       f"lowered {previous:.1f} -> {self.limit:.1f} ({reason})")
+
+    def p95(self) -> float:
+        if not self._latencies:
+            return 0.0
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for o in self._outcomes if o != OK) / len(self._outcomes)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "provider": self.provider,
+                "endpoint": self.endpoint or "default",
+                "limit": int(self.limit),
+                "limit_exact": round(self.limit, 2),
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "p95_seconds": round(self.p95(), 2),
+                "p95_target_seconds": self.p95_target_seconds,
+                "error_rate": round(self.error_rate(), 3),
+                **self._stats,
+            }
+
+
+class CallSlot:
+    """Handle for one admitted call; set the outcome when the call did not raise."""
+
+    def __init__(self):
+        self.outcome = OK
+
+    def report_status(self, status_code: int) -> None:
+        self.outcome = classify_status(status_code)
+
+
+class ConcurrencyRegistry:
+    """Per-process AdaptiveLimiter registry keyed by (provider, endpoint)."""
+
+    def __init__(self, redis_url: Optional[str] = None):
+        self.redis_url = redis_url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self._lock = threading.Lock()
+        self._limiters: Dict[Tuple[str, str], AdaptiveLimiter] = {}
+        self._overrides = _endpoint_overrides()
+        self._last_published = 0.0
+
+    def limiter(self, provider: str, endpoint: Optional[str]) -> AdaptiveLimiter:
+        key = (provider, (endpoint or "").rstrip("/"))
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                config = {**self._overrides.get(provider, {}), **self._overrides.get(f"{key[0]}@{key[1]}", {})}
+                limiter = self._limiters[key] = AdaptiveLimiter(
+                    *key,
+                    min_limit=config.get("min", AI_CONCURRENCY_MIN),
+                    max_limit=config.get("max", AI_CONCURRENCY_MAX),
+                    initial=config.get("initial", AI_CONCURRENCY_INITIAL),
+                    p95_target_seconds=config.get("p95_target_seconds", AI_CONCURRENCY_P95_TARGET_SECONDS),
+                    max_error_rate=config.get("max_error_rate", AI_CONCURRENCY_MAX_ERROR_RATE),
+                )
+            return limiter
+
+    @contextmanager
+    def slot(self, provider: str, endpoint: Optional[str]) -> Iterator[CallSlot]:
+        """
+        Hold one in-flight slot for the body of the with block.
+
+        An exception from the body is classified (timeouts and rate limits
+        count as overload); otherwise the body may report an HTTP status on
+        the yielded CallSlot.
+        """
+        if not AI_CONCURRENCY_ENABLED:
+            yield CallSlot()
+            return
+        limiter = self.limiter(provider, endpoint)
+        limiter.acquire()
+        call = CallSlot()
+        started = time.monotonic()
+        try:
+            yield call
+        except BaseException as e:
+            call.outcome = classify_exception(e)
+            raise
+        finally:
+            limiter.release(time.monotonic() - started, call.outcome)
+            self._publish()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "enabled": AI_CONCURRENCY_ENABLED,
+            "endpoints": [limiter.as_dict() for limiter in limiters],
+        }
+
+    def _publish(self) -> None:
+        """Write this process's snapshot to Redis, at most every few seconds."""
+        now = time.monotonic()
+        if now - self._last_published < _SNAPSHOT_INTERVAL_SECONDS:
+            return
+        self._last_published = now
+        try:
+            import redis
+            client = redis.Redis.from_url(self.redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            try:
+                snapshot = self.snapshot()
+                client.set(f"{SNAPSHOT_KEY_PREFIX}{snapshot['host']}:{snapshot['pid']}",
+                           json.dumps(snapshot), ex=_SNAPSHOT_TTL_SECONDS)
+            finally:
+                client.close()
+        except Exception as e:
+            logger.debug(f"AI concurrency: failed to publish snapshot: {e}")
+
+    def published_snapshots(self) -> List[Dict[str, Any]]:
+        """Snapshots published by every process (API and workers) within the last minute."""
+        import redis
+
+        client = redis.Redis.from_url(self.redis_url, socket_timeout=1, socket_connect_timeout=1)
+        try:
+            keys = list(client.scan_iter(match=f"{SNAPSHOT_KEY_PREFIX}*", count=100))
+            values = cast(List[Optional[bytes]], client.mget(keys)) if keys else []
+            return [json.loads(value) for value in values if value]
+        finally:
+            client.close()
+
+    def _reset_after_fork(self) -> None:
+        # Limits are per process; a forked worker starts from the initial values
+        self._lock = threading.Lock()
+        self._limiters = {}
+        self._last_published = 0.0
+
+
+# Global registry instance
+ai_concurrency = ConcurrencyRegistry()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=ai_concurrency._reset_after_fork)
@@ -0,0 +1,193 @@
+"""
+TF-IDF shortlist of controls for the step-2 mapping prompt.
+
+Step 2 of document analysis asks the model to pick controls from a numbered
+catalog. Rather than sending the whole catalog (or as much of its prefix as
+fits), the step-1 summary is scored against a TF-IDF index over every
+control's code, title, description and requirement text, and only the
+CONTROL_SHORTLIST_SIZE best candidates, drawn from all frameworks, go into
+the prompt.
+
+The index is built with NumPy from the controls table, at API startup and
+again whenever the catalog changes (checked with one aggregate query).
+Vectors are stored column-wise (term -> controls containing it), so scoring
+touches only the postings of the query's terms.
+"""
+import logging
+import math
+import os
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+
+from evidence_index import tokenize
+from models import Control, Requirement
+
+logger = logging.getLogger(__name__)
+
+# Controls offered to the model in the step-2 prompt
+CONTROL_SHORTLIST_SIZE = int(os.getenv("CONTROL_SHORTLIST_SIZE", "25"))
+
+
+def control_text(control: Dict[str, Any]) -> str:
+    """Text indexed for a control dict; the title counts twice as it is the most specific field."""
+    return " ".join(filter(None, [
+        control.get("code"),
+        control.get("title"),
+        control.get("title"),
+        control.get("description"),
+        control.get("requirements_text"),
+    ]))
+
+
+def summary_text(document_summary: Any) -> str:
+    """All string values of a step-1 summary, flattened into one query."""
+    if isinstance(document_summary, str):
+        return document_summary
+    if isinstance(document_summary, dict):
+        return " ".join(summary_text(v) for v in document_summary.values())
+    if isinstance(document_summary, (list, tuple)):
+        return " ".join(summary_text(v) for v in document_summary)
+    return ""
+
+
+class TfidfIndex:
+    """
+    Cosine similarity over sublinear TF-IDF vectors of a fixed list of texts.
+
+    The term-by-text matrix is kept in compressed-column form: the rows and
+    weights of term t are rows[indptr[t]:indptr[t + 1]] and data[...].
+    """
+
+    def __init__(self, texts: List[str]):
+        self.size = len(texts)
+        counts = [Counter(tokenize(text)) for text in texts]
+
+        df: Counter = Counter()
+        for tc in counts:
+            df.update(tc.keys())
+        self.vocabulary = {term: i for i, term in enumerate(sorted(df))}
+        self.idf = np.array(
+            [math.log((1 + self.size) / (1 + df[term])) + 1.0 for term in sorted(df)], dtype=np.float32
+        )
+
+        postings: List[List[Tuple[int, float]]] = [[] for _ in self.vocabulary]
+        for row, tc in enumerate(counts):
+            if not tc:
+                continue
+            terms = np.fromiter((self.vocabulary[t] for t in tc), dtype=np.int64, count=len(tc))
+            weights = (1.0 + np.log(np.fromiter(tc.values(), dtype=np.float32, count=len(tc)))) * self.idf[terms]
+            weights /= np.linalg.norm(weights)
+            for term, weight in zip(terms.tolist(), weights.tolist()):
+                postings[term].append((row, weight))
+
+        lengths = np.fromiter((len(p) for p in postings), dtype=np.int64, count=len(postings))
+        self.indptr = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        self.rows = np.fromiter((row for p in postings for row, _ in p), dtype=np.int64,
+                                count=int(self.indptr[-1]))
+        self.data = np.fromiter((w for p in postings for _, w in p), dtype=np.float32,
+                                count=int(self.indptr[-1]))
+
+    def scores(self, query: str) -> np.ndarray:
+        """Cosine similarity of the query with every text."""
+        scores = np.zeros(self.size, dtype=np.float32)
+        tc = Counter(t for t in tokenize(query) if t in self.vocabulary)
+        if not tc:
+            return scores
+        terms = np.fromiter((self.vocabulary[t] for t in tc), dtype=np.int64, count=len(tc))
+        weights = (1.0 + np.log(np.fromiter(tc.values(), dtype=np.float32, count=len(tc)))) * self.idf[terms]
+        weights /= np.linalg.norm(weights)
+        for term, weight in zip(terms.tolist(), weights.tolist()):
+            start, end = self.indptr[term], self.indptr[term + 1]
+            np.add.at(scores, self.rows[start:end], self.data[start:end] * weight)
+        return scores
+
+    def top_n(self, query: str, n: int) -> List[int]:
+        """Indices of the n best-matching texts with a non-zero score, best first."""
+        scores = self.scores(query)
+        matched = int(np.count_nonzero(scores))
+        if not matched:
+            return []
+        n = min(n, matched)
+        # Stable sort on the negated scores keeps catalog order among ties
+        return np.argsort(-scores, kind="stable")[:n].tolist()
+
+
+class ControlIndex:
+    """The control catalog used by document analysis, with its TF-IDF index."""
+
+    def __init__(self, shortlist_size: int = CONTROL_SHORTLIST_SIZE):
+        self.shortlist_size = shortlist_size
+        self._lock = threading.Lock()
+        self._signature: Optional[tuple] = None
+        self._controls: List[Dict[str, Any]] = []
+        self._index: Optional[TfidfIndex] = None
+
+    def _catalog_signature(self, db) -> tuple:
+        controls = db.query(func.count(Control.id), func.max(Control.updated_at)).one()
+        requirements = db.query(func.count(Requirement.id), func.max(Requirement.updated_at)).one()
+        return tuple(controls) + tuple(requirements)
+
+    def catalog(self, db) -> List[Dict[str, Any]]:
+        """
+        Every control as a dict (code, title, framework, description), rebuilding
+        the index first if the controls or requirements changed.
+        """
+        signature = self._catalog_signature(db)
+        with self._lock:
+            if signature == self._signature:
+                return self._controls
+
+        controls = db.query(Control).options(
+            selectinload(Control.framework), selectinload(Control.requirements)
+        ).all()
+        catalog = [
+            {
+                'code': control.code,
+                'title': control.title,
+                'framework': getattr(control.framework, 'name', None) or 'Unknown',
+                'description': control.description or '',
+                'requirements_text': " ".join(
+                    " ".join(filter(None, [req.text, req.guidance])) for req in control.requirements
+                ),
+            }
+            for control in controls
+        ]
+        index = TfidfIndex([control_text(c) for c in catalog])
+        with self._lock:
+            self._signature = signature
+            self._controls = catalog
+            self._index = index
+        logger.info(f"Control index built: {len(catalog)} controls, {len(index.vocabulary)} terms")
+        return catalog
+
+    def shortlist(self, available_controls: List[Dict[str, Any]], query: str,
+                  top_n: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        The top_n controls most similar to query, best first.
+
+        Uses the prebuilt index when available_controls is the current catalog
+        and indexes other lists on the fly. Without any lexical match the
+        catalog prefix is returned, as before shortlisting existed.
+        """
+        top_n = top_n or self.shortlist_size
+        if len(available_controls) <= top_n:
+            return available_controls
+
+        with self._lock:
+            index = self._index if available_controls is self._controls else None
+        if index is None:
+            index = TfidfIndex([control_text(c) for c in available_controls])
+
+        hits = index.top_n(query, top_n)
+        if not hits:
+            return available_controls[:top_n]
+        return [available_controls[i] for i in hits]
+
+
+# Global control index instance
+control_index = ControlIndex()
@@ -7,6 +7,7 @@ Generate a key with:
 """
 import os
 import logging
+from functools import lru_cache
 
 logger = logging.getLogger(__name__)
 
@@ -14,12 +15,18 @@ logger = logging.getLogger(__name__)
 _FERNET_PREFIX = "gAAAAA"
 
 
-def _get_fernet():
+@lru_cache(maxsize=4)
+def _fernet_for_key(key: str):
     from cryptography.fernet import Fernet
+    return Fernet(key.encode())
+
+
+def _get_fernet():
+    # Cached per key value so rotating ENCRYPTION_KEY still takes effect
     key = os.getenv("ENCRYPTION_KEY")
     if not key:
         raise RuntimeError("ENCRYPTION_KEY environment variable is not set")
-    return Fernet(key.encode() if isinstance(key, str) else key)
+    return _fernet_for_key(key)
 
 
 def encrypt_secret(value: str) -> str:
@@ -0,0 +1,77 @@
+"""
+Persisted step-1 document summaries.
+
+Two-step analysis first asks the model for a JSON summary of the document,
+then maps that summary to controls. The summary depends only on the
+document's content, the model and the summary prompt, so it is stored keyed
+by (org, sha256 of the content, model, prompt version) and reused by
+re-analysis, the AI retry loop and dual-vision validation. Bumping the
+prompt version in main.py invalidates every stored summary.
+"""
+import json
+import logging
+import uuid
+from typing import Any, Dict, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal
+from models import DocumentSummary
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentSummaryStore:
+    """Reads and writes document_summaries in short sessions of its own."""
+
+    def get(self, org_id, sha256: str, model: str, prompt_version: str) -> Optional[Dict[str, Any]]:
+        """The stored summary for this content, model and prompt version, or None."""
+        db = SessionLocal()
+        try:
+            row = (
+                db.query(DocumentSummary.summary_json)
+                .filter(
+                    DocumentSummary.org_id == org_id,
+                    DocumentSummary.sha256 == sha256,
+                    DocumentSummary.model == model,
+                    DocumentSummary.prompt_version == prompt_version,
+                )
+                .first()
+            )
+            if row is None:
+                return None
+            summary = json.loads(row.summary_json)
+            return summary if isinstance(summary, dict) else None
+        except Exception as e:
+            # A lookup failure only costs a regenerated summary
+            logger.warning(f"Document summary lookup failed for {sha256[:12]} ({model}): {e}")
+            return None
+        finally:
+            db.close()
+
+    def put(self, org_id, document_id, sha256: str, model: str, prompt_version: str,
+            summary: Dict[str, Any]) -> None:
+        """Store a summary; a concurrent writer for the same key wins."""
+        db = SessionLocal()
+        try:
+            db.add(DocumentSummary(
+                org_id=org_id,
+                document_id=uuid.UUID(str(document_id)) if document_id is not None else None,
+                sha256=sha256,
+                model=model,
+                prompt_version=prompt_version,
+                summary_json=json.dumps(summary),
+            ))
+            db.commit()
+            logger.info(f"Stored document summary for {sha256[:12]} ({model}, {prompt_version})")
+        except IntegrityError:
+            db.rollback()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Failed to store document summary for {sha256[:12]} ({model}): {e}")
+        finally:
+            db.close()
+
+
+# Global document summary store instance
+document_summaries = DocumentSummaryStore()
@@ -0,0 +1,237 @@
+"""
+Lexical (BM25) evidence retrieval for compliance scans.
+
+Document pages are split into overlapping chunks when text extraction runs and
+stored in document_chunks with their term counts. At scan time each
+requirement's text and guidance selects the top-k chunks from the documents
+linked to the control, so the prompt carries the relevant passages instead of
+every page of every document.
+"""
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, cast
+
+from sqlalchemy import insert
+
+from models import Document, DocumentChunk, DocumentPage
+from text_extraction import text_extractor
+
+logger = logging.getLogger(__name__)
+
+EVIDENCE_CHUNK_SIZE = int(os.getenv("EVIDENCE_CHUNK_SIZE", "1000"))
+EVIDENCE_CHUNK_OVERLAP = int(os.getenv("EVIDENCE_CHUNK_OVERLAP", "200"))
+# Chunks included in the prompt per requirement
+EVIDENCE_TOP_K = int(os.getenv("EVIDENCE_TOP_K", "8"))
+
+# Standard BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+_STOPWORDS = frozenset("""
+a an and are as at be been but by can for from has have if in into is it its
+may must not of on or shall should such that the their there these this to
+was were which will with within
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric terms with stopwords and single characters removed."""
+    return [t for t in _TOKEN_RE.findall((text or "").lower())
+            if len(t) > 1 and t not in _STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed set of documents given as term-count dicts."""
+
+    def __init__(self, term_counts: List[Dict[str, int]], lengths: Optional[List[int]] = None,
+                 k1: float = BM25_K1, b: float = BM25_B):
+        self.term_counts = term_counts
+        self.lengths = lengths if lengths is not None else [sum(tc.values()) for tc in term_counts]
+        self.k1 = k1
+        self.b = b
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+        df: Counter = Counter()
+        for tc in term_counts:
+            df.update(tc.keys())
+        n = len(term_counts)
+        self.idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+
+    def scores(self, query_terms: Iterable[str]) -> List[float]:
+        terms = [t for t in set(query_terms) if t in self.idf]
+        if not terms or not self.avg_length:
+            return [0.0] * len(self.term_counts)
+
+        results = []
+        for tc, length in zip(self.term_counts, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / self.avg_length)
+            score = 0.0
+            for term in terms:
+                tf = tc.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            results.append(score)
+        return results
+
+    def top_k(self, query_terms: Iterable[str], k: int) -> List[int]:
+        """Indices of the k best-scoring documents with a non-zero score, best first."""
+        scored = [(s, i) for i, s in enumerate(self.scores(query_terms)) if s > 0]
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        return [i for _, i in scored[:k]]
+
+
+class EvidenceIndex:
+    """Maintains document_chunks and selects evidence for requirements."""
+
+    def __init__(self, chunk_size: int = EVIDENCE_CHUNK_SIZE, overlap: int = EVIDENCE_CHUNK_OVERLAP,
+                 top_k: int = EVIDENCE_TOP_K):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.top_k = top_k
+
+    def index_document(self, db, document: Document, pages: List[Dict[str, Any]]) -> int:
+        """
+        Replace the chunks of one document with chunks of the given pages.
+
+        Called from extract_document_text, so the index is updated one
+        document at a time. The caller commits.
+        """
+        db.query(DocumentChunk).filter(DocumentChunk.document_id == document.id).delete(synchronize_session=False)
+        return self.index_pages(db, document, pages)
+
+    def index_pages(self, db, document: Document, pages: List[Dict[str, Any]]) -> int:
+        """
+        Add chunks for some pages of a document, leaving its other chunks alone.
+
+        Chunks never span pages, so extract_document_text indexes each batch
+        of pages as it is written. The caller commits.
+        """
+        chunks = text_extractor.chunk_pages(pages, chunk_size=self.chunk_size, overlap=self.overlap)
+        rows = []
+        for chunk in chunks:
+            counts = Counter(tokenize(chunk["text"]))
+            rows.append({
+                "org_id": document.org_id,
+                "document_id": document.id,
+                "page_num": chunk["page_num"],
+                "chunk_index": chunk["chunk_index"],
+                "text": chunk["text"],
+                "term_counts_json": json.dumps(counts),
+                "token_count": sum(counts.values()),
+            })
+        if rows:
+            db.execute(insert(DocumentChunk), rows)
+        return len(rows)
+
+    def _load_chunks(self, db, org_id, document_ids: List[Any]) -> List[DocumentChunk]:
+        chunks = (
+            db.query(DocumentChunk)
+            .filter(DocumentChunk.org_id == org_id, DocumentChunk.document_id.in_(document_ids))
+            .order_by(DocumentChunk.document_id, DocumentChunk.page_num, DocumentChunk.chunk_index)
+            .all()
+        )
+
+        # Backfill documents extracted before the chunk index existed
+        indexed = {c.document_id for c in chunks}
+        missing = [d for d in document_ids if d not in indexed]
+        if missing:
+            backfilled = 0
+            for document in db.query(Document).filter(Document.id.in_(missing), Document.org_id == org_id).all():
+                pages = [
+                    {"page_num": p.page_num, "text": p.text}
+                    for p in db.query(DocumentPage).filter(DocumentPage.document_id == document.id)
+                    .order_by(DocumentPage.page_num).all()
+                ]
+                if pages:
+                    backfilled += self.index_document(db, document, pages)
+            if backfilled:
+                db.commit()
+                logger.info(f"Backfilled {backfilled} evidence chunks for {len(missing)} documents")
+                return self._load_chunks(db, org_id, document_ids)
+
+        return chunks
+
+    def build_corpus(self, db, org_id, document_ids: List[Any]) -> "EvidenceCorpus":
+        """Load and index the chunks of the given documents once, for any number of selections."""
+        document_ids = list(dict.fromkeys(document_ids))
+        if not document_ids:
+            return EvidenceCorpus([], {})
+        chunks = self._load_chunks(db, org_id, document_ids)
+        names = dict(
+            db.query(Document.id, Document.filename).filter(Document.id.in_(document_ids)).all()
+        )
+        return EvidenceCorpus(chunks, names)
+
+    def select_evidence(self, db, org_id, document_ids: List[Any], requirements: List[Any],
+                        top_k: Optional[int] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Pick the top-k chunks per requirement from the given documents.
+
+        Returns {requirement_id: [evidence dicts]} in the shape
+        ComplianceScanner expects (document_id, document_name, page_num, text).
+        IDF is computed over the candidate documents' chunks.
+        """
+        return self.build_corpus(db, org_id, document_ids).select(requirements, top_k=top_k or self.top_k)
+
+
+class EvidenceCorpus:
+    """
+    BM25 index over a fixed set of chunks.
+
+    Holds plain values rather than ORM objects, so one corpus can be shared by
+    scans running in other threads and sessions.
+    """
+
+    def __init__(self, chunks: List[DocumentChunk], names: Dict[Any, str]):
+        self.chunks = [
+            {
+                "document_id": str(c.document_id),
+                "document_name": names.get(c.document_id, ""),
+                "page_num": c.page_num,
+                "text": c.text,
+            }
+            for c in chunks
+        ]
+        self.index = BM25Index(
+            [json.loads(c.term_counts_json) for c in chunks],
+            # token_count is NOT NULL; loaded rows hold ints, not the Column the class attribute is typed as
+            lengths=cast(List[int], [c.token_count for c in chunks]),
+        )
+        self.document_count = len({c["document_id"] for c in self.chunks})
+
+    def select(self, requirements: List[Any], document_ids: Optional[List[Any]] = None,
+               top_k: int = EVIDENCE_TOP_K) -> Dict[str, List[Dict[str, Any]]]:
+        """Top-k chunks per requirement, optionally restricted to some of the corpus's documents."""
+        allowed = None
+        if document_ids is not None:
+            allowed_ids = {str(d) for d in document_ids}
+            allowed = [i for i, c in enumerate(self.chunks) if c["document_id"] in allowed_ids]
+
+        candidates = allowed if allowed is not None else list(range(len(self.chunks)))
+        if not candidates:
+            return {str(req.id): [] for req in requirements}
+        candidate_set = set(candidates)
+
+        selected: Dict[str, List[Dict[str, Any]]] = {}
+        for req in requirements:
+            query = tokenize(" ".join(filter(None, [req.text, req.guidance])))
+            scores = self.index.scores(query)
+            hits = sorted((i for i in candidates if scores[i] > 0), key=lambda i: (-scores[i], i))[:top_k]
+            if not hits:
+                # Nothing matched lexically; still show the model the opening chunks
+                hits = sorted(candidate_set)[:top_k]
+            selected[str(req.id)] = [dict(self.chunks[i]) for i in hits]
+
+        logger.info(f"Selected evidence for {len(requirements)} requirements from {len(candidates)} chunks "
+                    f"(top_k={top_k})")
+        return selected
+
+
+# Global evidence index instance
+evidence_index = EvidenceIndex()
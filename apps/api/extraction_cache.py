@@ -0,0 +1,129 @@
+"""
+Content-addressed reuse of extraction and control-suggestion results.
+
+Documents carry the sha256 of their content (computed on upload). Once a
+document has been extracted completely, documents.extractor_version records
+the TextExtractor version that produced its pages. A later upload of the
+same bytes, in any org, copies those pages and their evidence chunks in the
+database instead of downloading and extracting the file again. Pages from
+another extractor version are never reused, so bumping EXTRACTOR_VERSION
+invalidates the cache.
+
+Control suggestions depend on the org's controls and AI settings, so they
+are only reused from a document of the same org with the same content that
+already has control links.
+"""
+import logging
+import os
+from typing import Optional
+
+from sqlalchemy import func, insert, literal, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import Document, DocumentChunk, DocumentControlLink, DocumentPage
+from text_extraction import EXTRACTOR_VERSION
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+
+
+def _utc_now():
+    """SQL for the current UTC time, matching the models' datetime.utcnow defaults."""
+    return func.timezone('UTC', func.now())
+
+
+class ExtractionCache:
+    """Finds already-processed copies of a document and copies their results; the caller commits."""
+
+    def __init__(self, enabled: bool = EXTRACTION_CACHE_ENABLED):
+        self.enabled = enabled
+
+    def find_extracted(self, db, document: Document) -> Optional[Document]:
+        """The oldest other document with this content fully extracted by the current extractor."""
+        if not self.enabled or not document.sha256:
+            return None
+        return (
+            db.query(Document)
+            .filter(
+                Document.sha256 == document.sha256,
+                Document.id != document.id,
+                Document.extractor_version == EXTRACTOR_VERSION,
+            )
+            .order_by(Document.created_at)
+            .first()
+        )
+
+    def copy_pages(self, db, source: Document, document: Document) -> int:
+        """Copy source's pages and evidence chunks to document; returns the number of pages."""
+        # INSERT ... SELECT inside the database. The model's Python defaults are left out
+        # (one uuid4 would be rendered for every row), and the columns have no server
+        # defaults on schemas built by create_all, so ids and created_at are selected per row.
+        statement = pg_insert(DocumentPage).from_select(
+            ["id", "created_at", "document_id", "page_num", "text", "extraction_engine", "ocr"],
+            select(func.gen_random_uuid(), _utc_now(), literal(document.id, DocumentPage.document_id.type),
+                   DocumentPage.page_num, DocumentPage.text, DocumentPage.extraction_engine, DocumentPage.ocr)
+            .where(DocumentPage.document_id == source.id),
+            include_defaults=False,
+        )
+        pages = db.execute(statement.on_conflict_do_update(
+            index_elements=[DocumentPage.document_id, DocumentPage.page_num],
+            set_={
+                "text": statement.excluded.text,
+                "extraction_engine": statement.excluded.extraction_engine,
+                "ocr": statement.excluded.ocr,
+            },
+        )).rowcount
+        chunks = db.execute(insert(DocumentChunk).from_select(
+            ["id", "created_at", "org_id", "document_id", "page_num", "chunk_index", "text", "term_counts_json",
+             "token_count"],
+            select(func.gen_random_uuid(), _utc_now(), literal(document.org_id, DocumentChunk.org_id.type),
+                   literal(document.id, DocumentChunk.document_id.type), DocumentChunk.page_num,
+                   DocumentChunk.chunk_index, DocumentChunk.text, DocumentChunk.term_counts_json,
+                   DocumentChunk.token_count)
+            .where(DocumentChunk.document_id == source.id),
+            include_defaults=False,
+        )).rowcount
+        logger.info(f"Reused extraction of {source.id} for {document.filename} ({document.sha256[:12]}): "
+                    f"{pages} pages, {chunks} chunks")
+        return pages
+
+    def find_suggested(self, db, document: Document) -> Optional[Document]:
+        """Another document of the same org with this content that already has control links."""
+        if not self.enabled or not document.sha256:
+            return None
+        return (
+            db.query(Document)
+            .filter(
+                Document.org_id == document.org_id,
+                Document.sha256 == document.sha256,
+                Document.id != document.id,
+                Document.control_links.any(),
+            )
+            .order_by(Document.created_at)
+            .first()
+        )
+
+    def copy_control_links(self, db, source: Document, document: Document) -> int:
+        """Copy source's control links that document does not have yet; returns how many were added."""
+        existing = {
+            row.control_id
+            for row in db.query(DocumentControlLink.control_id).filter(DocumentControlLink.document_id == document.id)
+        }
+        copied = 0
+        for link in db.query(DocumentControlLink).filter(DocumentControlLink.document_id == source.id):
+            if link.control_id in existing:
+                continue
+            db.add(DocumentControlLink(
+                document_id=document.id,
+                control_id=link.control_id,
+                confidence=link.confidence,
+                reasoning=link.reasoning,
+            ))
+            copied += 1
+        logger.info(f"Reused {copied} control link(s) of {source.id} for {document.filename}")
+        return copied
+
+
+# Global extraction cache instance
+extraction_cache = ExtractionCache()
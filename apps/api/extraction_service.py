@@ -0,0 +1,148 @@
+"""
+Document text for the API's AI paths.
+
+Upload analysis (analyze_file_content_for_controls), /analyze-document-controls
+and /ai/validate-evidence read document text through ExtractionService
+instead of parsing the bytes themselves. When the extraction worker has
+already processed the document, or any document with the same content
+(sha256), its document_pages are returned; otherwise the bytes are read by
+TextExtractor, whose per-MIME engine registry covers PDF (PyMuPDF,
+pdfplumber, OCR), DOCX, plain text, Markdown, HTML and images.
+
+Every path gets the same limit, ANALYSIS_TEXT_MAX_CHARS, which defaults to
+what pack_document lets one document take in a prompt. Pages are collected
+only up to it, so a long PDF is not extracted past the pages a prompt uses.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+from contextlib import closing
+from typing import Any, Dict, List, Optional
+
+from database import SessionLocal
+from models import Document, DocumentPage
+from prompt_packer import PROMPT_CHARS_PER_TOKEN, PROMPT_MAX_DOCUMENT_TOKENS, TRUNCATION_MARKER
+from text_extraction import EXTRACTOR_VERSION, TextExtractor, text_extractor
+
+logger = logging.getLogger(__name__)
+
+# Document text handed to AI prompts (default: what pack_document allows one document)
+ANALYSIS_TEXT_MAX_CHARS = int(os.getenv(
+    "ANALYSIS_TEXT_MAX_CHARS", str(int(PROMPT_MAX_DOCUMENT_TOKENS * PROMPT_CHARS_PER_TOKEN))
+))
+
+
+class ExtractionService:
+    """Reads document text from stored pages when possible, else with TextExtractor."""
+
+    def __init__(self, extractor: TextExtractor = text_extractor, max_chars: int = ANALYSIS_TEXT_MAX_CHARS):
+        self.extractor = extractor
+        self.max_chars = max_chars
+
+    def resolve_mime_type(self, file_content: bytes, filename: str, declared: Optional[str] = None) -> Optional[str]:
+        """
+        The MIME type whose engine should read the file, or None if none can.
+
+        The sniffed type (python-magic) wins, except that plain text defers to
+        a more specific text type from the filename (.md, .csv, .html); then
+        the declared type, then the filename's.
+        """
+        try:
+            import magic
+            sniffed = magic.from_buffer(file_content[:8192], mime=True)
+        except Exception:
+            sniffed = None
+        guessed = mimetypes.guess_type(filename or "")[0]
+        if sniffed == "text/plain" and guessed and guessed.startswith("text/") and self.extractor.supports(guessed):
+            return guessed
+        for candidate in (sniffed, declared, guessed):
+            if candidate and self.extractor.supports(candidate):
+                return candidate
+        return None
+
+    def pages(self, file_content: bytes, filename: str, mime_type: Optional[str] = None, document_id=None,
+              max_chars: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        The document's pages in order, stored ones when it has been extracted.
+
+        With max_chars, no more pages are read once that much text has been
+        collected.
+        """
+        stored = self.stored_pages(hashlib.sha256(file_content).hexdigest(), document_id, max_chars)
+        if stored is not None:
+            return stored
+
+        resolved = self.resolve_mime_type(file_content, filename, mime_type)
+        if resolved is None:
+            logger.info(f"No extraction engine for {filename} ({mime_type})")
+            return []
+        pages: List[Dict[str, Any]] = []
+        collected = 0
+        try:
+            with closing(self.extractor.iter_pages(file_content, filename, resolved)) as extracted:
+                for page in extracted:
+                    pages.append(page)
+                    collected += len(page["text"] or "")
+                    if max_chars is not None and collected >= max_chars:
+                        break
+        except Exception as e:
+            logger.warning(f"Text extraction failed for {filename}: {e}")
+        return pages
+
+    def stored_pages(self, sha256: str, document_id=None,
+                     max_chars: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Pages stored for document_id, or else for the oldest document with this content
+        extracted by the current EXTRACTOR_VERSION, if its extraction is done; None when
+        there is no such document.
+        """
+        db = SessionLocal()
+        try:
+            source = None
+            if document_id is not None:
+                source = (db.query(Document.id)
+                          .filter(Document.id == document_id, Document.extraction_status == 'done').first())
+            if source is None:
+                # Another document's pages only count if the current extractor produced them
+                source = (db.query(Document.id)
+                          .filter(Document.sha256 == sha256, Document.extraction_status == 'done',
+                                  Document.extractor_version == EXTRACTOR_VERSION)
+                          .order_by(Document.created_at).first())
+            if source is None:
+                return None
+
+            pages: List[Dict[str, Any]] = []
+            collected = 0
+            query = (db.query(DocumentPage.page_num, DocumentPage.text, DocumentPage.extraction_engine,
+                              DocumentPage.ocr)
+                     .filter(DocumentPage.document_id == source.id)
+                     .order_by(DocumentPage.page_num))
+            for row in query.yield_per(50):
+                pages.append({"page_num": row.page_num, "text": row.text or "", "engine": row.extraction_engine,
+                              "ocr": bool(row.ocr)})
+                collected += len(row.text or "")
+                if max_chars is not None and collected >= max_chars:
+                    break
+            logger.info(f"Using {len(pages)} stored pages of document {source.id} ({sha256[:12]})")
+            return pages
+        except Exception as e:
+            # Extracting the bytes again is only slower
+            logger.warning(f"Stored page lookup failed for {sha256[:12]}: {e}")
+            return None
+        finally:
+            db.close()
+
+    def text(self, file_content: bytes, filename: str, mime_type: Optional[str] = None, document_id=None,
+             max_chars: Optional[int] = None) -> str:
+        """The document's text for a prompt: pages joined, cut to max_chars (default ANALYSIS_TEXT_MAX_CHARS)."""
+        limit = self.max_chars if max_chars is None else max_chars
+        pages = self.pages(file_content, filename, mime_type, document_id=document_id, max_chars=limit)
+        text = "\n\n".join(page["text"] for page in pages if page.get("text")).strip()
+        if len(text) > limit:
+            text = text[:limit] + TRUNCATION_MARKER
+        return text
+
+
+# Global extraction service instance
+extraction_service = ExtractionService()
@@ -0,0 +1,439 @@
+"""
+Content-addressed cache for LLM responses.
+
+Responses are keyed by (org, provider, model, temperature, options, prompt hash)
+and held in an in-process LRU in front of a shared Redis tier, so identical
+prompts re-sent by the retry loop, dual-vision re-analysis or repeated scans
+are answered without another round trip to the model.
+
+Only deterministic calls are cached: temperature <= 0.1, unless the caller
+explicitly opts in (or out) with cache=True/False. Callers that parse the
+reply pass validate, so a reply they could not use is not stored and replayed
+to the retry.
+"""
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import requests
+
+from concurrency import ai_concurrency, classify_exception
+from llm_metrics import failure_kind, llm_metrics
+from provider_health import guarded_chat_completion, guarded_ollama_post, provider_health
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+LLM_CACHE_MAX_VALUE_BYTES = int(os.getenv("LLM_CACHE_MAX_VALUE_BYTES", str(1024 * 1024)))
+
+# Highest temperature treated as deterministic enough to replay
+DETERMINISTIC_TEMPERATURE = 0.1
+
+# Request fields that don't change the generated content
+_VOLATILE_OLLAMA_FIELDS = {"stream", "keep_alive"}
+
+_REDIS_RETRY_SECONDS = 30
+
+# Counters of the tally() block the current call runs in, if any
+_call_counts: contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar(
+    "llm_cache_call_counts", default=None
+)
+
+
+def is_cacheable(temperature: Optional[float], cache: Optional[bool] = None) -> bool:
+    """Explicit cache=True/False wins; otherwise only near-greedy sampling is cached."""
+    if not LLM_CACHE_ENABLED:
+        return False
+    if cache is not None:
+        return cache
+    return temperature is not None and temperature <= DETERMINISTIC_TEMPERATURE
+
+
+class LLMResponseCache:
+    """Two-tier (process LRU + Redis) response cache with TTL and size-based eviction."""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, max_bytes: int = LLM_CACHE_MAX_BYTES,
+                 ttl_seconds: int = LLM_CACHE_TTL_SECONDS, redis_url: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.redis_url = redis_url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self._lru: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_down_until = 0.0
+        self._stats = {"lru_hits": 0, "redis_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(org_id: Any, provider: str, model: str, temperature: Optional[float],
+                 options: Optional[Dict[str, Any]], prompt: Any) -> str:
+        """Build the content-addressed key; org_id namespaces it so tenants never share entries."""
+        prompt_text = prompt if isinstance(prompt, str) else json.dumps(prompt, sort_keys=True, default=str)
+        material = json.dumps({
+            "provider": provider,
+            "model": model,
+            "temperature": temperature,
+            "options": options or {},
+            "prompt_sha256": hashlib.sha256(prompt_text.encode("utf-8")).hexdigest(),
+        }, sort_keys=True, default=str)
+        digest = hashlib.sha256(material.encode("utf-8")).hexdigest()
+        return f"llm_cache:{org_id or 'system'}:{digest}"
+
+    def _get_redis(self):
+        if self._redis is not None:
+            return self._redis
+        if time.monotonic() < self._redis_down_until:
+            return None
+        try:
+            import redis
+            client = redis.Redis.from_url(self.redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            client.ping()
+            self._redis = client
+            return client
+        except Exception as e:
+            logger.warning(f"LLM cache: Redis tier unavailable ({e}); using in-process LRU only")
+            self._redis_down_until = time.monotonic() + _REDIS_RETRY_SECONDS
+            return None
+
+    def _redis_failed(self, e: Exception) -> None:
+        logger.warning(f"LLM cache: Redis error ({e}); disabling Redis tier for {_REDIS_RETRY_SECONDS}s")
+        self._redis = None
+        self._redis_down_until = time.monotonic() + _REDIS_RETRY_SECONDS
+
+    def _lru_put(self, key: str, value: str, expires_at: float) -> None:
+        with self._lock:
+            old = self._lru.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._lru[key] = (expires_at, value)
+            self._bytes += len(value)
+            while self._lru and (len(self._lru) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted) = self._lru.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._stats["evictions"] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._lru.move_to_end(key)
+                    self._count("lru_hits")
+                    return value
+                del self._lru[key]
+                self._bytes -= len(value)
+
+        client = self._get_redis()
+        if client is not None:
+            try:
+                raw = client.get(key)
+                if raw is not None:
+                    value = raw.decode("utf-8")
+                    ttl = client.ttl(key)
+                    self._lru_put(key, value, now + (ttl if ttl and ttl > 0 else self.ttl_seconds))
+                    with self._lock:
+                        self._count("redis_hits")
+                    return value
+            except Exception as e:
+                self._redis_failed(e)
+
+        with self._lock:
+            self._count("misses")
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        if len(value) > LLM_CACHE_MAX_VALUE_BYTES:
+            return
+        self._lru_put(key, value, time.time() + self.ttl_seconds)
+        with self._lock:
+            self._count("stores")
+        client = self._get_redis()
+        if client is not None:
+            try:
+                client.setex(key, self.ttl_seconds, value)
+            except Exception as e:
+                self._redis_failed(e)
+
+    def _count(self, stat: str) -> None:
+        # Called with self._lock held
+        self._stats[stat] += 1
+        counts = _call_counts.get()
+        if counts is not None:
+            counts[stat] += 1
+
+    @contextmanager
+    def tally(self) -> Iterator[Dict[str, int]]:
+        """
+        Count the lookups made inside the block, for summary(counts).
+
+        Threads started inside it are counted when they run in a copy of its
+        context (contextvars.copy_context().run).
+        """
+        counts = {"lru_hits": 0, "redis_hits": 0, "misses": 0, "stores": 0}
+        token = _call_counts.set(counts)
+        try:
+            yield counts
+        finally:
+            _call_counts.reset(token)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self._stats["lru_hits"] + self._stats["redis_hits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                **self._stats,
+                "hits": hits,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._lru),
+                "bytes": self._bytes,
+            }
+
+    def summary(self, counts: Optional[Dict[str, int]] = None) -> str:
+        """One-line hit/miss summary: of a tally() block's counts, else of the whole process."""
+        if counts is not None:
+            with self._lock:
+                s = {**counts, "hits": counts["lru_hits"] + counts["redis_hits"]}
+        else:
+            s = self.stats()
+        return f"{s['hits']} hits ({s['lru_hits']} lru, {s['redis_hits']} redis) / {s['misses']} misses"
+
+
+class CachedResponse:
+    """Minimal stand-in for a requests.Response replayed from the cache."""
+
+    status_code = 200
+
+    def __init__(self, data: Dict[str, Any]):
+        self._data = data
+        self.text = json.dumps(data)
+
+    def json(self) -> Dict[str, Any]:
+        return self._data
+
+
+def _storable(text: Optional[str], validate: Optional[Callable[[str], bool]]) -> bool:
+    """Whether a complete reply is worth caching: non-empty and accepted by the caller's validate."""
+    if not text:
+        return False
+    try:
+        return validate is None or bool(validate(text))
+    except Exception:
+        return False
+
+
+def cached_ollama_generate(endpoint: str, payload: Dict[str, Any], timeout: float,
+                           org_id: Any = None, cache: Optional[bool] = None,
+                           validate: Optional[Callable[[str], bool]] = None):
+    """
+    POST /api/generate through the response cache; returns a Response-like object.
+
+    validate(text) decides whether a reply is stored (default: any non-empty one).
+    """
+    temperature = (payload.get("options") or {}).get("temperature")
+    if payload.get("stream") or not is_cacheable(temperature, cache):
+        return guarded_ollama_post(endpoint, "/api/generate", payload, timeout=timeout, org_id=org_id)
+
+    key = _ollama_cache_key(endpoint, payload, org_id)
+    hit = llm_cache.get(key)
+    if hit is not None:
+        return CachedResponse(json.loads(hit))
+
+    response = guarded_ollama_post(endpoint, "/api/generate", payload, timeout=timeout, org_id=org_id)
+    if response.status_code == 200:
+        try:
+            data = response.json()
+            if data.get("done_reason") != "length" and _storable(data.get("response"), validate):
+                llm_cache.set(key, json.dumps(data))
+        except ValueError:
+            pass
+    return response
+
+
+def _ollama_cache_key(endpoint: str, payload: Dict[str, Any], org_id: Any) -> str:
+    request_fields = {k: v for k, v in payload.items()
+                      if k not in _VOLATILE_OLLAMA_FIELDS and k not in ("model", "prompt")}
+    return llm_cache.make_key(org_id, f"ollama:{endpoint}", payload.get("model", ""),
+                              (payload.get("options") or {}).get("temperature"),
+                              request_fields, payload.get("prompt", ""))
+
+
+def stream_ollama_generate(endpoint: str, payload: Dict[str, Any], on_text: Callable[[str], None],
+                           timeout: float, deadline_seconds: Optional[float] = None,
+                           org_id: Any = None, cache: Optional[bool] = None,
+                           validate: Optional[Callable[[str], bool]] = None) -> Tuple[Dict[str, Any], bool]:
+    """
+    Stream /api/generate, passing each piece of generated text to on_text.
+
+    Returns (result, complete): result has the accumulated "response" plus the
+    final chunk's metadata. complete is False when the deadline passed or the
+    stream broke off, in which case the partial text is still returned.
+    A cache hit is replayed to on_text in one piece; only complete responses
+    that pass validate are stored, under the same key as the non-streamed request.
+    """
+    temperature = (payload.get("options") or {}).get("temperature")
+    use_cache = is_cacheable(temperature, cache)
+    key = _ollama_cache_key(endpoint, payload, org_id) if use_cache else None
+    if key:
+        hit = llm_cache.get(key)
+        if hit is not None:
+            data = json.loads(hit)
+            on_text(data.get("response", ""))
+            return data, True
+
+    # The slot covers the whole stream, not just the response headers; an open
+    # breaker fails before queueing for it
+    provider_health.ensure_not_open("ollama", endpoint)
+    with ai_concurrency.slot("ollama", endpoint) as slot:
+        started = time.monotonic()
+        first_token_at = None
+        pieces = []
+        final: Dict[str, Any] = {}
+        complete = False
+        outcome = "ok"
+        try:
+            response = guarded_ollama_post(endpoint, "/api/generate", {**payload, "stream": True},
+                                           timeout=timeout, stream=True, org_id=org_id)
+            try:
+                slot.report_status(response.status_code)
+                if response.status_code != 200:
+                    outcome = "rate_limited" if response.status_code == 429 else "http_error"
+                    raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        outcome = "error"
+                        raise Exception(f"Ollama API error: {chunk['error']}")
+                    text = chunk.get("response", "")
+                    if text:
+                        if first_token_at is None:
+                            first_token_at = time.monotonic()
+                        pieces.append(text)
+                        on_text(text)
+                    if chunk.get("done"):
+                        final = chunk
+                        complete = True
+                        break
+                    if deadline_seconds and time.monotonic() - started > deadline_seconds:
+                        logger.warning(f"Ollama stream exceeded {deadline_seconds}s deadline; keeping partial output")
+                        outcome = "deadline"
+                        break
+            except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                slot.outcome = classify_exception(e)
+                outcome = failure_kind(e)
+                logger.warning(f"Ollama stream interrupted after {len(pieces)} chunks: {e}")
+            finally:
+                response.close()
+        except Exception as e:
+            if outcome == "ok":
+                outcome = failure_kind(e)
+            raise
+        finally:
+            duration = time.monotonic() - started
+            ttft = first_token_at - started if first_token_at is not None else None
+            if complete:
+                llm_metrics.record_ollama_response(payload.get("model", ""), duration, final,
+                                                   org_id=org_id, ttft=ttft)
+            else:
+                # A stream that ended without its done chunk is "incomplete"
+                llm_metrics.record_call("ollama", payload.get("model", ""), duration,
+                                        outcome if outcome != "ok" else "incomplete", org_id=org_id, ttft=ttft)
+
+    result = {**final, "response": "".join(pieces)}
+    if key and complete and result.get("done_reason") != "length" and _storable(result["response"], validate):
+        llm_cache.set(key, json.dumps(result))
+    return result, complete
+
+
+def cached_chat_completion(client, org_id: Any = None, cache: Optional[bool] = None,
+                           validate: Optional[Callable[[str], bool]] = None, **params):
+    """
+    chat.completions.create through the response cache; returns a ChatCompletion.
+
+    validate(text) decides whether a reply is stored (default: any non-empty one).
+    """
+    temperature = params.get("temperature")
+    if params.get("stream") or not is_cacheable(temperature, cache):
+        return guarded_chat_completion(client, org_id=org_id, **params)
+
+    options = {k: v for k, v in params.items() if k not in ("model", "messages", "temperature")}
+    key = llm_cache.make_key(org_id, f"openai:{getattr(client, 'base_url', '')}", params.get("model", ""),
+                             temperature, options, params.get("messages", []))
+    hit = llm_cache.get(key)
+    if hit is not None:
+        from openai.types.chat import ChatCompletion
+        return ChatCompletion.model_validate_json(hit)
+
+    response = guarded_chat_completion(client, org_id=org_id, **params)
+    try:
+        choice = response.choices[0]
+        if choice.finish_reason != "length" and _storable(choice.message.content, validate):
+            llm_cache.set(key, response.model_dump_json())
+    except (AttributeError, IndexError):
+        pass
+    return response
+
+
+# response_format levels tried in order; endpoints that reject one are remembered
+_JSON_MODES = ("json_schema", "json_object", "text")
+_json_mode_floor: Dict[str, int] = {}
+_json_mode_lock = threading.Lock()
+
+
+def structured_chat_completion(client, schema: Optional[Dict[str, Any]] = None, org_id: Any = None,
+                               cache: Optional[bool] = None, validate: Optional[Callable[[str], bool]] = None,
+                               **params):
+    """
+    cached_chat_completion asking for JSON output, following schema when given.
+
+    Tries structured outputs (json_schema), then JSON mode, then plain text.
+    An endpoint that rejects a mode as unsupported (400/422 naming the format)
+    is not asked for it again in this process, so OpenAI-compatible servers
+    without structured outputs cost one failed request rather than one per call.
+    """
+    import openai
+    from llm_json import openai_response_format
+
+    endpoint = str(getattr(client, "base_url", "") or "")
+    with _json_mode_lock:
+        level = _json_mode_floor.get(endpoint, 0 if schema else 1)
+    level = max(level, 0 if schema else 1)
+
+    while True:
+        mode = _JSON_MODES[level]
+        request = dict(params)
+        if mode == "json_schema":
+            request["response_format"] = openai_response_format(schema)
+        elif mode == "json_object":
+            request["response_format"] = {"type": "json_object"}
+        try:
+            return cached_chat_completion(client, org_id=org_id, cache=cache, validate=validate, **request)
+        except (openai.BadRequestError, openai.UnprocessableEntityError) as e:
+            if mode == "text":
+                raise
+            logger.warning(f"{endpoint or 'OpenAI endpoint'} rejected response_format {mode}, falling back: {e}")
+            level += 1
+            message = str(e).lower()
+            if "response_format" in message or "json" in message or "schema" in message:
+                # Only remember rejections that are about the format, not e.g. the prompt length
+                with _json_mode_lock:
+                    _json_mode_floor[endpoint] = max(_json_mode_floor.get(endpoint, 0), level)
+
+
+# Global cache instance
+llm_cache = LLMResponseCache()
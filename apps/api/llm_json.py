@@ -0,0 +1,262 @@
+"""
+JSON handling for LLM output.
+
+Requests ask the provider for schema-constrained output (Ollama's `format`
+option, OpenAI structured outputs), built with ollama_format() and
+openai_response_format(). extract_json() recovers the answer object from
+replies that still carry prose, code fences or reasoning text.
+
+IncrementalArrayParser consumes a JSON document as it is generated and emits
+each element of a chosen top-level array (e.g. "requirements") as soon as
+that element's closing brace arrives, so streamed scans can persist results
+before the model has finished the whole response.
+"""
+import json
+import logging
+import os
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from llm_metrics import llm_metrics
+
+logger = logging.getLogger(__name__)
+
+# Send JSON schemas as Ollama's `format` (Ollama >= 0.5); "false" falls back to plain JSON mode
+OLLAMA_STRUCTURED_OUTPUTS = os.getenv("OLLAMA_STRUCTURED_OUTPUTS", "true").lower() == "true"
+
+# Characters that matter outside strings while looking for objects
+_STRUCTURAL_RE = re.compile(r'[{}"]')
+# Opening braces tried, nearest first, against the reply's last closing brace
+_TAIL_ATTEMPTS = 64
+# A complete JSON string; raw newlines are not allowed in JSON strings, which
+# stops a stray quote in prose from swallowing the rest of the reply
+_STRING_RE = re.compile(r'"[^"\\\n]*(?:\\.[^"\\\n]*)*"')
+
+
+def object_schema(title: str, properties: Dict[str, Any], required: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """JSON schema for an object; every property is required unless listed otherwise."""
+    return {
+        "title": title,
+        "type": "object",
+        "properties": properties,
+        "required": list(required) if required is not None else list(properties),
+    }
+
+
+def ollama_format(schema: Dict[str, Any]) -> Union[Dict[str, Any], str]:
+    """Value for the `format` field of an Ollama /api/generate request."""
+    return schema if OLLAMA_STRUCTURED_OUTPUTS else "json"
+
+
+def openai_response_format(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """response_format requesting structured output that follows schema."""
+    name = re.sub(r"[^a-zA-Z0-9_-]", "_", schema.get("title") or "response")[:64]
+    return {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": False}}
+
+
+def _object_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    (start, end) of every outermost balanced {...} in text, in order.
+
+    One left-to-right pass: the regex engine skips everything but braces and
+    quotes, and strings are consumed whole so braces inside them don't count.
+    A brace that never closes (prose, or a truncated reply) does not hide the
+    complete objects that follow it.
+    """
+    closed: List[Tuple[int, int]] = []
+    open_positions: List[int] = []
+    pos = 0
+    while True:
+        match = _STRUCTURAL_RE.search(text, pos)
+        if match is None:
+            break
+        i = match.start()
+        ch = text[i]
+        if ch == '"':
+            string = _STRING_RE.match(text, i) if open_positions else None
+            pos = string.end() if string else i + 1
+            continue
+        if ch == "{":
+            open_positions.append(i)
+        elif open_positions:
+            closed.append((open_positions.pop(), i + 1))
+        pos = i + 1
+
+    # Spans are nested or disjoint; keep those not inside another one
+    closed.sort(key=lambda span: (span[0], -span[1]))
+    outermost: List[Tuple[int, int]] = []
+    for start, end in closed:
+        if not outermost or start >= outermost[-1][1]:
+            outermost.append((start, end))
+    return outermost
+
+
+def _parse_tail_object(text: str, required: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+    """
+    The object ending at the last '}', found by trying the nearest '{' first.
+
+    Covers the usual reply shape (reasoning, then the answer) without
+    scanning the reasoning. A wrong start fails json.loads at its first bad
+    token, so each attempt is cheap.
+    """
+    end = text.rfind("}")
+    start = end
+    for _ in range(_TAIL_ATTEMPTS):
+        start = text.rfind("{", 0, start)
+        if start < 0:
+            return None
+        try:
+            parsed = json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            continue
+        if isinstance(parsed, dict) and all(k in parsed for k in required):
+            return parsed
+        return None
+    return None
+
+
+def extract_json(text: Optional[str], required_keys: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+    """
+    The JSON object a model answered with, or None.
+
+    Accepts bare JSON, fenced JSON, and JSON surrounded by prose or reasoning.
+    When several objects are present the last one that parses (and has all
+    required_keys) wins, since models reason before they answer. Linear in
+    the length of text: each outermost object is parsed at most once.
+    Failures are counted in llm_metrics against the last call made here.
+    """
+    parsed = _find_json(text, tuple(required_keys))
+    if parsed is None:
+        llm_metrics.record_parse_failure()
+    return parsed
+
+
+def json_reply_check(required_keys: Iterable[str] = ()) -> Callable[[str], bool]:
+    """
+    A `validate` callback for the llm_cache helpers: only replies extract_json
+    can read (non-empty, with all required_keys) are cached. Not counted as
+    parse failures; the caller's own extract_json is.
+    """
+    required = tuple(required_keys)
+    return lambda text: bool(_find_json(text, required))
+
+
+def _find_json(text: Optional[str], required: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+    if not text:
+        return None
+
+    stripped = text.strip()
+    if stripped.startswith("{"):
+        try:
+            parsed = json.loads(stripped)
+            if isinstance(parsed, dict) and all(k in parsed for k in required):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+
+    parsed = _parse_tail_object(text, required)
+    if parsed is not None:
+        return parsed
+
+    for start, end in reversed(_object_spans(text)):
+        try:
+            parsed = json.loads(text[start:end])
+        except json.JSONDecodeError:
+            continue
+        if isinstance(parsed, dict) and all(k in parsed for k in required):
+            return parsed
+
+    logger.debug(f"No JSON object found in model reply ({len(text)} chars)")
+    return None
+
+
+class IncrementalArrayParser:
+    """
+    Emit objects of the top-level array `key` from a JSON stream fed in pieces.
+
+    Tolerates leading prose or a ```json fence before the opening brace. Only
+    a character scanner runs per chunk; each element is json.loads'ed once,
+    when complete.
+    """
+
+    def __init__(self, key: str, on_item: Optional[Callable[[Any], None]] = None):
+        self.key = key
+        self.on_item = on_item
+        self.items: List[Any] = []
+        self.buffer = ""
+        self._pos = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._last_string: Optional[str] = None
+        self._pending_key: Optional[str] = None
+        # One entry per open container: (char, key it is the value of)
+        self._stack: List[tuple] = []
+        self._item_start = -1
+
+    def feed(self, text: str) -> List[Any]:
+        """Add generated text; returns the items completed by this chunk."""
+        self.buffer += text
+        emitted = []
+        buf = self.buffer
+        i = self._pos
+        n = len(buf)
+        while i < n:
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = buf[self._string_start:i]
+                i += 1
+                continue
+
+            if not self._started:
+                # Skip prose/fences until the top-level object opens
+                if ch == "{":
+                    self._started = True
+                    self._stack.append(("{", None))
+                i += 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i + 1
+            elif ch == ":":
+                self._pending_key = self._last_string
+            elif ch in "{[":
+                parent_key = self._pending_key if self._stack and self._stack[-1][0] == "{" else None
+                if (ch == "{" and len(self._stack) == 2 and self._stack[-1] == ("[", self.key)):
+                    self._item_start = i
+                self._stack.append((ch, parent_key))
+                self._pending_key = None
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if (ch == "}" and self._item_start >= 0 and len(self._stack) == 2
+                        and self._stack[-1] == ("[", self.key)):
+                    raw = buf[self._item_start:i + 1]
+                    self._item_start = -1
+                    try:
+                        item = json.loads(raw)
+                    except json.JSONDecodeError as e:
+                        logger.warning(f"Skipping malformed streamed {self.key} item: {e}")
+                    else:
+                        self.items.append(item)
+                        emitted.append(item)
+                        if self.on_item:
+                            self.on_item(item)
+                self._pending_key = None
+            elif ch == ",":
+                self._pending_key = None
+            i += 1
+        self._pos = i
+        return emitted
+
+    @property
+    def text(self) -> str:
+        return self.buffer
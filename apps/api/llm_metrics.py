@@ -0,0 +1,403 @@
+"""
+Per-call instrumentation of LLM provider calls.
+
+provider_health's guarded_* helpers (and the streamed generate in
+llm_cache) record every call: wall time, time to first token, prompt and
+completion tokens, done_reason / finish_reason and the failure kind. Calls
+are labelled with the call site, provider and model; token totals are also
+kept per org. extract_json reports replies it could not parse against the
+last call made in the same context.
+
+The call site comes from a context variable set with llm_call_site(), used
+as a decorator on the function that makes the call or as a with block:
+
+    @llm_call_site("validate")
+    async def validate_evidence(...): ...
+
+Values aggregate into fixed-bucket histograms and counters per process.
+Each process publishes its state to Redis, and merged() sums every live
+process's state for the admin endpoints (JSON and Prometheus text format).
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, cast
+
+logger = logging.getLogger(__name__)
+
+LLM_METRICS_ENABLED = os.getenv("LLM_METRICS_ENABLED", "true").lower() == "true"
+
+# Redis keys holding each process's published state
+STATE_KEY_PREFIX = "llm_metrics:"
+_STATE_TTL_SECONDS = 24 * 3600
+_PUBLISH_INTERVAL_SECONDS = 10
+
+SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+HISTOGRAMS = {
+    "llm_call_duration_seconds": ("Wall time of a provider call", SECONDS_BUCKETS),
+    "llm_time_to_first_token_seconds": ("Time until the first generated token (streamed, or Ollama load + prompt eval)",
+                                        SECONDS_BUCKETS),
+    "llm_prompt_tokens": ("Prompt tokens per call as reported by the provider", TOKEN_BUCKETS),
+    "llm_completion_tokens": ("Completion tokens per call as reported by the provider", TOKEN_BUCKETS),
+}
+COUNTERS = {
+    "llm_calls_total": "Provider calls by outcome",
+    "llm_done_reasons_total": "Completed calls by done_reason / finish_reason",
+    "llm_parse_failures_total": "Replies from which no JSON answer could be extracted",
+    "llm_org_tokens_total": "Tokens per organisation",
+}
+
+_call_site: contextvars.ContextVar[str] = contextvars.ContextVar("llm_call_site", default="other")
+_last_call: contextvars.ContextVar[Optional[Tuple[str, str, str]]] = contextvars.ContextVar(
+    "llm_last_call", default=None
+)
+
+
+class llm_call_site:
+    """Label provider calls made inside a function or with block with a call site name."""
+
+    def __init__(self, site: str):
+        self.site = site
+        self._tokens: List[contextvars.Token] = []
+
+    def __enter__(self):
+        self._tokens.append(_call_site.set(self.site))
+        return self
+
+    def __exit__(self, *exc):
+        _call_site.reset(self._tokens.pop())
+        return False
+
+    def __call__(self, fn):
+        site = self.site
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                token = _call_site.set(site)
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    _call_site.reset(token)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            token = _call_site.set(site)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _call_site.reset(token)
+        return wrapper
+
+
+def current_call_site() -> str:
+    return _call_site.get()
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets: Tuple[float, ...], counts: Optional[List[int]] = None,
+                 total: float = 0.0, count: int = 0):
+        self.buckets = buckets
+        self.counts = counts or [0] * (len(buckets) + 1)  # last bucket is +Inf
+        self.sum = total
+        self.count = count
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram") -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate by linear interpolation within the bucket, as histogram_quantile() does."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, n in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if n and seen + n >= rank:
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return self.buckets[-1]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"counts": self.counts, "sum": self.sum, "count": self.count}
+
+
+class LLMMetrics:
+    """Per-process histograms and counters, keyed by metric name and label tuple."""
+
+    def __init__(self, redis_url: Optional[str] = None):
+        self.redis_url = redis_url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, Tuple[str, ...]], Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+        self._last_published = 0.0
+
+    # Recording
+
+    def record_call(self, provider: str, model: str, duration: float, outcome: str = "ok",
+                    org_id: Any = None, prompt_tokens: Optional[int] = None,
+                    completion_tokens: Optional[int] = None, ttft: Optional[float] = None,
+                    done_reason: Optional[str] = None) -> None:
+        """Record one provider call; outcome is "ok" or a failure kind from failure_kind()."""
+        if not LLM_METRICS_ENABLED:
+            return
+        site = current_call_site()
+        model = model or "unknown"
+        labels = (site, provider, model)
+        _last_call.set(labels)
+        with self._lock:
+            self._observe("llm_call_duration_seconds", labels, duration)
+            if ttft is not None:
+                self._observe("llm_time_to_first_token_seconds", labels, ttft)
+            if prompt_tokens is not None:
+                self._observe("llm_prompt_tokens", labels, prompt_tokens)
+            if completion_tokens is not None:
+                self._observe("llm_completion_tokens", labels, completion_tokens)
+            self._inc("llm_calls_total", labels + (outcome,))
+            if done_reason:
+                self._inc("llm_done_reasons_total", labels + (done_reason,))
+            org = str(org_id) if org_id is not None else "none"
+            if prompt_tokens:
+                self._inc("llm_org_tokens_total", (org, provider, model, "prompt"), prompt_tokens)
+            if completion_tokens:
+                self._inc("llm_org_tokens_total", (org, provider, model, "completion"), completion_tokens)
+        self._publish()
+
+    def record_parse_failure(self) -> None:
+        """Count a reply that held no usable JSON, against the last call in this context."""
+        if not LLM_METRICS_ENABLED:
+            return
+        labels = _last_call.get() or (current_call_site(), "unknown", "unknown")
+        with self._lock:
+            self._inc("llm_parse_failures_total", labels)
+
+    def record_ollama_response(self, model: str, duration: float, data: Dict[str, Any],
+                               org_id: Any = None, ttft: Optional[float] = None) -> None:
+        """Record a completed /api/generate call from its (final) JSON body."""
+        if ttft is None and data.get("prompt_eval_duration") is not None:
+            # Non-streamed: the first token follows model load and prompt evaluation
+            ttft = ((data.get("load_duration") or 0) + data["prompt_eval_duration"]) / 1e9
+        self.record_call(
+            "ollama", model, duration, org_id=org_id, ttft=ttft,
+            prompt_tokens=data.get("prompt_eval_count"), completion_tokens=data.get("eval_count"),
+            done_reason=data.get("done_reason"),
+        )
+
+    def record_openai_response(self, params: Dict[str, Any], duration: float, response: Any,
+                               org_id: Any = None) -> None:
+        usage = getattr(response, "usage", None)
+        try:
+            finish_reason = response.choices[0].finish_reason
+        except (AttributeError, IndexError, TypeError):
+            finish_reason = None
+        self.record_call(
+            "openai", getattr(response, "model", None) or params.get("model"), duration, org_id=org_id,
+            prompt_tokens=getattr(usage, "prompt_tokens", None),
+            completion_tokens=getattr(usage, "completion_tokens", None),
+            done_reason=finish_reason,
+        )
+
+    def _observe(self, name: str, labels: Tuple[str, ...], value: float) -> None:
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(HISTOGRAMS[name][1])
+        histogram.observe(value)
+
+    def _inc(self, name: str, labels: Tuple[str, ...], amount: float = 1) -> None:
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    # State and aggregation
+
+    def state(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "histograms": [[name, list(labels), h.as_dict()] for (name, labels), h in self._histograms.items()],
+                "counters": [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+            }
+
+    def _publish(self) -> None:
+        now = time.monotonic()
+        if now - self._last_published < _PUBLISH_INTERVAL_SECONDS:
+            return
+        self._last_published = now
+        try:
+            import redis
+            client = redis.Redis.from_url(self.redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            try:
+                client.set(f"{STATE_KEY_PREFIX}{socket.gethostname()}:{os.getpid()}",
+                           json.dumps(self.state()), ex=_STATE_TTL_SECONDS)
+            finally:
+                client.close()
+        except Exception as e:
+            logger.debug(f"LLM metrics: failed to publish state: {e}")
+
+    def merged(self) -> Tuple[Dict[Tuple[str, Tuple[str, ...]], Histogram], Dict[Tuple[str, Tuple[str, ...]], float]]:
+        """This process's metrics plus every other process's published state."""
+        own_key = f"{STATE_KEY_PREFIX}{socket.gethostname()}:{os.getpid()}"
+        states = [self.state()]
+        try:
+            import redis
+            client = redis.Redis.from_url(self.redis_url, socket_timeout=1, socket_connect_timeout=1)
+            try:
+                keys = [k for k in client.scan_iter(match=f"{STATE_KEY_PREFIX}*", count=100)
+                        if k.decode() != own_key]
+                values = cast(List[Optional[bytes]], client.mget(keys)) if keys else []
+                states.extend(json.loads(v) for v in values if v)
+            finally:
+                client.close()
+        except Exception as e:
+            logger.warning(f"LLM metrics: reporting this process only, Redis unavailable: {e}")
+
+        histograms: Dict[Tuple[str, Tuple[str, ...]], Histogram] = {}
+        counters: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+        for state in states:
+            for name, labels, data in state.get("histograms", []):
+                if name not in HISTOGRAMS:
+                    continue
+                key = (name, tuple(labels))
+                incoming = Histogram(HISTOGRAMS[name][1], list(data["counts"]), data["sum"], data["count"])
+                if key in histograms:
+                    histograms[key].merge(incoming)
+                else:
+                    histograms[key] = incoming
+            for name, labels, value in state.get("counters", []):
+                key = (name, tuple(labels))
+                counters[key] = counters.get(key, 0) + value
+        return histograms, counters
+
+    def summary(self) -> Dict[str, Any]:
+        """Merged metrics per (site, provider, model), with p50/p95 estimates, for the admin API."""
+        histograms, counters = self.merged()
+        series: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+
+        def entry(labels: Tuple[str, ...]) -> Dict[str, Any]:
+            if labels not in series:
+                series[labels] = {"site": labels[0], "provider": labels[1], "model": labels[2],
+                                  "outcomes": {}, "done_reasons": {}, "parse_failures": 0}
+            return series[labels]
+
+        for (name, labels), histogram in histograms.items():
+            entry(labels)[name] = {
+                "count": histogram.count,
+                "mean": round(histogram.sum / histogram.count, 3) if histogram.count else None,
+                "p50": _round(histogram.quantile(0.5)),
+                "p95": _round(histogram.quantile(0.95)),
+            }
+        for (name, labels), value in counters.items():
+            if name == "llm_calls_total":
+                entry(labels[:3])["outcomes"][labels[3]] = value
+            elif name == "llm_done_reasons_total":
+                entry(labels[:3])["done_reasons"][labels[3]] = value
+            elif name == "llm_parse_failures_total":
+                entry(labels[:3])["parse_failures"] += value
+
+        org_tokens: Dict[str, Dict[str, float]] = {}
+        for (name, labels), value in counters.items():
+            if name == "llm_org_tokens_total":
+                org = org_tokens.setdefault(labels[0], {"prompt": 0, "completion": 0})
+                org[labels[3]] += value
+        return {
+            "series": sorted(series.values(), key=lambda s: (s["site"], s["provider"], s["model"])),
+            "org_tokens": org_tokens,
+        }
+
+    def prometheus(self) -> str:
+        """Merged metrics in the Prometheus text exposition format."""
+        histograms, counters = self.merged()
+        lines: List[str] = []
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                base = _labels(("site", "provider", "model"), labels)
+                cumulative = 0
+                for bound, n in zip(list(buckets) + ["+Inf"], histogram.counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{{{base},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{base}}} {histogram.sum}")
+                lines.append(f"{name}_count{{{base}}} {histogram.count}")
+        label_names = {
+            "llm_calls_total": ("site", "provider", "model", "outcome"),
+            "llm_done_reasons_total": ("site", "provider", "model", "reason"),
+            "llm_parse_failures_total": ("site", "provider", "model"),
+            "llm_org_tokens_total": ("org", "provider", "model", "kind"),
+        }
+        for name, help_text in COUNTERS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{{{_labels(label_names[name], labels)}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._last_published = 0.0
+
+
+def failure_kind(exc: BaseException) -> str:
+    """Outcome label for a failed call: timeout, rate_limited, connection, http_error or error."""
+    import requests
+
+    if isinstance(exc, requests.exceptions.Timeout):
+        return "timeout"
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        return "connection"
+    try:
+        import openai
+    except ImportError:
+        return "error"
+    if isinstance(exc, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(exc, openai.RateLimitError):
+        return "rate_limited"
+    if isinstance(exc, openai.APIConnectionError):
+        return "connection"
+    if isinstance(exc, openai.APIStatusError):
+        return "http_error"
+    return "error"
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    def escape(value: str) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{n}="{escape(v)}"' for n, v in zip(names, values))
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+# Global metrics instance
+llm_metrics = LLMMetrics()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=llm_metrics._reset_after_fork)
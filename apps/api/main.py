@@ -1,13 +1,17 @@
 import os
 import uuid
+import hashlib
 import json
 import json as json_module
 import requests
 import logging
 import asyncio
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Optional, Any, Dict, cast
+from typing import List, Optional, Any, Dict, Tuple, cast
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, BackgroundTasks, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
@@ -23,13 +27,25 @@ from middleware import (
 from sqlalchemy.orm import Session, selectinload
 from sqlalchemy import or_, func
 from database import get_db
-from models import Document, Org, User, Framework, Control, Requirement, EvidenceLink, Scan, ScanResult, Gap, DocumentControlLink, DocumentPage, Settings
+from models import Document, Org, User, Framework, Control, Requirement, EvidenceLink, Scan, ScanBatch, ScanResult, Gap, DocumentControlLink, DocumentPage, Settings
 from storage import storage
-from worker_tasks import extract_document_text, process_scan
+from worker_tasks import process_scan, process_framework_scan, queue_document_extraction
 from pydantic import BaseModel
 from init_db import initialize_database
 from auth import get_current_user, require_admin, verify_password, get_password_hash, create_access_token
 from crypto import encrypt_secret, decrypt_secret, is_encrypted
+from ai_clients import get_openai_client, get_http_session, ollama_get, ollama_post, pool_stats, close_all as close_ai_pools
+from llm_cache import llm_cache, cached_chat_completion, cached_ollama_generate, structured_chat_completion
+from llm_json import extract_json, json_reply_check, object_schema, ollama_format
+from prompt_packer import PromptBudget, context_window, pack_document
+from provider_health import guarded_chat_completion, guarded_ollama_post, provider_health
+from llm_metrics import llm_call_site, llm_metrics
+from concurrency import ai_concurrency
+from settings_cache import settings_cache
+from document_summaries import document_summaries
+from control_index import control_index, summary_text
+from model_cascade import model_cascade
+from extraction_service import extraction_service
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -40,123 +56,260 @@ logger = logging.getLogger(__name__)
 # The OpenAI SDK requires an api_key parameter, so we provide this dummy value for local endpoints.
 LOCAL_AI_PLACEHOLDER_KEY = os.getenv('LOCAL_AI_PLACEHOLDER_KEY', 'sk-local-endpoint-no-auth')
 
-def _analyze_document_two_step(file_text: str, filename: str, available_controls: List[dict], ai_client) -> List[dict]:
+# Shared deadline for the concurrent provider analyses of dual-vision validation
+DUAL_VISION_DEADLINE_SECONDS = float(os.getenv("DUAL_VISION_DEADLINE_SECONDS", "240"))
+
+# Bump when the step-1 summary prompt or schema changes; stored summaries of other versions are ignored
+DOCUMENT_SUMMARY_PROMPT_VERSION = "summary-v2"
+
+# Output schemas for the JSON prompts below, sent as Ollama `format` / OpenAI structured outputs
+_STRING_LIST = {"type": "array", "items": {"type": "string"}}
+_DOCUMENT_SUMMARY_SCHEMA = object_schema("DocumentSummary", {
+    "document_type": {"type": "string"},
+    "primary_topic": {"type": "string"},
+    "key_content_indicators": _STRING_LIST,
+    "security_areas": _STRING_LIST,
+    "main_requirements": _STRING_LIST,
+    "distinguishing_features": {"type": "string"},
+})
+_CONTROL_MAPPING_SCHEMA = object_schema("ControlMapping", {
+    "selected_controls": {"type": "array", "items": object_schema("SelectedControl", {
+        "number": {"type": "integer"},
+        "confidence": {"type": "number"},
+        "reasoning": {"type": "string"},
+    })},
+})
+_CONTROL_SUGGESTIONS_SCHEMA = object_schema("ControlSuggestions", {
+    "suggestions": {"type": "array", "items": object_schema("ControlSuggestion", {
+        "control_code": {"type": "string"},
+        "control_title": {"type": "string"},
+        "framework_name": {"type": "string"},
+        "confidence": {"type": "number"},
+        "reasoning": {"type": "string"},
+    })},
+})
+_EVIDENCE_VALIDATION_SCHEMA = object_schema("EvidenceValidation", {
+    "outcome": {"type": "string", "enum": ["PASS", "PARTIAL", "FAIL"]},
+    "confidence": {"type": "number"},
+    "rationale": {"type": "string"},
+    "findings": _STRING_LIST,
+    "recommendations": _STRING_LIST,
+})
+
+def _analyze_document_two_step(file_text: str, filename: str, available_controls: List[dict], ai_client, org_id=None,
+                               content_sha256: Optional[str] = None, document_id=None,
+                               model: Optional[str] = None) -> Optional[List[dict]]:
     """
     Two-step document analysis:
     1. First scan and summarize the document
     2. Then map the summary to compliance controls
+
+    With content_sha256, a step-1 summary stored for the same content, model and
+    prompt version is reused instead of regenerated; new summaries are stored
+    when document_id is given. model overrides the client's default model; such
+    a run (the cascade's small model) returns None when the analysis fails
+    instead of the filename-based fallback suggestions.
     """
+    fallback = model is None
     if isinstance(ai_client, dict) and ai_client.get('type') == 'ollama':
-        return _analyze_document_ollama_two_step(file_text, filename, available_controls, ai_client)
+        if model:
+            ai_client = {**ai_client, 'model': model}
+        return _analyze_document_ollama_two_step(file_text, filename, available_controls, ai_client, org_id,
+                                                 content_sha256, document_id, fallback)
     else:
-        return _analyze_document_openai_two_step(file_text, filename, available_controls, ai_client)
+        return _analyze_document_openai_two_step(file_text, filename, available_controls, ai_client, org_id,
+                                                 content_sha256, document_id, model, fallback)
 
-def _analyze_document_ollama_two_step(file_text: str, filename: str, available_controls: List[dict], ai_client: dict) -> List[dict]:
-    """JSON-to-JSON two-step analysis specifically for Ollama models"""
-    import requests
-    import json as json_module
-    
+def _cascade_small_model(org_id, ai_client) -> Optional[str]:
+    """The org's small model for this client's provider, or None when the cascade is off or has nothing to save."""
+    if org_id is None:
+        return None
+    settings = settings_cache.get(org_id)
+    if not settings.use_model_cascade:
+        return None
+    if isinstance(ai_client, dict) and ai_client.get('type') == 'ollama':
+        small, main_model = settings.cascade_ollama_model, ai_client.get('model')
+    else:
+        small, main_model = settings.cascade_openai_model, os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    return small if small and small != main_model else None
+
+def _analyze_document_cascade(file_text: str, filename: str, available_controls: List[dict], ai_client, org_id=None,
+                              content_sha256: Optional[str] = None, document_id=None) -> List[dict]:
+    """
+    Two-step analysis, on the org's small model first when its model cascade is on.
+
+    The small model's suggestions are kept unless model_cascade says they need
+    escalating (its analysis failed, found none, or one is in the org's
+    ambiguous confidence band); then the main model analyses the document from
+    scratch.
+    """
+    small_model = _cascade_small_model(org_id, ai_client)
+    if small_model is None:
+        return _analyze_document_two_step(file_text, filename, available_controls, ai_client, org_id,
+                                          content_sha256, document_id)
+
+    settings = settings_cache.get(org_id)
+    started = time.monotonic()
+    suggestions = _analyze_document_two_step(file_text, filename, available_controls, ai_client, org_id,
+                                             content_sha256, document_id, model=small_model)
+    small_seconds = time.monotonic() - started
+    escalation = model_cascade.escalation_reason(
+        suggestions,
+        settings.cascade_escalate_min if settings.cascade_escalate_min is not None else 0.5,
+        settings.cascade_escalate_max if settings.cascade_escalate_max is not None else 0.95,
+    )
+    if escalation is None:
+        model_cascade.record(small_seconds)
+        logger.info(f"Cascade: {filename} settled by {small_model} in {small_seconds:.1f}s "
+                    f"({model_cascade.summary()})")
+        return suggestions
+
+    started = time.monotonic()
+    suggestions = _analyze_document_two_step(file_text, filename, available_controls, ai_client, org_id,
+                                             content_sha256, document_id)
+    large_seconds = time.monotonic() - started
+    model_cascade.record(small_seconds, escalation, large_seconds)
+    logger.info(f"Cascade: {filename} escalated ({escalation}) after {small_seconds:.1f}s on {small_model}, "
+                f"main model took {large_seconds:.1f}s ({model_cascade.summary()})")
+    return suggestions
+
+def _stored_summary_or_generate(summarize, filename: str, org_id, model_key: str,
+                                content_sha256: Optional[str], document_id) -> Optional[dict]:
+    """Step 1 through the document summary store: reuse a valid summary, else generate and store one."""
+    if org_id is not None and content_sha256:
+        stored = document_summaries.get(org_id, content_sha256, model_key, DOCUMENT_SUMMARY_PROMPT_VERSION)
+        if stored is not None:
+            logger.info(f"Step 1: reusing stored summary for {filename} ({model_key})")
+            return stored
+
+    summary = summarize()
+    if summary and org_id is not None and content_sha256 and document_id is not None:
+        document_summaries.put(org_id, document_id, content_sha256, model_key,
+                               DOCUMENT_SUMMARY_PROMPT_VERSION, summary)
+    return summary
+
+@llm_call_site("step1")
+def _summarize_document_ollama(file_text: str, filename: str, ai_client: dict, org_id=None) -> Optional[dict]:
+    """Step 1 for Ollama: JSON summary of the document, or None if the model didn't produce one."""
     endpoint = ai_client['endpoint']
     model = ai_client['model']
-    
+    context_tokens = context_window(ai_client)
+
     # Step 1: Document Scanning - Create JSON Summary
+    scan_instructions = """Return JSON summary:
+{"document_type":"screenshot","primary_topic":"main subject","key_content_indicators":["keywords found"],"security_areas":["security domain"],"main_requirements":["core requirement"],"distinguishing_features":"what makes this unique"}"""
+    document_text, budget = pack_document(
+        file_text, context_tokens, 1000,
+        template_text=f"Analyze document: {filename}\nContent: \n\n{scan_instructions}"
+    )
+    if budget.lossy:
+        logger.info(f"Step 1 prompt for {filename}: {budget.summary()}")
     scan_prompt = f"""Analyze document: {filename}
-Content: {file_text[:5000]}
+Content: {document_text}
 
-Return JSON summary:
-{{"document_type":"screenshot","primary_topic":"main subject","key_content_indicators":["keywords found"],"security_areas":["security domain"],"main_requirements":["core requirement"],"distinguishing_features":"what makes this unique"}}"""
+{scan_instructions}"""
     
     logger.info(f"Step 1: Creating JSON summary for {filename}")
     
+    # Use only generate API for completions
+    scan_response = cached_ollama_generate(
+        endpoint,
+        {
+            "model": model,
+            "prompt": scan_prompt,
+            "stream": False,
+            "format": ollama_format(_DOCUMENT_SUMMARY_SCHEMA),
+            "options": {
+                "temperature": 0.1,
+                "num_predict": 1000,  # Increased for complete JSON responses
+                "num_ctx": context_tokens,
+                "stop": ["\n\n\n"]  # Only stop on triple newlines
+            }
+        },
+        timeout=90,
+        org_id=org_id,
+        validate=json_reply_check()
+    )
+    
+    if scan_response.status_code != 200:
+        logger.error(f"Step 1 failed for {filename}: {scan_response.status_code}")
+        return None
+    
+    scan_result = scan_response.json()
+    
+    # Use only generate API response format
+    document_summary_raw = scan_result.get('response', '')
+    logger.info(f"Step 1: Using generate API response for {filename}")
+    
+    # NEVER use thinking field - log but ignore
+    if 'thinking' in scan_result and scan_result.get('thinking'):
+        logger.info(f"Step 1: Thinking field ignored for {filename}: {scan_result.get('thinking', '')[:100]}...")
+    
+    if not document_summary_raw:
+        logger.warning(f"Step 1 produced empty summary for {filename}")
+        return None
+    
+    logger.info(f"Step 1 raw response for {filename}: {document_summary_raw[:300]}...")
+    
+    # Parse the JSON summary from Step 1
+    document_summary_json = extract_json(document_summary_raw)
+    if not document_summary_json:
+        logger.warning(f"Step 1 failed to produce valid JSON for {filename}")
+        return None
+    
+    logger.info(f"Step 1 JSON summary for {filename}: {document_summary_json}")
+    return document_summary_json
+
+@llm_call_site("step2")
+def _analyze_document_ollama_two_step(file_text: str, filename: str, available_controls: List[dict], ai_client: dict, org_id=None,
+                                      content_sha256: Optional[str] = None, document_id=None,
+                                      fallback: bool = True) -> Optional[List[dict]]:
+    """JSON-to-JSON two-step analysis specifically for Ollama models"""
+    import json as json_module
+    
+    endpoint = ai_client['endpoint']
+    model = ai_client['model']
+    context_tokens = context_window(ai_client)
+    
     try:
-        # Use only generate API for completions
-        scan_response = requests.post(
-            f"{endpoint}/api/generate",
-            json={
-                "model": model,
-                "prompt": scan_prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.1,
-                    "num_predict": 1000,  # Increased for complete JSON responses
-                    "num_ctx": int(os.getenv("OLLAMA_CONTEXT_SIZE", "32768")),
-                    "stop": ["\n\n\n"]  # Only stop on triple newlines
-                }
-            },
-            timeout=90
+        document_summary_json = _stored_summary_or_generate(
+            lambda: _summarize_document_ollama(file_text, filename, ai_client, org_id),
+            filename, org_id, f"ollama:{model}", content_sha256, document_id
         )
-        
-        if scan_response.status_code != 200:
-            logger.error(f"Step 1 failed for {filename}: {scan_response.status_code}")
-            return generate_fallback_suggestions_from_filename(filename, available_controls)
-        
-        scan_result = scan_response.json()
-        
-        # Use only generate API response format
-        document_summary_raw = scan_result.get('response', '')
-        logger.info(f"Step 1: Using generate API response for {filename}")
-        
-        # NEVER use thinking field - log but ignore
-        if 'thinking' in scan_result and scan_result.get('thinking'):
-            logger.info(f"Step 1: Thinking field ignored for {filename}: {scan_result.get('thinking', '')[:100]}...")
-        
-        if not document_summary_raw:
-            logger.warning(f"Step 1 produced empty summary for {filename}")
-            return generate_fallback_suggestions_from_filename(filename, available_controls)
-        
-        logger.info(f"Step 1 raw response for {filename}: {document_summary_raw[:300]}...")
-        
-        # Parse the JSON summary from Step 1
-        document_summary_json = _extract_json_from_response(document_summary_raw)
         if not document_summary_json:
-            logger.warning(f"Step 1 failed to produce valid JSON for {filename}")
-            return generate_fallback_suggestions_from_filename(filename, available_controls)
-        
-        logger.info(f"Step 1 JSON summary for {filename}: {document_summary_json}")
+            return _two_step_failed(filename, available_controls, fallback)
         
         # Step 2: Control Mapping using the JSON from Step 1
-        controls_json = []
-        for i, control in enumerate(available_controls[:50], 1):
-            controls_json.append({
-                "number": i,
-                "code": control['code'],
-                "title": control['title'],
-                "framework": control.get('framework', 'Unknown')
-            })
-
-        mapping_prompt = f"""Document Summary: {json_module.dumps(document_summary_json, indent=2)}
+        candidates = _shortlist_controls(available_controls, document_summary_json, filename)
+        controls_json = _pack_controls_catalog(candidates, document_summary_json, context_tokens, 600, filename)
 
-Available Controls: {json_module.dumps(controls_json, indent=2)}
-
-Identify ALL controls from ANY framework that this document provides evidence for.
-Return up to 10 matches as a JSON array, ordered by confidence (highest first).
-Only include controls with genuine relevance (confidence >= 0.5).
-
-Return JSON only:
-{{"selected_controls":[{{"number":1,"confidence":0.90,"reasoning":"Brief match explanation"}},{{"number":4,"confidence":0.75,"reasoning":"Brief match explanation"}}]}}"""
+        mapping_prompt = _control_mapping_prompt(document_summary_json, controls_json)
         
         logger.info(f"Step 2: JSON mapping controls for {filename}")
         
         # Use only generate API for completions
-        mapping_response = requests.post(
-            f"{endpoint}/api/generate",
-            json={
+        mapping_response = cached_ollama_generate(
+            endpoint,
+            {
                 "model": model,
                 "prompt": mapping_prompt,
                 "stream": False,
+                "format": ollama_format(_CONTROL_MAPPING_SCHEMA),
                 "options": {
                     "temperature": 0.1,
                     "num_predict": 600,  # Increased for complete JSON responses with reasoning
-                    "num_ctx": int(os.getenv("OLLAMA_CONTEXT_SIZE", "32768")),
+                    "num_ctx": context_tokens,
                     "stop": ["\n\n\n"]  # Only stop on triple newlines
                 }
             },
-            timeout=90
+            timeout=90,
+            org_id=org_id,
+            validate=json_reply_check()
         )
         
         if mapping_response.status_code != 200:
             logger.error(f"Step 2 failed for {filename}: {mapping_response.status_code}")
-            return generate_fallback_suggestions_from_filename(filename, available_controls)
+            return _two_step_failed(filename, available_controls, fallback)
         
         mapping_result = mapping_response.json()
         
@@ -170,24 +323,84 @@ Return JSON only:
         
         if not mapping_text_raw:
             logger.warning(f"Step 2 produced empty mapping for {filename}")
-            return generate_fallback_suggestions_from_filename(filename, available_controls)
+            return _two_step_failed(filename, available_controls, fallback)
         
         logger.info(f"Step 2 raw response for {filename}: {mapping_text_raw}")
         
         # Parse the JSON mapping result from Step 2
-        mapping_json = _extract_json_from_response(mapping_text_raw)
+        mapping_json = extract_json(mapping_text_raw)
         if not mapping_json:
             logger.warning(f"Step 2 failed to produce valid JSON for {filename}")
-            return generate_fallback_suggestions_from_filename(filename, available_controls)
+            return _two_step_failed(filename, available_controls, fallback)
         
         logger.info(f"Step 2 JSON mapping for {filename}: {mapping_json}")
         
         # Convert the JSON result to the expected format
-        return _convert_json_mapping_to_suggestions(mapping_json, available_controls, controls_json)
+        return _convert_json_mapping_to_suggestions(mapping_json, candidates, controls_json)
         
     except Exception as e:
         logger.error(f"JSON-to-JSON two-step analysis failed for {filename}: {e}")
-        return generate_fallback_suggestions_from_filename(filename, available_controls)
+        return _two_step_failed(filename, available_controls, fallback)
+
+# Fixed head of the step-2 prompt; it comes first so Ollama can reuse the KV
+# cache for it across documents (the shortlist and summary vary per document).
+_CONTROL_MAPPING_INSTRUCTIONS = """Identify ALL controls from ANY framework that the document summarised below provides evidence for.
+Return up to 10 matches as a JSON array, ordered by confidence (highest first).
+Only include controls with genuine relevance (confidence >= 0.5).
+Use the "number" of each control in Available Controls.
+
+Return JSON only:
+{"selected_controls":[{"number":1,"confidence":0.90,"reasoning":"Brief match explanation"},{"number":4,"confidence":0.75,"reasoning":"Brief match explanation"}]}
+"""
+
+
+def _control_mapping_prompt(document_summary_json: dict, controls_json: List[dict]) -> str:
+    """Step-2 prompt: fixed instructions, then the candidate controls, then the document summary."""
+    return (f"{_CONTROL_MAPPING_INSTRUCTIONS}\n"
+            f"Available Controls: {json.dumps(controls_json, indent=2)}\n\n"
+            f"Document Summary: {json.dumps(document_summary_json, indent=2)}\n\n"
+            "Return JSON only.")
+
+
+def _shortlist_controls(available_controls: List[dict], document_summary_json: dict, filename: str) -> List[dict]:
+    """Controls most similar to the step-1 summary, from every framework, for the step-2 prompt."""
+    candidates = control_index.shortlist(available_controls, f"{filename} {summary_text(document_summary_json)}")
+    if len(candidates) < len(available_controls):
+        logger.info(f"Step 2 shortlist for {filename}: {len(candidates)} of {len(available_controls)} controls "
+                    f"({', '.join(c['code'] for c in candidates[:5])}...)")
+    return candidates
+
+def _pack_controls_catalog(available_controls: List[dict], document_summary_json: dict,
+                           context_tokens: int, reserve_output_tokens: int, filename: str) -> List[dict]:
+    """
+    Number as many controls as fit in the step-2 mapping prompt.
+
+    Controls are the lowest-priority section, so they get what is left after the
+    document summary, instructions and output reservation. Only a prefix is kept
+    so numbers still index available_controls.
+    """
+    import json as json_module
+
+    budget = PromptBudget(context_tokens, reserve_output_tokens)
+    budget.reserve(json_module.dumps(document_summary_json, indent=2))
+    # The rest of _control_mapping_prompt's fixed text
+    budget.reserve(_CONTROL_MAPPING_INSTRUCTIONS + "Available Controls: \n\nDocument Summary: \n\nReturn JSON only.")
+
+    controls_json = [
+        {
+            "number": i,
+            "code": control['code'],
+            "title": control['title'],
+            "framework": control.get('framework', 'Unknown'),
+        }
+        for i, control in enumerate(available_controls, 1)
+    ]
+    kept = budget.fit_items(
+        "controls", controls_json, lambda c: json_module.dumps(c, indent=4) + ",\n", contiguous=True
+    )
+    if budget.lossy:
+        logger.info(f"Step 2 prompt for {filename}: {budget.summary()}")
+    return controls_json[:len(kept)]
 
 def _convert_json_mapping_to_suggestions(mapping_json: dict, available_controls: List[dict], controls_json: List[dict]) -> List[dict]:
     """Convert JSON mapping result to the expected suggestions format"""
@@ -247,74 +460,95 @@ def _parse_structured_control_response(response_text: str, available_controls: L
         logger.error(f"Failed to parse structured response: {e}")
         return []
 
-def _analyze_document_openai_two_step(file_text: str, filename: str, available_controls: List[dict], ai_client) -> List[dict]:
+@llm_call_site("step1")
+def _summarize_document_openai(file_text: str, filename: str, ai_client, model: str, org_id=None) -> Optional[dict]:
+    """Step 1 for OpenAI-compatible endpoints: JSON summary of the document, or None."""
+    context_tokens = context_window(ai_client)
+
+    scan_instructions = """Return a JSON summary:
+{"document_type":"<type>","primary_topic":"<topic>","key_content_indicators":["<keyword>"],"security_areas":["<domain>"],"main_requirements":["<requirement>"],"distinguishing_features":"<what makes this unique>"}"""
+    document_text, budget = pack_document(
+        file_text, context_tokens, 500,
+        template_text=f"Analyze document: {filename}\nContent: \n\n{scan_instructions}"
+    )
+    if budget.lossy:
+        logger.info(f"OpenAI Step 1 prompt for {filename}: {budget.summary()}")
+    scan_prompt = f"""Analyze document: {filename}
+Content: {document_text}
+
+{scan_instructions}"""
+
+    scan_response = structured_chat_completion(
+        ai_client,
+        schema=_DOCUMENT_SUMMARY_SCHEMA,
+        org_id=org_id,
+        model=model,
+        messages=[{"role": "user", "content": scan_prompt}],
+        temperature=0.1,
+        max_tokens=500,
+        validate=json_reply_check(),
+    )
+    document_summary_raw = scan_response.choices[0].message.content or ""
+    logger.info(f"OpenAI Step 1 raw for {filename}: {document_summary_raw[:200]}")
+
+    document_summary_json = extract_json(document_summary_raw)
+    if not document_summary_json:
+        logger.warning(f"OpenAI Step 1 failed to produce JSON for {filename}")
+        return None
+    return document_summary_json
+
+@llm_call_site("step2")
+def _analyze_document_openai_two_step(file_text: str, filename: str, available_controls: List[dict], ai_client, org_id=None,
+                                      content_sha256: Optional[str] = None, document_id=None,
+                                      model: Optional[str] = None, fallback: bool = True) -> Optional[List[dict]]:
     """Two-step analysis for OpenAI: summarise then map to ALL relevant controls."""
     import json as json_module
 
     try:
-        model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-
-        # Step 1: summarise document
-        scan_prompt = f"""Analyze document: {filename}
-Content: {file_text[:5000]}
+        model = model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        context_tokens = context_window(ai_client)
 
-Return a JSON summary:
-{{"document_type":"<type>","primary_topic":"<topic>","key_content_indicators":["<keyword>"],"security_areas":["<domain>"],"main_requirements":["<requirement>"],"distinguishing_features":"<what makes this unique>"}}"""
-
-        scan_response = ai_client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": scan_prompt}],
-            temperature=0.1,
-            max_tokens=500,
+        # Step 1: summarise document (or reuse the stored summary)
+        document_summary_json = _stored_summary_or_generate(
+            lambda: _summarize_document_openai(file_text, filename, ai_client, model, org_id),
+            filename, org_id, f"openai:{model}", content_sha256, document_id
         )
-        document_summary_raw = scan_response.choices[0].message.content or ""
-        logger.info(f"OpenAI Step 1 raw for {filename}: {document_summary_raw[:200]}")
-
-        document_summary_json = _extract_json_from_response(document_summary_raw)
         if not document_summary_json:
-            logger.warning(f"OpenAI Step 1 failed to produce JSON for {filename}")
-            return generate_fallback_suggestions_from_filename(filename, available_controls)
+            return _two_step_failed(filename, available_controls, fallback)
 
         # Step 2: map to controls
-        controls_json = []
-        for i, control in enumerate(available_controls, 1):
-            controls_json.append({
-                "number": i,
-                "code": control['code'],
-                "title": control['title'],
-                "framework": control.get('framework', 'Unknown'),
-            })
-
-        mapping_prompt = f"""Document Summary: {json_module.dumps(document_summary_json, indent=2)}
-
-Available Controls: {json_module.dumps(controls_json, indent=2)}
-
-Identify ALL controls from ANY framework that this document provides evidence for.
-Return up to 10 matches as a JSON array, ordered by confidence (highest first).
-Only include controls with genuine relevance (confidence >= 0.5).
+        candidates = _shortlist_controls(available_controls, document_summary_json, filename)
+        controls_json = _pack_controls_catalog(candidates, document_summary_json, context_tokens, 800, filename)
 
-Return JSON only:
-{{"selected_controls":[{{"number":1,"confidence":0.90,"reasoning":"Brief match explanation"}},{{"number":4,"confidence":0.75,"reasoning":"Brief match explanation"}}]}}"""
+        mapping_prompt = _control_mapping_prompt(document_summary_json, controls_json)
 
-        mapping_response = ai_client.chat.completions.create(
+        mapping_response = structured_chat_completion(
+            ai_client,
+            schema=_CONTROL_MAPPING_SCHEMA,
+            org_id=org_id,
             model=model,
             messages=[{"role": "user", "content": mapping_prompt}],
             temperature=0.1,
             max_tokens=800,
+            validate=json_reply_check(),
         )
         mapping_text_raw = mapping_response.choices[0].message.content or ""
         logger.info(f"OpenAI Step 2 raw for {filename}: {mapping_text_raw}")
 
-        mapping_json = _extract_json_from_response(mapping_text_raw)
+        mapping_json = extract_json(mapping_text_raw)
         if not mapping_json:
             logger.warning(f"OpenAI Step 2 failed to produce JSON for {filename}")
-            return generate_fallback_suggestions_from_filename(filename, available_controls)
+            return _two_step_failed(filename, available_controls, fallback)
 
-        return _convert_json_mapping_to_suggestions(mapping_json, available_controls, controls_json)
+        return _convert_json_mapping_to_suggestions(mapping_json, candidates, controls_json)
 
     except Exception as e:
         logger.error(f"OpenAI two-step analysis failed for {filename}: {e}")
-        return generate_fallback_suggestions_from_filename(filename, available_controls)
+        return _two_step_failed(filename, available_controls, fallback)
+
+def _two_step_failed(filename: str, available_controls: List[dict], fallback: bool) -> Optional[List[dict]]:
+    """Result of a failed two-step analysis: filename-based suggestions, or None when fallback is off."""
+    return generate_fallback_suggestions_from_filename(filename, available_controls) if fallback else None
 
 def generate_fallback_suggestions_from_filename(filename: str, available_controls: List[dict]) -> List[dict]:
     """Generate control suggestions based on filename when AI analysis fails."""
@@ -367,122 +601,6 @@ def generate_fallback_suggestions_from_filename(filename: str, available_control
     # Return top 3 suggestions
     return sorted(suggestions, key=lambda x: x['confidence'], reverse=True)[:3]
 
-def _extract_json_content_only(response_text):
-    """Extract just the JSON object as a string, no parsing."""
-    if not response_text:
-        return None
-
-    import re
-
-    # Clean the response first
-    response_text = response_text.strip()
-
-    # If it already looks like valid JSON, return it
-    if response_text.startswith('{') and response_text.endswith('}'):
-        return response_text
-
-    # Try to find the outermost JSON object by counting braces
-    start_idx = response_text.find('{')
-    if start_idx == -1:
-        return None
-
-    brace_count = 0
-    end_idx = start_idx
-
-    for i in range(start_idx, len(response_text)):
-        if response_text[i] == '{':
-            brace_count += 1
-        elif response_text[i] == '}':
-            brace_count -= 1
-            if brace_count == 0:
-                end_idx = i + 1
-                break
-
-    if brace_count == 0 and end_idx > start_idx:
-        return response_text[start_idx:end_idx].strip()
-
-    return None
-
-def _extract_json_from_response(response_text):
-    """Extract JSON from a response that might contain extra text."""
-    if not response_text:
-        logger.warning("Empty response text for JSON extraction")
-        return None
-    
-    # Try to find JSON object in the response
-    import re
-    import json
-    
-    # Clean the response text
-    response_text = response_text.strip()
-    logger.info(f"Extracting JSON from response (length: {len(response_text)}): {response_text[:200]}...")
-    
-    # First, try to parse the entire response as JSON
-    try:
-        parsed = json.loads(response_text)
-        if isinstance(parsed, dict):
-            logger.info("Successfully parsed entire response as JSON")
-            return parsed
-    except json.JSONDecodeError:
-        pass
-    
-    # Look for JSON object patterns (more comprehensive)
-    json_patterns = [
-        r'\{[^{}]*"document_type"[^{}]*\}',  # Document summary JSON
-        r'\{[^{}]*"selected_control_number"[^{}]*\}',  # Control mapping JSON
-        r'\{[^{}]*"suggestions"[^{}]*\[[^\]]*\][^{}]*\}',  # Suggestions JSON
-        r'\{.*?"suggestions".*?\[.*?\].*?\}',  # More flexible suggestions pattern
-        r'\{[\s\S]*?\}',  # Any JSON object (non-greedy)
-    ]
-    
-    for i, pattern in enumerate(json_patterns):
-        matches = re.findall(pattern, response_text, re.DOTALL)
-        for match in matches:
-            try:
-                # Clean the match
-                cleaned_match = match.strip()
-                parsed = json.loads(cleaned_match)
-                if isinstance(parsed, dict):
-                    logger.info(f"Successfully extracted JSON using pattern {i}: {cleaned_match[:100]}...")
-                    return parsed
-            except json.JSONDecodeError:
-                continue
-    
-    # Try to find JSON between code block markers
-    code_block_patterns = [
-        r'```json\s*(\{.*?\})\s*```',
-        r'```\s*(\{.*?\})\s*```',
-    ]
-    
-    for pattern in code_block_patterns:
-        matches = re.findall(pattern, response_text, re.DOTALL)
-        for match in matches:
-            try:
-                parsed = json.loads(match.strip())
-                if isinstance(parsed, dict):
-                    return parsed
-            except json.JSONDecodeError:
-                continue
-    
-    # Try the whole response as-is
-    try:
-        return json.loads(response_text)
-    except json.JSONDecodeError:
-        pass
-    
-    # Last resort: try to extract just the JSON portion
-    try:
-        # Find first { and last }
-        start = response_text.find('{')
-        end = response_text.rfind('}')
-        if start >= 0 and end > start:
-            json_portion = response_text[start:end+1]
-            return json.loads(json_portion)
-    except (json.JSONDecodeError, ValueError):
-        pass
-    
-    return None
-
 def _safe_json_loads(json_data, default=None):
     """Safely parse JSON data from JSONB columns, which are already parsed by PostgreSQL."""
     if json_data is None:
@@ -512,6 +630,17 @@ async def lifespan(app: FastAPI):
         logger.error("Database initialization failed!")
         raise RuntimeError("Database initialization failed")
     
+    # Build the control shortlist index before the first analysis needs it
+    try:
+        from database import SessionLocal
+        db = SessionLocal()
+        try:
+            control_index.catalog(db)
+        finally:
+            db.close()
+    except Exception as e:
+        logger.warning(f"Control index not built at startup, will build on first analysis: {e}")
+    
     # Start the periodic AI retry task
     retry_task = asyncio.create_task(periodic_ai_retry_task())
     logger.info("Started periodic AI retry task")
@@ -525,6 +654,7 @@ async def lifespan(app: FastAPI):
         await retry_task
     except asyncio.CancelledError:
         logger.info("Periodic AI retry task cancelled")
+    close_ai_pools()
 
 app = FastAPI(
     title="GeekyGoose Compliance API",
@@ -565,33 +695,31 @@ ALLOWED_MIME_TYPES = {
 
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 
-async def analyze_file_content_for_controls(file: UploadFile, file_content: bytes, org_id) -> list:
-    """Analyze file content and suggest relevant compliance controls (scoped to org_id's AI settings)."""
+@llm_call_site("analyze-text")
+async def analyze_file_content_for_controls(file: UploadFile, file_content: bytes, org_id, document_id=None,
+                                            ai_client=None, cancel: Optional[threading.Event] = None) -> list:
+    """
+    Analyze file content and suggest relevant compliance controls (scoped to org_id's AI settings).
+
+    Step-1 summaries are looked up by the content's sha256 and stored against
+    document_id when one is given. ai_client overrides the org's configured
+    provider (dual-vision validation passes each vision client in turn).
+    Once cancel is set, no further model calls are started and [] is returned.
+    """
+    override_client = ai_client
     try:
         # Get available templates/controls from the database
         from database import SessionLocal
         db = SessionLocal()
         
         try:
-            # Get all controls from database
-            controls = db.query(Control).all()
-            logger.info(f"Found {len(controls)} controls in database for analysis")
+            # All controls, from the control index (rebuilt only when the catalog changes)
+            available_controls = control_index.catalog(db)
+            logger.info(f"Found {len(available_controls)} controls in database for analysis")
             
-            if not controls:
+            if not available_controls:
                 logger.warning("No controls found in database - cannot provide AI analysis")
                 return []
-            
-            # Convert to the format expected by our analysis
-            available_controls = []
-            for control in controls:
-                available_controls.append({
-                    'code': control.code,
-                    'title': control.title,
-                    'framework': getattr(control.framework, 'name', 'Unknown') if hasattr(control, 'framework') else 'Unknown',
-                    'description': control.description or '',
-                })
-            
-            logger.info(f"Prepared {len(available_controls)} controls for AI analysis")
         finally:
             db.close()
         
@@ -612,54 +740,7 @@ async def analyze_file_content_for_controls(file: UploadFile, file_content: byte
             file_mime = getattr(file, 'content_type', 'text/plain')
         
         file_content_type = getattr(file, 'content_type', 'text/plain')
-        if file_mime == "text/plain" or file_content_type == "text/plain" or filename.lower().endswith(('.txt', '.md', '.csv')):
-            try:
-                import chardet
-                # Detect encoding for better text extraction
-                detected = chardet.detect(file_content)
-                encoding = detected.get('encoding') or 'utf-8'
-                file_text = file_content.decode(encoding, errors='ignore')[:2000]  # Limit to first 2000 chars
-            except Exception as e:
-                try:
-                    file_text = file_content.decode('utf-8', errors='ignore')[:2000]
-                except:
-                    file_text = f"Text file: {filename} (encoding issue)"
-                
-        elif file_mime == "application/pdf" or file.content_type == "application/pdf" or filename.lower().endswith('.pdf'):
-            try:
-                import fitz  # PyMuPDF
-                import pdfplumber
-                
-                # Try PyMuPDF first (faster)
-                try:
-                    pdf_doc = fitz.open(stream=file_content, filetype="pdf")
-                    text_pages = []
-                    for page_num in range(min(3, pdf_doc.page_count)):  # First 3 pages
-                        page = pdf_doc[page_num]
-                        page_text = page.get_text()
-                        if page_text.strip():
-                            text_pages.append(page_text[:800])  # More text per page
-                    
-                    pdf_doc.close()
-                    file_text = " ".join(text_pages)
-                except Exception:
-                    # Fallback to pdfplumber for more complex PDFs
-                    import io
-                    with pdfplumber.open(io.BytesIO(file_content)) as pdf:
-                        text_pages = []
-                        for i, page in enumerate(pdf.pages[:3]):
-                            page_text = page.extract_text()
-                            if page_text:
-                                text_pages.append(page_text[:800])
-                        file_text = " ".join(text_pages)
-                
-                if not file_text.strip():
-                    file_text = f"PDF document: {filename} (text extraction failed)"
-            except Exception as e:
-                logger.warning(f"PDF extraction failed for {filename}: {e}")
-                file_text = f"PDF document: {filename} (text extraction failed)"
-                
-        elif (file_mime and file_mime.startswith("image/")) or (file.content_type and file.content_type.startswith("image/")) or filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
+        if (file_mime and file_mime.startswith("image/")) or (file.content_type and file.content_type.startswith("image/")) or filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
             # Enhanced image processing with OCR fallback
             try:
                 from ai_scanner import get_ai_client
@@ -689,119 +770,66 @@ async def analyze_file_content_for_controls(file: UploadFile, file_content: byte
                 except Exception:
                     processed_content = file_content
                 
-                ai_client = get_ai_client(org_id)
+                ai_client = override_client or get_ai_client(org_id)
                 image_b64 = base64.b64encode(processed_content).decode('utf-8')
                 
                 if not isinstance(ai_client, dict):  # OpenAI
                     try:
-                        response = ai_client.chat.completions.create(
-                            model="gpt-4o",  # Updated to latest vision model
-                            messages=[
-                                {
-                                    "role": "user",
-                                    "content": [
-                                        {
-                                            "type": "text",
-                                            "text": f"Analyze this image thoroughly and describe any visible text, error messages, security configurations, system interfaces, compliance-related information, policies, procedures, or other relevant content you can see. Focus on compliance and security aspects. Image: {filename}"
-                                        },
-                                        {
-                                            "type": "image_url",
-                                            "image_url": {
-                                                "url": f"data:image/jpeg;base64,{image_b64}",
-                                                "detail": "high"  # High detail for better text recognition
+                        with llm_call_site("vision"):
+                            response = guarded_chat_completion(
+                                ai_client, org_id=org_id,
+                                model="gpt-4o",  # Updated to latest vision model
+                                messages=[
+                                    {
+                                        "role": "user",
+                                        "content": [
+                                            {
+                                                "type": "text",
+                                                "text": f"Analyze this image thoroughly and describe any visible text, error messages, security configurations, system interfaces, compliance-related information, policies, procedures, or other relevant content you can see. Focus on compliance and security aspects. Image: {filename}"
+                                            },
+                                            {
+                                                "type": "image_url",
+                                                "image_url": {
+                                                    "url": f"data:image/jpeg;base64,{image_b64}",
+                                                    "detail": "high"  # High detail for better text recognition
+                                                }
                                             }
-                                        }
-                                    ]
-                                }
-                            ],
-                            max_tokens=500
-                        )
+                                        ]
+                                    }
+                                ],
+                                max_tokens=500
+                            )
                         file_text = f"Image analysis: {response.choices[0].message.content}"
                     except Exception as e:
                         logger.warning(f"Vision AI failed for {filename}: {e}")
                         # Fallback to OCR
-                        try:
-                            import pytesseract
-                            from PIL import Image
-                            image = Image.open(io.BytesIO(file_content))
-                            ocr_text = pytesseract.image_to_string(image)
-                            if ocr_text.strip():
-                                file_text = f"OCR extracted text from {filename}: {ocr_text[:500]}"
-                            else:
-                                file_text = f"Screenshot/Image: {filename} (no text detected)"
-                        except Exception:
-                            file_text = f"Screenshot/Image: {filename}"
+                        ocr_text = extraction_service.text(file_content, filename, file_content_type,
+                                                           document_id=document_id, max_chars=500)
+                        if ocr_text:
+                            file_text = f"OCR extracted text from {filename}: {ocr_text}"
+                        else:
+                            file_text = f"Screenshot/Image: {filename} (no text detected)"
                 else:
                     # Try OCR for Ollama users
-                    try:
-                        import pytesseract
-                        from PIL import Image
-                        image = Image.open(io.BytesIO(file_content))
-                        ocr_text = pytesseract.image_to_string(image)
-                        if ocr_text.strip():
-                            file_text = f"OCR extracted text from {filename}: {ocr_text[:500]}"
-                        else:
-                            file_text = f"Screenshot/Image: {filename}"
-                    except Exception:
-                        file_text = f"Image: {filename}"
+                    ocr_text = extraction_service.text(file_content, filename, file_content_type,
+                                                       document_id=document_id, max_chars=500)
+                    if ocr_text:
+                        file_text = f"OCR extracted text from {filename}: {ocr_text}"
+                    else:
+                        file_text = f"Screenshot/Image: {filename}"
             except Exception as e:
                 logger.error(f"Image processing failed for {filename}: {e}")
                 file_text = f"Image: {filename}"
                 
-        elif file_mime == "application/vnd.openxmlformats-officedocument.wordprocessingml.document" or filename.lower().endswith('.docx'):
-            # Enhanced Word document processing
-            try:
-                from docx import Document
-                import io
-                
-                doc = Document(io.BytesIO(file_content))
-                paragraphs = []
-                for para in doc.paragraphs:
-                    if para.text.strip():
-                        paragraphs.append(para.text)
-                
-                # Also extract text from tables
-                for table in doc.tables:
-                    for row in table.rows:
-                        for cell in row.cells:
-                            if cell.text.strip():
-                                paragraphs.append(cell.text)
-                
-                file_text = "\n".join(paragraphs[:30])  # First 30 paragraphs/cells
-                if not file_text.strip():
-                    file_text = f"Word document: {filename} (text extraction failed)"
-            except Exception as e:
-                logger.warning(f"Word document processing failed for {filename}: {e}")
-                file_text = f"Word document: {filename} (text extraction failed)"
-                
-        elif filename.lower().endswith(('.html', '.htm')):
-            # HTML document processing
-            try:
-                from bs4 import BeautifulSoup
-                soup = BeautifulSoup(file_content, 'html.parser')
-                # Remove script and style elements
-                for script in soup(["script", "style"]):
-                    script.decompose()
-                file_text = soup.get_text()[:2000]
-            except Exception:
-                file_text = f"HTML document: {filename}"
-                
-        elif filename.lower().endswith('.md'):
-            # Markdown document processing
-            try:
-                import markdown
-                md_text = file_content.decode('utf-8', errors='ignore')
-                html = markdown.markdown(md_text)
-                from bs4 import BeautifulSoup
-                soup = BeautifulSoup(html, 'html.parser')
-                file_text = soup.get_text()[:2000]
-            except Exception:
-                try:
-                    file_text = file_content.decode('utf-8', errors='ignore')[:2000]
-                except:
-                    file_text = f"Markdown document: {filename}"
         else:
-            file_text = f"Document: {filename} (type: {file_mime or file.content_type})"
+            # PDF, Word, text, Markdown, HTML: the extraction worker's pages when it has already run
+            file_text = extraction_service.text(file_content, filename, file_content_type, document_id=document_id)
+            if not file_text:
+                file_text = f"Document: {filename} (type: {file_mime or file.content_type}, no text extracted)"
+
+        if cancel is not None and cancel.is_set():
+            logger.info(f"Analysis of {filename} cancelled before control mapping")
+            return []
         
         # Create analysis prompt
         controls_context = "\n".join([
@@ -840,16 +868,19 @@ Do not include any text before or after the JSON. Return empty suggestions array
         try:
             from ai_scanner import get_ai_client
             logger.info(f"Attempting to get AI client for {filename}")
-            ai_client = get_ai_client(org_id)
+            ai_client = override_client or get_ai_client(org_id)
             logger.info(f"AI client initialized: {type(ai_client)}")
             
-            # Use the new two-step analysis approach
+            # Use the new two-step analysis approach (small model first if the org cascades)
             logger.info(f"Starting two-step analysis for {filename}")
-            suggested_controls = _analyze_document_two_step(
+            suggested_controls = _analyze_document_cascade(
                 file_text=file_text,
                 filename=filename,
                 available_controls=available_controls,
-                ai_client=ai_client
+                ai_client=ai_client,
+                org_id=org_id,
+                content_sha256=hashlib.sha256(file_content).hexdigest() if file_content else None,
+                document_id=document_id
             )
             
             if suggested_controls:
@@ -857,21 +888,19 @@ Do not include any text before or after the JSON. Return empty suggestions array
                 return suggested_controls
             else:
                 logger.warning(f"Two-step analysis failed for {filename}, falling back to original method")
+            if cancel is not None and cancel.is_set():
+                logger.info(f"Analysis of {filename} cancelled before the fallback method")
+                return []
             
             # Fallback to original method if two-step fails
             if isinstance(ai_client, dict) and ai_client.get('type') == 'ollama':
-                import requests
                 endpoint = ai_client['endpoint']
                 model = ai_client['model']
                 logger.info(f"Using Ollama at {endpoint} with model {model}")
                 
-                # Test Ollama connectivity first
+                # Test Ollama connectivity first (cached; fails fast while the circuit is open)
                 try:
-                    test_response = requests.get(f"{endpoint}/api/tags", timeout=10)
-                    logger.info(f"Ollama connectivity test: {test_response.status_code}")
-                    if test_response.status_code != 200:
-                        logger.error(f"Ollama not reachable at {endpoint}")
-                        return generate_fallback_suggestions_from_filename(filename, available_controls)
+                    provider_health.check_ollama(endpoint, timeout=10)
                 except Exception as conn_error:
                     logger.error(f"Cannot connect to Ollama at {endpoint}: {conn_error}")
                     return generate_fallback_suggestions_from_filename(filename, available_controls)
@@ -888,12 +917,13 @@ Respond with JSON only:
                 logger.info(f"Sending prompt to Ollama (length: {len(simple_prompt)})")
                 
                 # Use only generate API for completions
-                response = requests.post(
-                    f"{endpoint}/api/generate",
-                    json={
+                response = cached_ollama_generate(
+                    endpoint,
+                    {
                         "model": model,
                         "prompt": simple_prompt,
                         "stream": False,
+                        "format": ollama_format(_CONTROL_SUGGESTIONS_SCHEMA),
                         "options": {
                             "temperature": 0.1,  # Slightly higher for more flexibility
                             "num_predict": 2000,  # Increased for models with thinking mode
@@ -903,7 +933,8 @@ Respond with JSON only:
                             "repeat_penalty": 1.0,
                         }
                     },
-                    timeout=60
+                    timeout=60,
+                    org_id=org_id
                 )
                 
                 logger.info(f"Ollama response status: {response.status_code}")
@@ -925,10 +956,10 @@ Respond with JSON only:
                         logger.info(f"Content empty, checking thinking field for JSON: '{thinking_content[:200]}...'")
                         
                         # Try to extract JSON from thinking field
-                        extracted_json = _extract_json_content_only(thinking_content)
+                        extracted_json = extract_json(thinking_content, required_keys=("suggestions",))
                         if extracted_json:
                             logger.info(f"Found valid JSON in thinking field, using it: {extracted_json}")
-                            ai_response = extracted_json
+                            ai_response = json_module.dumps(extracted_json)
                         else:
                             logger.warning(f"No valid JSON found in thinking field for {filename}")
                     elif 'thinking' in result and result.get('thinking'):
@@ -937,30 +968,17 @@ Respond with JSON only:
                     logger.info(f"Raw AI response for {filename}: \"{ai_response[:200]}...\"")
                     logger.info(f"Response length: {len(ai_response)}")
                     
-                    # Force clean JSON extraction if the response contains explanatory text
-                    if ai_response and ("We need" in ai_response or "Looking at" in ai_response or "The document" in ai_response):
-                        logger.warning(f"Response contains explanatory text, attempting JSON extraction")
-                        extracted_json = _extract_json_content_only(ai_response)
-                        if extracted_json:
-                            logger.info(f"Extracted JSON: {extracted_json}")
-                            ai_response = extracted_json
-                        else:
-                            logger.error(f"No valid JSON found in explanatory response")
-                            return generate_fallback_suggestions_from_filename(filename, available_controls)
-                    
                     if not ai_response:
                         logger.warning(f"AI scanning failed for {filename} - no valid response generated")
                         logger.info(f"Ollama result object: {result}")
                         return []  # Simple empty result instead of filename fallback
                     
-                    # Force JSON format validation
-                    if not ai_response.strip().startswith('{') or not ai_response.strip().endswith('}'):
-                        logger.warning(f"Response doesn't look like JSON for {filename}: {ai_response[:100]}")
-                        # Try to extract any JSON from the response
-                        ai_response = _extract_json_content_only(ai_response)
-                        if not ai_response:
-                            logger.error(f"No valid JSON found in response for {filename}")
-                            return generate_fallback_suggestions_from_filename(filename, available_controls)
+                    # Strip any explanatory text or fences around the JSON answer
+                    extracted_json = extract_json(ai_response, required_keys=("suggestions",))
+                    if not extracted_json:
+                        logger.error(f"No valid JSON found in response for {filename}: {ai_response[:100]}")
+                        return generate_fallback_suggestions_from_filename(filename, available_controls)
+                    ai_response = json_module.dumps(extracted_json)
                 else:
                     logger.error(f"Ollama error: {response.status_code} - {response.text[:200]}")
                     return generate_fallback_suggestions_from_filename(filename, available_controls)
@@ -979,7 +997,8 @@ Respond with JSON only:
                             {"role": "user", "content": "Respond with just the JSON: {\"test\": \"success\"}"}
                         ],
                         max_tokens=50,
-                        temperature=0.1
+                        temperature=0.1,
+                        cache=False  # A connectivity probe must really hit the endpoint
                     )
                     test_content = test_response.choices[0].message.content
                     logger.info(f"AI test response: '{test_content}'")
@@ -1001,7 +1020,8 @@ Respond with JSON only:
                         ],
                         max_tokens=500,  # Reduced tokens
                         temperature=0.3,
-                        use_json_mode=True  # Try JSON mode with fallback
+                        json_schema=_CONTROL_SUGGESTIONS_SCHEMA,  # Structured output, with fallbacks
+                        org_id=org_id
                     )
                     ai_response = response.choices[0].message.content
                     logger.info(f"OpenAI analysis response received, length: {len(ai_response) if ai_response else 0}")
@@ -1028,17 +1048,17 @@ Respond with ONLY this JSON structure:
                                 messages=[{"role": "user", "content": simple_prompt}],
                                 max_tokens=200,
                                 temperature=0.3,
-                                use_json_mode=True
+                                json_schema=_CONTROL_SUGGESTIONS_SCHEMA,
+                                org_id=org_id
                             )
                             simple_ai_response = simple_response.choices[0].message.content
                             logger.info(f"Simple prompt response: {simple_ai_response}")
                             if simple_ai_response and simple_ai_response.strip():
                                 # Try to parse the simple response
-                                try:
-                                    simple_parsed = json_module.loads(simple_ai_response)
+                                simple_parsed = extract_json(simple_ai_response)
+                                if simple_parsed is not None:
                                     return simple_parsed.get('suggestions', [])
-                                except:
-                                    logger.warning("Simple prompt also failed to parse")
+                                logger.warning("Simple prompt also failed to parse")
                         except Exception as simple_error:
                             logger.error(f"Simple prompt also failed: {simple_error}")
                             return generate_fallback_suggestions_from_filename(filename, available_controls)
@@ -1078,40 +1098,13 @@ Respond with ONLY this JSON structure:
                     logger.warning(f"Empty AI response for {filename}")
                     return generate_fallback_suggestions_from_filename(filename, available_controls)
                 
-                # Look for JSON content within the response
-                if '```json' in cleaned_response:
-                    # Extract JSON from markdown code blocks
-                    start = cleaned_response.find('```json') + 7
-                    end = cleaned_response.find('```', start)
-                    if end != -1:
-                        cleaned_response = cleaned_response[start:end].strip()
-                elif '```' in cleaned_response:
-                    # Extract from general code blocks
-                    start = cleaned_response.find('```') + 3
-                    end = cleaned_response.rfind('```')
-                    if end != -1 and end > start:
-                        cleaned_response = cleaned_response[start:end].strip()
-                
-                # Find JSON object in the response
-                json_start = cleaned_response.find('{')
-                json_end = cleaned_response.rfind('}') + 1
-                
-                if json_start != -1 and json_end > json_start:
-                    json_content = cleaned_response[json_start:json_end]
-                    try:
-                        parsed_response = json_module.loads(json_content)
-                    except json_module.JSONDecodeError as json_err:
-                        logger.warning(f"JSON parsing failed for extracted content: {json_err}")
-                        logger.info(f"Extracted JSON content: {repr(json_content[:300])}")
-                        return generate_fallback_suggestions_from_filename(filename, available_controls)
-                else:
-                    try:
-                        parsed_response = json_module.loads(cleaned_response)
-                    except json_module.JSONDecodeError as json_err:
-                        logger.warning(f"JSON parsing failed for full response: {json_err}")
-                        logger.info(f"Cleaned response: {repr(cleaned_response[:300])}")
-                        return generate_fallback_suggestions_from_filename(filename, available_controls)
-                    
+                # Recover the JSON object from code fences or surrounding text
+                parsed_response = extract_json(cleaned_response)
+                if parsed_response is None:
+                    logger.warning(f"No JSON object found in AI response for {filename}")
+                    logger.info(f"Cleaned response: {repr(cleaned_response[:300])}")
+                    return generate_fallback_suggestions_from_filename(filename, available_controls)
+
                 suggestions = parsed_response.get('suggestions', [])
                 
                 # Validate and return suggestions
@@ -1165,10 +1158,11 @@ Respond with ONLY this JSON structure:
         return []
 
 # Ensure the function always returns a list
-async def safe_analyze_file_content_for_controls(file, file_content, org_id):
+async def safe_analyze_file_content_for_controls(file, file_content, org_id, document_id=None, ai_client=None,
+                                                 cancel: Optional[threading.Event] = None):
     """Wrapper for analyze_file_content_for_controls that ensures it always returns a list."""
     try:
-        result = await analyze_file_content_for_controls(file, file_content, org_id)
+        result = await analyze_file_content_for_controls(file, file_content, org_id, document_id, ai_client, cancel)
         if not isinstance(result, list):
             logger.warning(f"analyze_file_content_for_controls returned non-list: {type(result)}")
             return []
@@ -1238,6 +1232,91 @@ async def periodic_ai_retry_task():
             logger.error(f"Error in periodic AI retry task: {e}")
             await asyncio.sleep(300)  # Wait 5 minutes before trying again
 
+async def _run_dual_vision_analyses(vision_clients: Dict[str, dict], make_file, file_content: bytes, org_id,
+                                    document_id) -> Tuple[bool, List[dict]]:
+    """
+    Analyze the document with every vision client concurrently.
+
+    Each provider runs in its own worker thread and event loop, since the
+    analysis makes blocking HTTP calls. All share DUAL_VISION_DEADLINE_SECONDS.
+    As soon as consensus is impossible (a provider failed, returned nothing or
+    picked a different top control than another) the remaining providers are
+    abandoned: a shared cancel event stops them before their next model call
+    (after vision/extraction, before control mapping) and their results are dropped.
+    Returns (agreed, results): agreed is True only when every provider finished
+    with the same top control; results has one entry per finished provider with
+    its top suggestion and elapsed seconds.
+    """
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    # One thread per provider, per call: abandoned calls keep their threads until
+    # they finish, so a shared pool would queue later documents behind them. Not
+    # the loop's default executor either, since asyncio.run() waits for that on exit.
+    executor = ThreadPoolExecutor(max_workers=len(vision_clients), thread_name_prefix="dual-vision")
+    cancel = threading.Event()
+
+    def analyze(provider_name: str, client_info: dict):
+        # OpenAI entries wrap the SDK client; Ollama entries are already the dict two-step analysis expects
+        client = client_info['client'] if client_info.get('type') == 'openai' else client_info
+        provider_started = time.monotonic()
+        try:
+            result = asyncio.run(safe_analyze_file_content_for_controls(
+                make_file(), file_content, org_id, document_id, client, cancel
+            ))
+        except Exception as e:
+            logger.error(f"Dual vision analysis failed for {provider_name}: {e}")
+            result = []
+        return result, time.monotonic() - provider_started
+
+    pending = {}
+    for provider_name, client_info in vision_clients.items():
+        logger.info(f"Analyzing with {provider_name} - {client_info['model']}")
+        future = loop.run_in_executor(executor, analyze, provider_name, client_info)
+        pending[future] = (provider_name, client_info)
+
+    dual_results: List[dict] = []
+    timings: Dict[str, str] = {}
+    deadline = started + DUAL_VISION_DEADLINE_SECONDS
+    while pending:
+        remaining = deadline - time.monotonic()
+        done = set()
+        if remaining > 0:
+            done, _ = await asyncio.wait(pending.keys(), timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            logger.warning(f"Dual vision deadline of {DUAL_VISION_DEADLINE_SECONDS:.0f}s reached waiting for "
+                           f"{', '.join(name for name, _ in pending.values())}")
+            break
+        for future in done:
+            provider_name, client_info = pending.pop(future)
+            result, elapsed = future.result()
+            timings[provider_name] = f"{elapsed:.1f}s"
+            dual_results.append({
+                'provider': provider_name,
+                'model': client_info['model'],
+                'result': result[0] if result else None,
+                'elapsed_seconds': elapsed,
+            })
+        codes = {r['result'].get('control_code') if r['result'] else None for r in dual_results}
+        if None in codes or len(codes) > 1:
+            logger.info(f"Dual vision: no consensus possible after {len(dual_results)} of "
+                        f"{len(vision_clients)} providers, not waiting for the rest")
+            break
+
+    if pending:
+        cancel.set()
+    for future, (provider_name, _) in pending.items():
+        future.cancel()
+        timings[provider_name] = "abandoned"
+    executor.shutdown(wait=False)
+
+    slowest = max(dual_results, key=lambda r: r['elapsed_seconds'], default=None)
+    logger.info(f"Dual vision timings for document {document_id}: "
+                f"{', '.join(f'{name} {t}' for name, t in timings.items())}; wall {time.monotonic() - started:.1f}s"
+                + (f", slowest completed: {slowest['provider']}" if slowest else ""))
+    codes = {r['result'].get('control_code') if r['result'] else None for r in dual_results}
+    agreed = len(dual_results) == len(vision_clients) and len(codes) == 1 and None not in codes
+    return agreed, dual_results
+
 async def process_document_ai_analysis_background(document_id: str, filename: str, file_content: bytes, org_id):
     """Process AI analysis in background and store results (scoped to org_id's AI settings)."""
     try:
@@ -1269,8 +1348,10 @@ async def process_document_ai_analysis_background(document_id: str, filename: st
         
         mock_file = MockFile(filename, file_content)
 
-        # Perform the AI analysis
-        suggested_controls = await safe_analyze_file_content_for_controls(mock_file, file_content, org_id)
+        # Perform the AI analysis, tallying its own LLM cache hits and misses
+        with llm_cache.tally() as cache_counts:
+            suggested_controls = await safe_analyze_file_content_for_controls(mock_file, file_content, org_id,
+                                                                              document_id)
         
         if not suggested_controls:
             # Use filename fallback if AI analysis fails - get available controls from database
@@ -1298,7 +1379,7 @@ async def process_document_ai_analysis_background(document_id: str, filename: st
                 logger.error(f"Failed to get fallback suggestions for {filename}: {e}")
                 suggested_controls = []
         
-        logger.info(f"Background AI analysis completed for {filename}: {len(suggested_controls)} suggestions")
+        logger.info(f"Background AI analysis completed for {filename}: {len(suggested_controls)} suggestions (LLM cache: {llm_cache.summary(cache_counts)})")
         
         # Store results in database for later retrieval
         try:
@@ -1309,8 +1390,7 @@ async def process_document_ai_analysis_background(document_id: str, filename: st
             db = SessionLocal()
             
             # Get confidence threshold and dual vision settings for this org
-            from ai_scanner import get_or_create_settings
-            settings = get_or_create_settings(db, org_id)
+            settings = settings_cache.get(org_id)
             min_threshold = settings.min_confidence_threshold if settings.min_confidence_threshold is not None else 0.90
             use_dual_vision = bool(settings.use_dual_vision_validation)
 
@@ -1330,49 +1410,37 @@ async def process_document_ai_analysis_background(document_id: str, filename: st
                     if len(vision_clients) >= 2:
                         logger.info(f"Running dual vision validation with {len(vision_clients)} models")
 
-                        # Re-run analysis with both models
-                        dual_results = []
-                        for provider_name, client_info in vision_clients.items():
-                            try:
-                                logger.info(f"Analyzing with {provider_name} - {client_info['model']}")
-                                # Re-analyze the document with this specific client
-                                mock_file = MockFile(filename, file_content)
-                                result = await safe_analyze_file_content_for_controls(mock_file, file_content, org_id)
-                                if result:
-                                    dual_results.append({
-                                        'provider': provider_name,
-                                        'model': client_info['model'],
-                                        'result': result[0] if result else None
-                                    })
-                            except Exception as e:
-                                logger.error(f"Dual vision analysis failed for {provider_name}: {e}")
-
-                        # Compare results - only proceed if both models agree
-                        if len(dual_results) == 2:
-                            result1 = dual_results[0]['result']
-                            result2 = dual_results[1]['result']
-
-                            if result1 and result2:
-                                control1 = result1.get('control_code')
-                                control2 = result2.get('control_code')
-                                conf1 = result1.get('confidence', 0.0)
-                                conf2 = result2.get('confidence', 0.0)
-
-                                if control1 == control2:
-                                    # Both models agree! Use minimum confidence (most conservative)
-                                    min_conf = min(conf1, conf2)
-                                    logger.info(f"✓ Dual vision CONSENSUS: Both models agree on {control1} (conf: {conf1:.2f} & {conf2:.2f}, using min: {min_conf:.2f})")
-
-                                    # Update suggested_controls with validated result
-                                    suggested_controls = [{
-                                        'control_code': control1,
-                                        'confidence': min_conf,
-                                        'reasoning': f"Dual validation: {dual_results[0]['model']} ({conf1:.2f}) and {dual_results[1]['model']} ({conf2:.2f}) both agree"
-                                    }]
-                                else:
-                                    # Models disagree - reject the link for safety
-                                    logger.warning(f"✗ Dual vision DISAGREEMENT: {dual_results[0]['model']} suggested {control1} ({conf1:.2f}), {dual_results[1]['model']} suggested {control2} ({conf2:.2f}) - NO LINK CREATED")
-                                    suggested_controls = []  # Clear suggestions - no consensus
+                        # Re-run analysis with every model at once, under one deadline
+                        agreed, dual_results = await _run_dual_vision_analyses(
+                            vision_clients, lambda: MockFile(filename, file_content), file_content, org_id, document_id
+                        )
+
+                        # Only link when every model agrees on the top control
+                        if agreed:
+                            control_code = dual_results[0]['result'].get('control_code')
+                            confidences = [r['result'].get('confidence', 0.0) for r in dual_results]
+                            # Use minimum confidence (most conservative)
+                            min_conf = min(confidences)
+                            agreeing = " and ".join(f"{r['model']} ({c:.2f})" for r, c in zip(dual_results, confidences))
+                            logger.info(f"✓ Dual vision CONSENSUS: all models agree on {control_code} "
+                                        f"({agreeing}, using min: {min_conf:.2f})")
+
+                            # Update suggested_controls with validated result
+                            suggested_controls = [{
+                                'control_code': control_code,
+                                'confidence': min_conf,
+                                'reasoning': f"Dual validation: {agreeing} agree"
+                            }]
+                        else:
+                            # Disagreement, a failed or empty analysis, or the deadline - reject the link for safety
+                            outcomes = ", ".join(
+                                f"{r['model']} suggested {r['result'].get('control_code')} ({r['result'].get('confidence', 0.0):.2f})"
+                                if r['result'] else f"{r['model']} suggested nothing"
+                                for r in dual_results
+                            )
+                            logger.warning(f"✗ Dual vision NO CONSENSUS after {len(dual_results)} of {len(vision_clients)} "
+                                           f"models ({outcomes or 'none finished'}) - NO LINK CREATED")
+                            suggested_controls = []  # Clear suggestions - no consensus
                     else:
                         logger.warning(f"Dual vision validation requires 2 models, only {len(vision_clients)} available - falling back to single model")
                 except Exception as e:
@@ -1763,14 +1831,14 @@ async def upload_document(
 
         # Trigger text extraction task (required for compliance scanning)
         try:
-            from worker_tasks import extract_document_text
-            extract_task = extract_document_text.delay(str(document.id))
-            logger.info(f"Triggered text extraction task for {file.filename}: {extract_task.id}")
+            from worker_tasks import queue_document_extraction
+            extract_task_id = queue_document_extraction(str(document.id))
+            logger.info(f"Triggered text extraction task for {file.filename}: {extract_task_id}")
         except Exception as e:
             logger.error(f"Failed to trigger text extraction for {file.filename}: {e}")
 
         # Return immediate response without AI analysis to prevent timeouts.
-        # AI analysis runs on the Celery ai_tasks queue (concurrency=1) so the
+        # AI analysis runs on the Celery ai_tasks queue (the ai-worker) so the
         # blocking AI/OCR/HTTP work never stalls the API event loop.
         suggested_controls = []
 
@@ -1896,6 +1964,7 @@ async def download_document(document_id: str, db: Session = Depends(get_db), cur
         raise HTTPException(status_code=500, detail="Download failed. Please try again.")
 
 @app.post("/reports/comprehensive-analysis")
+@llm_call_site("analyze-text")
 async def run_comprehensive_ai_analysis(request: dict, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     """Run comprehensive AI analysis across all documents and controls."""
     try:
@@ -2022,7 +2091,8 @@ async def run_comprehensive_ai_analysis(request: dict, db: Session = Depends(get
                         {"role": "user", "content": analysis_prompt}
                     ],
                     max_tokens=500,
-                    temperature=0.1
+                    temperature=0.1,
+                    org_id=current_user.org_id
                 )
                 
                 if ai_response and ai_response.choices[0].message.content:
@@ -2112,6 +2182,45 @@ async def manual_retry_ai_processing(current_user: User = Depends(require_admin)
         logger.error(f"Failed to trigger AI processing retry: {e}")
         raise HTTPException(status_code=500, detail="Failed to trigger AI processing retry")
 
+@app.get("/admin/ai/pools")
+async def get_ai_pool_stats(current_user: User = Depends(require_admin)):
+    """Connection pool hit/miss stats for the AI provider clients held by this API process."""
+    return pool_stats()
+
+@app.get("/admin/ai/health")
+async def get_ai_provider_health(current_user: User = Depends(require_admin)):
+    """Cached liveness and circuit-breaker state of the AI endpoints used by this API process."""
+    return provider_health.snapshot()
+
+@app.get("/admin/ai/metrics")
+async def get_llm_metrics(current_user: User = Depends(require_admin)):
+    """Per call site, provider and model: call outcomes, latency, TTFT and token histograms across all processes."""
+    return await asyncio.to_thread(llm_metrics.summary)
+
+@app.get("/admin/ai/metrics/prometheus")
+async def get_llm_metrics_prometheus(current_user: User = Depends(require_admin)):
+    """The same LLM call metrics in the Prometheus text exposition format."""
+    from fastapi.responses import Response
+    text = await asyncio.to_thread(llm_metrics.prometheus)
+    return Response(content=text, media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/ai/concurrency")
+async def get_ai_concurrency_limits(current_user: User = Depends(require_admin)):
+    """Adaptive concurrency limits per AI endpoint, for this API process and every process publishing to Redis."""
+    try:
+        processes = await asyncio.to_thread(ai_concurrency.published_snapshots)
+    except Exception as e:
+        logger.warning(f"Failed to read published AI concurrency snapshots: {e}")
+        processes = None
+    return {"this_process": ai_concurrency.snapshot(), "processes": processes}
+
+@app.post("/admin/ai/health/reset")
+async def reset_ai_provider_health(current_user: User = Depends(require_admin)):
+    """Close all circuit breakers so the next AI call probes its endpoint again."""
+    cleared = provider_health.reset()
+    logger.info(f"AI provider health reset by {current_user.email}: {cleared} endpoints cleared")
+    return {"cleared": cleared}
+
 @app.delete("/documents/{document_id}")
 async def delete_document(document_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     document = db.query(Document).filter(Document.id == document_id, Document.org_id == current_user.org_id).first()
@@ -2300,8 +2409,8 @@ async def link_evidence_to_control(
     db.add(evidence_link)
     db.commit()
     
-    # Trigger text extraction in background if not already done
-    background_tasks.add_task(extract_document_text.delay, str(document.id))
+    # Trigger text extraction in background if not already done or running
+    background_tasks.add_task(queue_document_extraction, str(document.id))
     
     return {
         "message": "Evidence linked successfully",
@@ -2603,6 +2712,99 @@ async def get_control_scans(control_id: str, db: Session = Depends(get_db), curr
         ]
     }
 
+@app.post("/frameworks/{framework_id}/scan")
+async def create_framework_scan(
+    framework_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Scan every control of a framework that has linked evidence, as one batch."""
+
+    framework = db.query(Framework).filter(Framework.id == framework_id).first()
+    if not framework:
+        raise HTTPException(status_code=404, detail="Framework not found")
+
+    # Child scans are created by the worker once it has loaded the evidence
+    batch = ScanBatch(
+        org_id=current_user.org_id,
+        framework_id=framework.id,
+        status='pending'
+    )
+
+    db.add(batch)
+    db.commit()
+    db.refresh(batch)
+
+    process_framework_scan.delay(str(batch.id))
+
+    return {
+        "batch_id": str(batch.id),
+        "status": "pending",
+        "message": "Framework scan started. Check status using the batch_id."
+    }
+
+@app.get("/scan-batches/{batch_id}")
+async def get_scan_batch_status(batch_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Get the aggregate progress of a framework scan and its child scans."""
+
+    batch = db.query(ScanBatch).filter(ScanBatch.id == batch_id, ScanBatch.org_id == current_user.org_id).first()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Scan batch not found")
+
+    scans = (
+        db.query(Scan)
+        .options(selectinload(Scan.control))
+        .filter(Scan.batch_id == batch.id, Scan.org_id == current_user.org_id)
+        .all()
+    )
+    scans.sort(key=lambda scan: scan.control.code)
+
+    # Requirement-level progress across child scans, finer-grained than the
+    # per-control counts the worker records on the batch
+    total_requirements = sum(scan.total_requirements or 0 for scan in scans)
+    processed_requirements = sum(
+        (scan.total_requirements or 0) if scan.status in ('completed', 'failed') else (scan.processed_requirements or 0)
+        for scan in scans
+    )
+    progress = batch.progress_percentage or 0
+    if batch.status == 'processing' and total_requirements:
+        progress = max(progress, 5 + int(95 * processed_requirements / total_requirements))
+
+    return {
+        "id": str(batch.id),
+        "framework": {
+            "id": str(batch.framework.id),
+            "name": batch.framework.name
+        },
+        "status": batch.status,
+        "progress_percentage": min(progress, 100),
+        "current_step": batch.current_step or 'Initializing...',
+        "total_controls": batch.total_controls or 0,
+        "completed_controls": batch.completed_controls or 0,
+        "failed_controls": batch.failed_controls or 0,
+        "skipped_controls": batch.skipped_controls or 0,
+        "total_requirements": total_requirements,
+        "processed_requirements": processed_requirements,
+        "created_at": batch.created_at.isoformat(),
+        "updated_at": batch.updated_at.isoformat(),
+        "scans": [
+            {
+                "id": str(scan.id),
+                "control": {
+                    "id": str(scan.control.id),
+                    "code": scan.control.code,
+                    "title": scan.control.title
+                },
+                "status": scan.status,
+                "progress_percentage": scan.progress_percentage or 0,
+                "current_step": scan.current_step or 'Initializing...',
+                "total_requirements": scan.total_requirements or 0,
+                "processed_requirements": scan.processed_requirements or 0
+            }
+            for scan in scans
+        ]
+    }
+
 # AI Settings endpoints
 class AISettingsRequest(BaseModel):
     provider: str  # 'openai' or 'ollama'
@@ -2616,6 +2818,11 @@ class AISettingsRequest(BaseModel):
     ollama_context_size: Optional[int] = 131072
     min_confidence_threshold: Optional[float] = 0.90
     use_dual_vision_validation: Optional[bool] = False
+    use_model_cascade: Optional[bool] = False
+    cascade_ollama_model: Optional[str] = 'qwen2.5:3b'
+    cascade_openai_model: Optional[str] = 'gpt-4o-mini'
+    cascade_escalate_min: Optional[float] = 0.5
+    cascade_escalate_max: Optional[float] = 0.95
 
 @app.get("/settings/ai")
 async def get_ai_settings(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -2634,6 +2841,11 @@ async def get_ai_settings(db: Session = Depends(get_db), current_user: User = De
         "ollama_context_size": settings.ollama_context_size,
         "min_confidence_threshold": settings.min_confidence_threshold or 0.90,
         "use_dual_vision_validation": bool(settings.use_dual_vision_validation) if hasattr(settings, 'use_dual_vision_validation') else False,
+        "use_model_cascade": bool(settings.use_model_cascade),
+        "cascade_ollama_model": settings.cascade_ollama_model or 'qwen2.5:3b',
+        "cascade_openai_model": settings.cascade_openai_model or 'gpt-4o-mini',
+        "cascade_escalate_min": settings.cascade_escalate_min if settings.cascade_escalate_min is not None else 0.5,
+        "cascade_escalate_max": settings.cascade_escalate_max if settings.cascade_escalate_max is not None else 0.95,
         # Don't return API key for security
         "openai_api_key": "***" if settings.openai_api_key else None
     }
@@ -2656,6 +2868,20 @@ async def save_ai_settings(settings_request: AISettingsRequest, db: Session = De
     if settings_request.use_dual_vision_validation is not None:
         settings.use_dual_vision_validation = bool(settings_request.use_dual_vision_validation)
 
+    # Update the small-model-first cascade for document analysis
+    if settings_request.use_model_cascade is not None:
+        settings.use_model_cascade = bool(settings_request.use_model_cascade)
+    if settings_request.cascade_ollama_model:
+        settings.cascade_ollama_model = settings_request.cascade_ollama_model
+    if settings_request.cascade_openai_model:
+        settings.cascade_openai_model = settings_request.cascade_openai_model
+    if settings_request.cascade_escalate_min is not None:
+        settings.cascade_escalate_min = settings_request.cascade_escalate_min
+    if settings_request.cascade_escalate_max is not None:
+        settings.cascade_escalate_max = settings_request.cascade_escalate_max
+    if (settings.cascade_escalate_min or 0.0) > (settings.cascade_escalate_max or 1.0):
+        raise HTTPException(status_code=400, detail="cascade_escalate_min must not exceed cascade_escalate_max")
+
     # Update OpenAI settings (allow even when provider is Ollama, for dual validation)
     if settings_request.openai_api_key and settings_request.openai_api_key != "***":
         settings.openai_api_key = encrypt_secret(settings_request.openai_api_key)
@@ -2679,15 +2905,17 @@ async def save_ai_settings(settings_request: AISettingsRequest, db: Session = De
     db.commit()
     db.refresh(settings)
 
+    # Drop the cached copy in this and every other API/worker process
+    settings_cache.invalidate(current_user.org_id)
+
     return {"message": "Settings saved successfully"}
 
 @app.post("/settings/ai/test")
+@llm_call_site("test")
 async def test_ai_connection(settings: AISettingsRequest, current_user: User = Depends(require_admin), db: Session = Depends(get_db)):
     """Test connection to the specified AI provider."""
     try:
         if settings.provider == "openai":
-            from openai import OpenAI
-
             if not settings.openai_api_key or settings.openai_api_key == "***":
                 # Fall back to the key stored for this org (decrypt it)
                 stored = db.query(Settings).filter(Settings.org_id == current_user.org_id).first()
@@ -2709,10 +2937,7 @@ async def test_ai_connection(settings: AISettingsRequest, current_user: User = D
             if not api_key and base_url:
                 api_key = LOCAL_AI_PLACEHOLDER_KEY
 
-            client = OpenAI(
-                api_key=api_key,
-                base_url=base_url
-            )
+            client = get_openai_client(api_key=api_key, base_url=base_url)
             response = create_chat_completion_safe(
                 client=client,
                 model=settings.openai_model or "gpt-4o-mini",
@@ -2727,17 +2952,16 @@ async def test_ai_connection(settings: AISettingsRequest, current_user: User = D
             }
             
         elif settings.provider == "ollama":
-            import requests
-
             endpoint = settings.ollama_endpoint or "http://localhost:11434"
             model = settings.ollama_model or "llama2"
 
             _validate_endpoint_url(endpoint)
 
             # Test Ollama connection
-            response = requests.post(
-                f"{endpoint}/api/generate",
-                json={
+            response = ollama_post(
+                endpoint,
+                "/api/generate",
+                {
                     "model": model,
                     "prompt": "Reply with exactly: 'Ollama connection successful'",
                     "stream": False
@@ -2774,10 +2998,8 @@ async def get_ollama_models(endpoint: str = "http://localhost:11434", current_us
     """Get list of available models from Ollama instance."""
     _validate_endpoint_url(endpoint)
     try:
-        import requests
-
         # Get list of models from Ollama
-        response = requests.get(f"{endpoint}/api/tags", timeout=10)
+        response = ollama_get(endpoint, "/api/tags", timeout=10)
         
         if response.status_code != 200:
             raise HTTPException(
@@ -2869,8 +3091,6 @@ async def get_openai_models(endpoint: Optional[str] = None, current_user: User =
     if endpoint:
         _validate_endpoint_url(endpoint)
     try:
-        from openai import OpenAI
-
         # Use provided endpoint or fall back to environment/default
         base_url = endpoint if endpoint else os.getenv("OPENAI_ENDPOINT")
 
@@ -2887,11 +3107,8 @@ async def get_openai_models(endpoint: Optional[str] = None, current_user: User =
         if not api_key and base_url:
             api_key = LOCAL_AI_PLACEHOLDER_KEY
 
-        # Create client with custom endpoint if provided
-        client = OpenAI(
-            api_key=api_key,
-            base_url=base_url
-        )
+        # Create (or reuse the pooled) client with custom endpoint if provided
+        client = get_openai_client(api_key=api_key, base_url=base_url)
         
         # Query the /v1/models endpoint
         try:
@@ -2937,12 +3154,11 @@ async def get_openai_models(endpoint: Optional[str] = None, current_user: User =
             # Fallback: try direct HTTP request
             if base_url:
                 try:
-                    import requests
                     headers = {"Authorization": f"Bearer {api_key}"} if api_key != LOCAL_AI_PLACEHOLDER_KEY else {}
                     models_url = f"{base_url.rstrip('/')}/models"
                     logger.info(f"Trying direct HTTP request to: {models_url}")
                     
-                    response = requests.get(models_url, headers=headers, timeout=10)
+                    response = get_http_session("openai", base_url, api_key).get(models_url, headers=headers, timeout=10)
                     
                     if response.status_code == 200:
                         data = response.json()
@@ -3001,10 +3217,13 @@ async def get_openai_models(endpoint: Optional[str] = None, current_user: User =
             logger.error(f"Failed to fetch models: {type(e).__name__}: {e}")
             raise HTTPException(status_code=500, detail="Failed to fetch models. Please try again.")
 
-def create_chat_completion_safe(client, model, messages, max_tokens=None, temperature=None, use_json_mode=False):
+def create_chat_completion_safe(client, model, messages, max_tokens=None, temperature=None, use_json_mode=False, org_id=None, cache=None, json_schema=None, validate=None):
     """
     Create a chat completion with safe fallbacks for different endpoint capabilities.
     Some OpenAI-compatible endpoints don't support all features.
+    Deterministic calls are answered from the org's LLM response cache when possible;
+    validate(text) decides whether a reply is cached.
+    With json_schema, structured output is requested, falling back to JSON mode and plain text.
     """
     # Base parameters
     params = {
@@ -3018,18 +3237,22 @@ def create_chat_completion_safe(client, model, messages, max_tokens=None, temper
     if temperature is not None:
         params["temperature"] = temperature
     
+    if json_schema is not None:
+        return structured_chat_completion(client, schema=json_schema, org_id=org_id, cache=cache,
+                                          validate=validate, **params)
+
     # Try with JSON mode first if requested
     if use_json_mode:
         try:
             params["response_format"] = {"type": "json_object"}
-            return client.chat.completions.create(**params)
+            return cached_chat_completion(client, org_id=org_id, cache=cache, validate=validate, **params)
         except Exception as e:
             # If JSON mode fails, try without it
             logger.warning(f"JSON mode not supported, falling back to text mode: {e}")
             params.pop("response_format", None)
     
     # Make request without JSON mode
-    return client.chat.completions.create(**params)
+    return cached_chat_completion(client, org_id=org_id, cache=cache, validate=validate, **params)
 
 def get_model_family(model_name: str) -> str:
     """Categorize model by family for better organization."""
@@ -3064,6 +3287,7 @@ class DocumentBatchAnalysisRequest(BaseModel):
     prompt: str
 
 @app.post("/ai/validate-evidence")
+@llm_call_site("validate")
 async def validate_evidence(
     file: UploadFile = File(...),
     requirement_code: str = Form(...),
@@ -3082,14 +3306,8 @@ async def validate_evidence(
 
     filename = file.filename or "evidence"
 
-    # Extract evidence text (handles PDF/DOCX/TXT and OCR for images)
-    from text_extraction import text_extractor
-    try:
-        pages = text_extractor.extract_text(content, filename, file.content_type or "")
-        evidence_text = "\n".join(p["text"] for p in pages if p.get("text")).strip()[:8000]
-    except Exception as e:
-        logger.warning(f"Evidence text extraction failed for {filename}: {e}")
-        evidence_text = ""
+    # Evidence text (PDF/DOCX/TXT/HTML, OCR for images), stored pages when this file was already extracted
+    evidence_text = extraction_service.text(content, filename, file.content_type)
 
     neutral_result = {
         "outcome": "PARTIAL",
@@ -3105,32 +3323,44 @@ async def validate_evidence(
         neutral_result["rationale"] = "No readable text could be extracted from this file; manual review required."
         return neutral_result
 
-    prompt = f"""You are a strict compliance auditor. Determine whether the evidence below satisfies the requirement "{requirement_code}".
+    try:
+        from ai_scanner import get_ai_client
+        ai_client = get_ai_client(current_user.org_id)
+        context_tokens = context_window(ai_client)
+
+        prompt_header = f"""You are a strict compliance auditor. Determine whether the evidence below satisfies the requirement "{requirement_code}".
 {validation_prompt or ''}
 
 EVIDENCE (extracted text):
-{evidence_text}
+"""
+        prompt_footer = """
 
 Respond ONLY with valid JSON in this exact shape:
-{{"outcome":"PASS|PARTIAL|FAIL","confidence":0.0-1.0,"rationale":"short explanation","findings":["..."],"recommendations":["..."]}}
+{"outcome":"PASS|PARTIAL|FAIL","confidence":0.0-1.0,"rationale":"short explanation","findings":["..."],"recommendations":["..."]}
 Be strict: only PASS when the evidence clearly and comprehensively satisfies the requirement."""
 
-    try:
-        from ai_scanner import get_ai_client
-        ai_client = get_ai_client(current_user.org_id)
+        # Fit the evidence into the org's context window instead of a fixed slice
+        packed_evidence, budget = pack_document(
+            evidence_text, context_tokens, 800, template_text=prompt_header + prompt_footer
+        )
+        if budget.lossy:
+            logger.info(f"Evidence validation prompt for {filename}: {budget.summary()}")
+        prompt = prompt_header + packed_evidence + prompt_footer
 
         if isinstance(ai_client, dict) and ai_client.get('type') == 'ollama':
-            import requests
-            resp = requests.post(
-                f"{ai_client['endpoint']}/api/generate",
-                json={
+            resp = cached_ollama_generate(
+                ai_client['endpoint'],
+                {
                     "model": ai_client['model'],
                     "prompt": prompt,
                     "stream": False,
+                    "format": ollama_format(_EVIDENCE_VALIDATION_SCHEMA),
                     "options": {"temperature": 0.1, "num_predict": 800,
-                                "num_ctx": int(os.getenv("OLLAMA_CONTEXT_SIZE", "32768"))},
+                                "num_ctx": context_tokens},
                 },
                 timeout=90,
+                org_id=current_user.org_id,
+                validate=json_reply_check(("outcome",)),
             )
             if resp.status_code != 200:
                 logger.warning(f"Evidence validation: Ollama returned {resp.status_code}")
@@ -3146,12 +3376,14 @@ Be strict: only PASS when the evidence clearly and comprehensively satisfies the
                 ],
                 max_tokens=600,
                 temperature=0.1,
-                use_json_mode=True,
+                json_schema=_EVIDENCE_VALIDATION_SCHEMA,
+                org_id=current_user.org_id,
+                validate=json_reply_check(("outcome",)),
             )
             ai_text = completion.choices[0].message.content
 
-        parsed = _extract_json_from_response(ai_text)
-        if not parsed or "outcome" not in parsed:
+        parsed = extract_json(ai_text, required_keys=("outcome",))
+        if not parsed:
             logger.warning(f"Evidence validation: could not parse AI response for {filename}")
             return neutral_result
 
@@ -3178,6 +3410,7 @@ Be strict: only PASS when the evidence clearly and comprehensively satisfies the
 
 
 @app.post("/ai/analyze-text")
+@llm_call_site("analyze-text")
 async def analyze_text_with_ai(request: ControlAnalysisRequest, current_user: User = Depends(get_current_user)):
     """Analyze text using the configured AI provider."""
     try:
@@ -3188,14 +3421,12 @@ async def analyze_text_with_ai(request: ControlAnalysisRequest, current_user: Us
         
         if isinstance(ai_client, dict) and ai_client.get('type') == 'ollama':
             # Handle Ollama
-            import requests
-            
             endpoint = ai_client['endpoint']
             model = ai_client['model']
             
-            response = requests.post(
-                f"{endpoint}/api/generate",
-                json={
+            response = cached_ollama_generate(
+                endpoint,
+                {
                     "model": model,
                     "prompt": request.prompt,
                     "stream": False,
@@ -3205,7 +3436,8 @@ async def analyze_text_with_ai(request: ControlAnalysisRequest, current_user: Us
                         "num_ctx": int(os.getenv("OLLAMA_CONTEXT_SIZE", "32768"))
                     }
                 },
-                timeout=60
+                timeout=60,
+                org_id=current_user.org_id
             )
             
             if response.status_code != 200:
@@ -3239,7 +3471,8 @@ async def analyze_text_with_ai(request: ControlAnalysisRequest, current_user: Us
                     }
                 ],
                 max_tokens=request.max_tokens,
-                temperature=request.temperature
+                temperature=request.temperature,
+                org_id=current_user.org_id
             )
             
             ai_response = response.choices[0].message.content
@@ -3254,6 +3487,7 @@ async def analyze_text_with_ai(request: ControlAnalysisRequest, current_user: Us
         )
 
 @app.post("/api/ai/analyze-image")
+@llm_call_site("vision")
 async def analyze_image_with_ai(
     image: UploadFile = File(...),
     prompt: str = Form(...),
@@ -3295,7 +3529,8 @@ async def analyze_image_with_ai(
             try:
                 image_b64 = base64.b64encode(processed_content).decode('utf-8')
 
-                response = ai_client.chat.completions.create(
+                response = guarded_chat_completion(
+                    ai_client, org_id=current_user.org_id,
                     model="gpt-4o",
                     messages=[
                         {
@@ -3326,12 +3561,13 @@ async def analyze_image_with_ai(
             except Exception as e:
                 logger.warning(f"Vision AI failed for {image.filename}: {e}")
                 # Fallback to OCR
-                import pytesseract
-                ocr_text = pytesseract.image_to_string(Image.open(io.BytesIO(image_content)))
+                ocr_text = extraction_service.text(image_content, image.filename or "image", image.content_type,
+                                                   max_chars=3000)
 
                 if ocr_text.strip():
                     # Analyze OCR text with the prompt
-                    response = ai_client.chat.completions.create(
+                    response = guarded_chat_completion(
+                        ai_client, org_id=current_user.org_id,
                         model="gpt-4o-mini",
                         messages=[
                             {
@@ -3350,8 +3586,8 @@ async def analyze_image_with_ai(
                     )
         else:  # Ollama
             # Use OCR for Ollama
-            import pytesseract
-            ocr_text = pytesseract.image_to_string(Image.open(io.BytesIO(image_content)))
+            ocr_text = extraction_service.text(image_content, image.filename or "image", image.content_type,
+                                               max_chars=3000)
 
             if not ocr_text.strip():
                 raise HTTPException(
@@ -3360,15 +3596,14 @@ async def analyze_image_with_ai(
                 )
 
             # Analyze OCR text with Ollama
-            import requests
             endpoint = ai_client['endpoint']
             model = ai_client['model']
 
             analysis_prompt = f"{prompt}\n\nExtracted text from image:\n{ocr_text[:3000]}"
 
-            response = requests.post(
-                f"{endpoint}/api/generate",
-                json={
+            response = cached_ollama_generate(
+                endpoint,
+                {
                     "model": model,
                     "prompt": analysis_prompt,
                     "stream": False,
@@ -3378,7 +3613,8 @@ async def analyze_image_with_ai(
                         "num_ctx": int(os.getenv("OLLAMA_CONTEXT_SIZE", "32768"))
                     }
                 },
-                timeout=120
+                timeout=120,
+                org_id=current_user.org_id
             )
 
             if response.status_code != 200:
@@ -3406,6 +3642,7 @@ async def analyze_image_with_ai(
         )
 
 @app.post("/analyze-documents")
+@llm_call_site("analyze-text")
 async def analyze_multiple_documents(request: DocumentBatchAnalysisRequest, current_user: User = Depends(get_current_user)):
     """Analyze multiple documents together and suggest relevant compliance controls."""
     try:
@@ -3457,24 +3694,24 @@ Do not include any text before or after the JSON. Do not use markdown formatting
         
         if isinstance(ai_client, dict) and ai_client.get('type') == 'ollama':
             # Handle Ollama
-            import requests
-            
             endpoint = ai_client['endpoint']
             model = ai_client['model']
             
-            response = requests.post(
-                f"{endpoint}/api/generate",
-                json={
+            response = cached_ollama_generate(
+                endpoint,
+                {
                     "model": model,
                     "prompt": enhanced_prompt,
                     "stream": False,
+                    "format": ollama_format(_CONTROL_SUGGESTIONS_SCHEMA),
                     "options": {
                         "temperature": 0.3,
                         "num_predict": 2000,
                         "num_ctx": int(os.getenv("OLLAMA_CONTEXT_SIZE", "32768"))
                     }
                 },
-                timeout=45  # Reduced timeout to prevent connection drops
+                timeout=45,  # Reduced timeout to prevent connection drops
+                org_id=current_user.org_id
             )
             
             if response.status_code == 200:
@@ -3489,19 +3726,18 @@ Do not include any text before or after the JSON. Do not use markdown formatting
                 raise HTTPException(status_code=500, detail=f"Ollama API error (status {response.status_code}).")
                 
         else:
-            # Handle OpenAI
-            from openai import OpenAI
-            client = OpenAI(api_key=ai_client.api_key, base_url=ai_client.base_url)
-            
-            completion = client.chat.completions.create(
-                model=ai_client.model,
+            # Handle OpenAI - reuse the pooled client rather than building a new one
+            completion = structured_chat_completion(
+                ai_client,
+                schema=_CONTROL_SUGGESTIONS_SCHEMA,
+                org_id=current_user.org_id,
+                model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
                 messages=[
                     {"role": "system", "content": "You are a compliance expert. Analyze documents and suggest relevant compliance controls in JSON format."},
                     {"role": "user", "content": enhanced_prompt}
                 ],
                 max_tokens=2000,
-                temperature=0.3,
-                response_format={"type": "json_object"}
+                temperature=0.3
             )
             
             result = completion.choices[0].message.content
@@ -3509,7 +3745,7 @@ Do not include any text before or after the JSON. Do not use markdown formatting
         # Try to parse the response as JSON
         try:
             if result:
-                parsed_result = _extract_json_from_response(result)
+                parsed_result = extract_json(result)
                 if parsed_result:
                     return {"suggestions": parsed_result.get("suggestions", [])}
                 else:
@@ -3532,6 +3768,7 @@ Do not include any text before or after the JSON. Do not use markdown formatting
         )
 
 @app.post("/analyze-document-controls")
+@llm_call_site("analyze-text")
 async def analyze_document_controls(
     file: UploadFile = File(...),
     available_controls: Optional[str] = None,
@@ -3543,32 +3780,8 @@ async def analyze_document_controls(
         file_content = await file.read()
         file_text = ""
         
-        # Extract text based on file type
-        if file.content_type == "text/plain":
-            file_text = file_content.decode('utf-8')
-        elif file.content_type == "application/pdf":
-            # Extract text from PDF
-            try:
-                import fitz  # PyMuPDF
-                import io
-                
-                pdf_doc = fitz.open(stream=file_content, filetype="pdf")
-                text_pages = []
-                for page_num in range(min(3, pdf_doc.page_count)):  # First 3 pages
-                    page = pdf_doc[page_num]
-                    page_text = page.get_text()
-                    if page_text.strip():
-                        text_pages.append(f"Page {page_num + 1}: {page_text[:1000]}")
-                
-                pdf_doc.close()
-                file_text = "\n\n".join(text_pages)
-                if not file_text.strip():
-                    file_text = f"PDF document: {file.filename} (text extraction failed)"
-            except Exception as e:
-                logger.warning(f"PDF text extraction failed: {e}")
-                file_text = f"PDF document: {file.filename} (text extraction failed)"
-        
-        elif file.content_type and file.content_type.startswith("image/"):
+        # Images are described by the vision model; other types read through the extraction service
+        if file.content_type and file.content_type.startswith("image/"):
             # Analyze image using AI vision
             try:
                 import base64
@@ -3583,20 +3796,22 @@ async def analyze_document_controls(
                 if isinstance(ai_client, dict) and ai_client.get('type') == 'ollama':
                     # Ollama with vision models (if available)
                     try:
-                        import requests
                         endpoint = ai_client['endpoint']
                         
                         # Try vision model first
-                        vision_response = requests.post(
-                            f"{endpoint}/api/generate",
-                            json={
-                                "model": "llava",  # Vision model
-                                "prompt": f"Describe what you see in this image. Focus on any text, security-related content, error messages, configurations, or compliance-related information: {file.filename}",
-                                "images": [image_b64],
-                                "stream": False
-                            },
-                            timeout=30
-                        )
+                        with llm_call_site("vision"):
+                            vision_response = guarded_ollama_post(
+                                endpoint,
+                                "/api/generate",
+                                {
+                                    "model": "llava",  # Vision model
+                                    "prompt": f"Describe what you see in this image. Focus on any text, security-related content, error messages, configurations, or compliance-related information: {file.filename}",
+                                    "images": [image_b64],
+                                    "stream": False
+                                },
+                                timeout=30,
+                                org_id=current_user.org_id
+                            )
                         
                         if vision_response.status_code == 200:
                             result = vision_response.json()
@@ -3610,27 +3825,29 @@ async def analyze_document_controls(
                 else:
                     # OpenAI GPT-4 Vision
                     try:
-                        response = ai_client.chat.completions.create(
-                            model="gpt-4-vision-preview",
-                            messages=[
-                                {
-                                    "role": "user",
-                                    "content": [
-                                        {
-                                            "type": "text",
-                                            "text": f"Analyze this image and describe any text, security configurations, error messages, compliance-related information, or other relevant content you can see. Image filename: {file.filename}"
-                                        },
-                                        {
-                                            "type": "image_url",
-                                            "image_url": {
-                                                "url": f"data:{file.content_type};base64,{image_b64}"
+                        with llm_call_site("vision"):
+                            response = guarded_chat_completion(
+                                ai_client, org_id=current_user.org_id,
+                                model="gpt-4-vision-preview",
+                                messages=[
+                                    {
+                                        "role": "user",
+                                        "content": [
+                                            {
+                                                "type": "text",
+                                                "text": f"Analyze this image and describe any text, security configurations, error messages, compliance-related information, or other relevant content you can see. Image filename: {file.filename}"
+                                            },
+                                            {
+                                                "type": "image_url",
+                                                "image_url": {
+                                                    "url": f"data:{file.content_type};base64,{image_b64}"
+                                                }
                                             }
-                                        }
-                                    ]
-                                }
-                            ],
-                            max_tokens=500
-                        )
+                                        ]
+                                    }
+                                ],
+                                max_tokens=500
+                            )
                         file_text = f"Image analysis of {file.filename}: {response.choices[0].message.content}"
                     except Exception as e:
                         logger.warning(f"Vision analysis failed: {e}")
@@ -3640,28 +3857,10 @@ async def analyze_document_controls(
                 logger.error(f"Image analysis error: {e}")
                 file_text = f"Image: {file.filename}"
                 
-        elif file.content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            # Extract text from Word documents
-            try:
-                import docx
-                import io
-                
-                doc = docx.Document(io.BytesIO(file_content))
-                paragraphs = []
-                for para in doc.paragraphs:
-                    if para.text.strip():
-                        paragraphs.append(para.text)
-                
-                file_text = "\n".join(paragraphs[:20])  # First 20 paragraphs
-                if not file_text.strip():
-                    file_text = f"Word document: {file.filename} (text extraction failed)"
-            except Exception as e:
-                logger.warning(f"Word document text extraction failed: {e}")
-                file_text = f"Word document: {file.filename} (text extraction failed)"
-                
         else:
-            # For other file types, use filename
-            file_text = f"Document: {file.filename}"
+            file_text = extraction_service.text(file_content, file.filename or "document", file.content_type)
+            if not file_text:
+                file_text = f"Document: {file.filename}"
         
         # Parse available controls
         controls = []
@@ -3716,14 +3915,12 @@ Limit to the top 3 most relevant matches. If no relevant matches, return empty a
         
         if isinstance(ai_client, dict) and ai_client.get('type') == 'ollama':
             # Handle Ollama
-            import requests
-            
             endpoint = ai_client['endpoint']
             model = ai_client['model']
             
-            response = requests.post(
-                f"{endpoint}/api/generate",
-                json={
+            response = cached_ollama_generate(
+                endpoint,
+                {
                     "model": model,
                     "prompt": analysis_prompt + """\n\nIMPORTANT: You must respond with ONLY valid JSON in this exact format:
 {{
@@ -3740,13 +3937,15 @@ Limit to the top 3 most relevant matches. If no relevant matches, return empty a
 
 Do not include any text before or after the JSON. Do not use markdown formatting. Return only the JSON object.""",
                     "stream": False,
+                    "format": ollama_format(_CONTROL_SUGGESTIONS_SCHEMA),
                     "options": {
                         "temperature": 0.3,
                         "num_predict": 2000,
                         "num_ctx": int(os.getenv("OLLAMA_CONTEXT_SIZE", "32768"))
                     }
                 },
-                timeout=60
+                timeout=60,
+                org_id=current_user.org_id
             )
             
             if response.status_code == 200:
@@ -3778,15 +3977,15 @@ Do not include any text before or after the JSON. Do not use markdown formatting
                 ],
                 max_tokens=800,
                 temperature=0.3,
-                use_json_mode=True
+                json_schema=_CONTROL_SUGGESTIONS_SCHEMA,
+                org_id=current_user.org_id
             )
             
             ai_response = response.choices[0].message.content
         
         # Parse AI response
         try:
-            # Use improved JSON extraction
-            parsed_response = _extract_json_from_response(ai_response)
+            parsed_response = extract_json(ai_response)
             if not parsed_response:
                 logger.warning(f"Could not extract JSON from AI response: {ai_response[:200]}...")
                 return {"suggested_controls": []}
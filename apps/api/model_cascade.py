@@ -0,0 +1,120 @@
+"""
+Cheap-model-first cascade for document-to-control suggestions.
+
+With use_model_cascade on, document analysis runs on the org's small model
+first (cascade_ollama_model / cascade_openai_model). Its suggestions are
+kept unless one lands in the ambiguous band
+[cascade_escalate_min, cascade_escalate_max), there are none, or the small
+model's analysis failed, in which case the document is analysed again on the main model. Suggestions below
+the band are under any sensible link threshold and those above it are
+trusted as they are.
+
+Outcomes and latencies per tier are counted per process and logged after
+each cascaded document. The time saved by a document the small model
+settles is estimated as the mean main-model latency seen so far minus the
+small model's latency; escalations cost their small-model time.
+"""
+import logging
+import os
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ModelCascade:
+    """Escalation rule and per-tier statistics for the suggestion cascade."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.small_settled = 0
+        self.escalations: Counter = Counter()
+        self.small_seconds = 0.0
+        self.large_seconds = 0.0
+        self.saved_seconds = 0.0
+        self.wasted_seconds = 0.0
+        # Settled before any main-model latency was known; credited on the first escalation
+        self._unpriced_small_seconds: List[float] = []
+
+    @staticmethod
+    def escalation_reason(suggestions: Optional[List[Dict[str, Any]]], low: float, high: float) -> Optional[str]:
+        """
+        Why the small model's suggestions need the main model ("failed", "empty",
+        "ambiguous"), or None to keep them; suggestions is None when its analysis failed.
+        """
+        if suggestions is None:
+            return "failed"
+        if not suggestions:
+            return "empty"
+        for suggestion in suggestions:
+            try:
+                confidence = float(suggestion.get('confidence', 0.0))
+            except (TypeError, ValueError):
+                return "ambiguous"
+            if low <= confidence < high:
+                return "ambiguous"
+        return None
+
+    def record(self, small_seconds: float, escalation: Optional[str] = None,
+               large_seconds: Optional[float] = None) -> None:
+        """Count one cascaded document; large_seconds is given when it was escalated."""
+        with self._lock:
+            self.small_seconds += small_seconds
+            if escalation is None:
+                self.small_settled += 1
+                mean_large = self._mean_large()
+                if mean_large is None:
+                    self._unpriced_small_seconds.append(small_seconds)
+                else:
+                    self.saved_seconds += max(0.0, mean_large - small_seconds)
+                return
+            self.escalations[escalation] += 1
+            self.large_seconds += large_seconds or 0.0
+            self.wasted_seconds += small_seconds
+            if self._unpriced_small_seconds:
+                mean_large = self.large_seconds / sum(self.escalations.values())
+                self.saved_seconds += sum(max(0.0, mean_large - s) for s in self._unpriced_small_seconds)
+                self._unpriced_small_seconds = []
+
+    def _mean_large(self) -> Optional[float]:
+        escalated = sum(self.escalations.values())
+        return self.large_seconds / escalated if escalated else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            escalated = sum(self.escalations.values())
+            documents = self.small_settled + escalated
+            return {
+                "documents": documents,
+                "small_settled": self.small_settled,
+                "escalated": dict(self.escalations),
+                "small_hit_rate": round(self.small_settled / documents, 3) if documents else None,
+                "small_seconds": round(self.small_seconds, 1),
+                "large_seconds": round(self.large_seconds, 1),
+                "estimated_saved_seconds": round(self.saved_seconds, 1),
+                "escalation_overhead_seconds": round(self.wasted_seconds, 1),
+            }
+
+    def summary(self) -> str:
+        s = self.stats()
+        if not s["documents"]:
+            return "no cascaded documents"
+        return (f"small model settled {s['small_settled']}/{s['documents']} ({s['small_hit_rate']:.0%}), "
+                f"escalated {s['escalated']}, ~{s['estimated_saved_seconds'] - s['escalation_overhead_seconds']:.0f}s "
+                f"net saved ({s['estimated_saved_seconds']:.0f}s saved, {s['escalation_overhead_seconds']:.0f}s "
+                f"spent on escalated small calls)")
+
+    def _reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._reset()
+
+
+# Global model cascade instance
+model_cascade = ModelCascade()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=model_cascade._reset_after_fork)
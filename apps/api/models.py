@@ -86,6 +86,12 @@ class Document(Base):
     file_size = Column(BigInteger)
     uploaded_by = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     sha256 = Column(String(64))
+    # Text extraction state: pending, running, done or failed
+    extraction_status = Column(String(20), default='pending')
+    # Last page committed by extract_document_text; a retry resumes after it
+    extraction_checkpoint = Column(Integer, default=0)
+    # TextExtractor version that extracted every page; NULL until extraction completes
+    extractor_version = Column(String(20))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow)
     
@@ -100,6 +106,7 @@ class Document(Base):
     org = relationship("Org", back_populates="documents")
     uploader = relationship("User")
     pages = relationship("DocumentPage", back_populates="document", cascade="all, delete-orphan")
+    chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
     control_links = relationship("DocumentControlLink", back_populates="document", cascade="all, delete-orphan")
 
 class DocumentPage(Base):
@@ -109,16 +116,59 @@ class DocumentPage(Base):
     document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), nullable=False)
     page_num = Column(Integer, nullable=False)
     text = Column(Text)
+    # Engine that produced text: pymupdf, pdfplumber, python-docx, text, markdown, html, tesseract
+    extraction_engine = Column(String(20))
+    # Text came from OCR of the rendered page rather than a text layer
+    ocr = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Performance: Add indexes for document queries
     __table_args__ = (
         Index('idx_document_page_document_id', 'document_id'),
-        Index('idx_document_page_num', 'document_id', 'page_num'),
+        Index('idx_document_page_num', 'document_id', 'page_num', unique=True),
     )
     
     document = relationship("Document", back_populates="pages")
 
+class DocumentChunk(Base):
+    """Retrieval chunk of a document page, indexed for BM25 evidence selection."""
+    __tablename__ = "document_chunks"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    org_id = Column(UUID(as_uuid=True), ForeignKey("orgs.id", ondelete="CASCADE"), nullable=False)
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), nullable=False)
+    page_num = Column(Integer, nullable=False)
+    chunk_index = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+    term_counts_json = Column(Text, nullable=False)  # JSON {term: count} from evidence_index.tokenize
+    token_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_document_chunk_org_id', 'org_id'),
+        Index('idx_document_chunk_document_id', 'document_id'),
+    )
+    
+    document = relationship("Document", back_populates="chunks")
+
+class DocumentSummary(Base):
+    """Step-1 JSON summary of document content, reused while content, model and prompt version match."""
+    __tablename__ = "document_summaries"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    org_id = Column(UUID(as_uuid=True), ForeignKey("orgs.id", ondelete="CASCADE"), nullable=False)
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="SET NULL"), nullable=True)
+    sha256 = Column(String(64), nullable=False)  # Content hash, as in documents.sha256
+    model = Column(String(255), nullable=False)  # "<provider>:<model>", e.g. "ollama:qwen2.5:14b"
+    prompt_version = Column(String(50), nullable=False)
+    summary_json = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_document_summary_document_id', 'document_id'),
+        Index('idx_document_summary_key', 'org_id', 'sha256', 'model', 'prompt_version', unique=True),
+    )
+
 class EvidenceLink(Base):
     __tablename__ = "evidence_links"
 
@@ -179,12 +229,14 @@ class Scan(Base):
     current_step = Column(Text, default='Initializing...')
     total_requirements = Column(Integer, default=0)
     processed_requirements = Column(Integer, default=0)
+    batch_id = Column(UUID(as_uuid=True), ForeignKey("scan_batches.id", ondelete="SET NULL"), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow)
 
     # Performance: Add indexes for scan queries
     __table_args__ = (
         Index('idx_scan_org_id', 'org_id'),
+        Index('idx_scan_batch_id', 'batch_id'),
         Index('idx_scan_control_id', 'control_id'),
         Index('idx_scan_status', 'status'),
         Index('idx_scan_created_at', 'created_at'),
@@ -192,9 +244,36 @@ class Scan(Base):
 
     org = relationship("Org")
     control = relationship("Control")
+    batch = relationship("ScanBatch", back_populates="scans")
     results = relationship("ScanResult", back_populates="scan")
     gaps = relationship("Gap", back_populates="scan")
 
+class ScanBatch(Base):
+    """Framework-wide scan: one child Scan per control with linked evidence."""
+    __tablename__ = "scan_batches"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    org_id = Column(UUID(as_uuid=True), ForeignKey("orgs.id"), nullable=False)
+    framework_id = Column(UUID(as_uuid=True), ForeignKey("frameworks.id"), nullable=False)
+    status = Column(String(50), nullable=False, default='pending')  # pending, processing, completed, failed
+    progress_percentage = Column(Integer, default=0)
+    current_step = Column(Text, default='Initializing...')
+    total_controls = Column(Integer, default=0)
+    completed_controls = Column(Integer, default=0)
+    failed_controls = Column(Integer, default=0)
+    skipped_controls = Column(Integer, default=0)  # controls with no linked evidence
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('idx_scan_batch_org_id', 'org_id'),
+        Index('idx_scan_batch_framework_id', 'framework_id'),
+    )
+
+    org = relationship("Org")
+    framework = relationship("Framework")
+    scans = relationship("Scan", back_populates="batch")
+
 class ScanResult(Base):
     __tablename__ = "scan_results"
 
@@ -268,6 +347,12 @@ class Settings(Base):
     ollama_context_size = Column(Integer, default=131072)
     min_confidence_threshold = Column(Float, default=0.90)
     use_dual_vision_validation = Column(Boolean, default=False)
+    # Document analysis on a small model first; escalate results in the ambiguous band
+    use_model_cascade = Column(Boolean, default=False)
+    cascade_ollama_model = Column(String(100), default='qwen2.5:3b')
+    cascade_openai_model = Column(String(100), default='gpt-4o-mini')
+    cascade_escalate_min = Column(Float, default=0.5)
+    cascade_escalate_max = Column(Float, default=0.95)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -0,0 +1,176 @@
+"""
+Token-budget-aware prompt packing.
+
+Prompts are filled against the model's real context window (the org's
+ollama_context_size, or OPENAI_CONTEXT_WINDOW for OpenAI-compatible
+endpoints) minus the tokens reserved for the answer, instead of fixed
+character slices. Sections are added in priority order and whatever does
+not fit is counted and reported rather than silently cut off.
+"""
+import math
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Rough chars-per-token ratio for English prose/JSON; deliberately conservative
+PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "3.5"))
+# Context window assumed for OpenAI-compatible endpoints
+OPENAI_CONTEXT_WINDOW = int(os.getenv("OPENAI_CONTEXT_WINDOW", "128000"))
+# Cap on a single document's text in summary/validation prompts, to keep latency predictable
+PROMPT_MAX_DOCUMENT_TOKENS = int(os.getenv("PROMPT_MAX_DOCUMENT_TOKENS", "2000"))
+
+TRUNCATION_MARKER = "... [truncated]"
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate from character count."""
+    if not text:
+        return 0
+    return int(math.ceil(len(text) / PROMPT_CHARS_PER_TOKEN))
+
+
+def context_window(ai_client: Any) -> int:
+    """Context window for a client returned by ai_scanner.get_ai_client."""
+    if isinstance(ai_client, dict) and ai_client.get('type') == 'ollama':
+        return int(ai_client.get('context_size') or os.getenv("OLLAMA_CONTEXT_SIZE", "32768"))
+    return OPENAI_CONTEXT_WINDOW
+
+
+class PromptBudget:
+    """
+    Token budget for one prompt.
+
+    Usage: create with the context window and output reservation, charge the
+    fixed template with reserve(), then add sections in priority order with
+    fit() / fit_items(). report() and summary() describe what was dropped.
+    """
+
+    def __init__(self, context_tokens: int, reserve_output_tokens: int,
+                 max_input_tokens: Optional[int] = None):
+        available = max(0, context_tokens - reserve_output_tokens)
+        if max_input_tokens is not None:
+            available = min(available, max_input_tokens)
+        self.context_tokens = context_tokens
+        self.reserve_output_tokens = reserve_output_tokens
+        self.budget_tokens = available
+        self.used_tokens = 0
+        self.included: Dict[str, int] = {}
+        self.dropped: Dict[str, int] = {}
+        self.dropped_tokens: Dict[str, int] = {}
+        self.truncated: Dict[str, int] = {}
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.budget_tokens - self.used_tokens)
+
+    def reserve(self, text: str) -> None:
+        """Charge mandatory text (template, instructions) that is always sent."""
+        self.used_tokens += estimate_tokens(text)
+
+    def reserve_tokens(self, tokens: int) -> None:
+        """Charge a known token overhead (e.g. text the provider call adds later)."""
+        self.used_tokens += tokens
+
+    def fit(self, section: str, text: str, truncate: bool = True,
+            required: bool = False) -> Optional[str]:
+        """
+        Return text if it fits in the remaining budget.
+
+        required text is always returned (and may overdraw the budget);
+        otherwise it is cut to the remaining budget when truncate is set, or
+        dropped (returns None).
+        """
+        tokens = estimate_tokens(text)
+        if required or tokens <= self.remaining:
+            self.used_tokens += tokens
+            self.included[section] = self.included.get(section, 0) + 1
+            return text
+
+        if truncate and self.remaining > estimate_tokens(TRUNCATION_MARKER) + 16:
+            keep_chars = int((self.remaining - estimate_tokens(TRUNCATION_MARKER)) * PROMPT_CHARS_PER_TOKEN)
+            cut = text[:keep_chars] + TRUNCATION_MARKER
+            self.used_tokens += estimate_tokens(cut)
+            self.included[section] = self.included.get(section, 0) + 1
+            self.truncated[section] = self.truncated.get(section, 0) + 1
+            self.dropped_tokens[section] = self.dropped_tokens.get(section, 0) + tokens - estimate_tokens(cut)
+            return cut
+
+        self.dropped[section] = self.dropped.get(section, 0) + 1
+        self.dropped_tokens[section] = self.dropped_tokens.get(section, 0) + tokens
+        return None
+
+    def fit_items(self, section: str, items: List[Any], render: Callable[[Any], str],
+                  contiguous: bool = False, truncate_last: bool = False) -> List[str]:
+        """
+        Add items (already in priority order) while they fit; returns their rendered text.
+
+        contiguous keeps a prefix only, for lists whose positions are referenced
+        elsewhere (e.g. numbered control catalogs), so len(result) is the number
+        of leading items kept. Otherwise an item that does not fit is skipped and
+        smaller later items may still be added. truncate_last cuts the first item
+        that does not fit instead of dropping it, which exhausts the budget.
+        """
+        kept: List[str] = []
+        stopped = False
+        for item in items:
+            text = render(item)
+            if stopped:
+                self._drop(section, text)
+                continue
+            fitted = self.fit(section, text, truncate=truncate_last)
+            if fitted is None:
+                stopped = contiguous
+                continue
+            kept.append(fitted)
+            if fitted is not text:
+                stopped = True
+        return kept
+
+    def _drop(self, section: str, text: str) -> None:
+        self.dropped[section] = self.dropped.get(section, 0) + 1
+        self.dropped_tokens[section] = self.dropped_tokens.get(section, 0) + estimate_tokens(text)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "context_tokens": self.context_tokens,
+            "reserved_output_tokens": self.reserve_output_tokens,
+            "budget_tokens": self.budget_tokens,
+            "used_tokens": self.used_tokens,
+            "included": dict(self.included),
+            "truncated": dict(self.truncated),
+            "dropped": dict(self.dropped),
+            "dropped_tokens": dict(self.dropped_tokens),
+        }
+
+    def summary(self) -> str:
+        """One-line description for logs."""
+        line = f"{self.used_tokens}/{self.budget_tokens} tokens (ctx {self.context_tokens}, {self.reserve_output_tokens} reserved for output)"
+        losses = []
+        for section in sorted(set(self.dropped) | set(self.truncated)):
+            parts = []
+            if self.dropped.get(section):
+                parts.append(f"{self.dropped[section]} dropped")
+            if self.truncated.get(section):
+                parts.append(f"{self.truncated[section]} truncated")
+            losses.append(f"{section}: {', '.join(parts)} (~{self.dropped_tokens.get(section, 0)} tokens)")
+        if losses:
+            line += "; " + "; ".join(losses)
+        return line
+
+    @property
+    def lossy(self) -> bool:
+        return bool(self.dropped or self.truncated)
+
+
+def pack_document(text: str, context_tokens: int, reserve_output_tokens: int, template_text: str = "",
+                  max_document_tokens: int = PROMPT_MAX_DOCUMENT_TOKENS) -> Tuple[str, PromptBudget]:
+    """
+    Fit one document's text into a prompt whose remaining text is template_text.
+
+    The document gets whatever the context window leaves after the template and
+    output reservation, capped at max_document_tokens.
+    """
+    budget = PromptBudget(context_tokens, reserve_output_tokens)
+    budget.reserve(template_text)
+    budget.budget_tokens = min(budget.budget_tokens, budget.used_tokens + max_document_tokens)
+    packed = budget.fit("document", text or "", truncate=True) or ""
+    return packed, budget
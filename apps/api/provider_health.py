@@ -0,0 +1,279 @@
+"""
+Health registry and circuit breaker for AI provider endpoints.
+
+Liveness of each (provider, endpoint) is cached for AI_HEALTH_TTL_SECONDS, so
+callers no longer probe GET /api/tags before every request. Real calls
+report their outcome too. After AI_BREAKER_FAILURE_THRESHOLD consecutive
+failures the breaker opens and calls fail fast with ProviderUnavailableError
+(callers already fall back on any exception). After AI_BREAKER_RESET_SECONDS
+one trial call is let through (half-open); its outcome closes or re-opens
+the breaker.
+
+Calls also take a slot from the endpoint's adaptive concurrency limiter
+(see concurrency.py), after the breaker check so a dead endpoint never
+queues callers, and are recorded in llm_metrics.
+
+State is per process, like the connection pools in ai_clients.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+
+from ai_clients import ollama_get, ollama_post
+from concurrency import ai_concurrency
+from llm_metrics import failure_kind, llm_metrics
+
+logger = logging.getLogger(__name__)
+
+AI_HEALTH_TTL_SECONDS = float(os.getenv("AI_HEALTH_TTL_SECONDS", "30"))
+AI_BREAKER_FAILURE_THRESHOLD = int(os.getenv("AI_BREAKER_FAILURE_THRESHOLD", "3"))
+AI_BREAKER_RESET_SECONDS = float(os.getenv("AI_BREAKER_RESET_SECONDS", "60"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ProviderUnavailableError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+
+class EndpointHealth:
+    """Liveness and breaker state for one provider endpoint."""
+
+    def __init__(self, provider: str, endpoint: str):
+        self.provider = provider
+        self.endpoint = endpoint
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.last_ok_at: Optional[float] = None
+        self.last_failure_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.opened_at: Optional[float] = None
+        self.trial_started_at: Optional[float] = None
+        self.successes = 0
+        self.failures = 0
+        self.probes = 0
+        self.rejected = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "provider": self.provider,
+            "endpoint": self.endpoint or "default",
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "last_ok_seconds_ago": round(now - self.last_ok_at, 1) if self.last_ok_at else None,
+            "last_failure_seconds_ago": round(now - self.last_failure_at, 1) if self.last_failure_at else None,
+            "last_error": self.last_error,
+            "retry_in_seconds": (
+                max(0.0, round(self.opened_at + AI_BREAKER_RESET_SECONDS - now, 1))
+                if self.state == OPEN and self.opened_at else None
+            ),
+            "successes": self.successes,
+            "failures": self.failures,
+            "probes": self.probes,
+            "rejected": self.rejected,
+        }
+
+
+class ProviderHealthRegistry:
+    """Per-process registry of EndpointHealth keyed by (provider, endpoint)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: Dict[Tuple[str, str], EndpointHealth] = {}
+
+    def _get(self, provider: str, endpoint: Optional[str]) -> EndpointHealth:
+        key = (provider, (endpoint or "").rstrip("/"))
+        health = self._endpoints.get(key)
+        if health is None:
+            health = self._endpoints[key] = EndpointHealth(*key)
+        return health
+
+    def before_call(self, provider: str, endpoint: Optional[str]) -> None:
+        """Raise ProviderUnavailableError if the breaker is open; admit one trial when it may reset."""
+        with self._lock:
+            health = self._get(provider, endpoint)
+            if health.state == CLOSED:
+                return
+            now = time.time()
+            if health.state == OPEN and now - (health.opened_at or 0) >= AI_BREAKER_RESET_SECONDS:
+                health.state = HALF_OPEN
+                health.trial_started_at = None
+            # A trial that never reported back (caller gave up) doesn't block the next one forever
+            if health.state == HALF_OPEN and (
+                health.trial_started_at is None or now - health.trial_started_at >= AI_BREAKER_RESET_SECONDS
+            ):
+                health.trial_started_at = now
+                return
+            health.rejected += 1
+        raise ProviderUnavailableError(
+            f"{provider} at {endpoint or 'default'} is unavailable (circuit open after "
+            f"{health.consecutive_failures} failures: {health.last_error})"
+        )
+
+    def ensure_not_open(self, provider: str, endpoint: Optional[str]) -> None:
+        """Raise ProviderUnavailableError while the breaker is open, without admitting a trial call."""
+        with self._lock:
+            health = self._get(provider, endpoint)
+            if health.state != OPEN or time.time() - (health.opened_at or 0) >= AI_BREAKER_RESET_SECONDS:
+                return
+            health.rejected += 1
+        raise ProviderUnavailableError(
+            f"{provider} at {endpoint or 'default'} is unavailable (circuit open after "
+            f"{health.consecutive_failures} failures: {health.last_error})"
+        )
+
+    def record_success(self, provider: str, endpoint: Optional[str]) -> None:
+        with self._lock:
+            health = self._get(provider, endpoint)
+            if health.state != CLOSED:
+                logger.info(f"Circuit closed for {provider} at {endpoint or 'default'}")
+            health.state = CLOSED
+            health.trial_started_at = None
+            health.consecutive_failures = 0
+            health.last_ok_at = time.time()
+            health.successes += 1
+
+    def record_failure(self, provider: str, endpoint: Optional[str], error: Any) -> None:
+        with self._lock:
+            health = self._get(provider, endpoint)
+            health.consecutive_failures += 1
+            health.failures += 1
+            health.last_failure_at = time.time()
+            health.last_error = str(error)[:200]
+            health.trial_started_at = None
+            if health.state == HALF_OPEN or (
+                health.state == CLOSED and health.consecutive_failures >= AI_BREAKER_FAILURE_THRESHOLD
+            ):
+                health.state = OPEN
+                health.opened_at = time.time()
+                logger.warning(f"Circuit opened for {provider} at {endpoint or 'default'} after "
+                               f"{health.consecutive_failures} consecutive failures: {health.last_error}")
+
+    def is_fresh(self, provider: str, endpoint: Optional[str]) -> bool:
+        """True when the endpoint answered successfully within the TTL."""
+        with self._lock:
+            health = self._get(provider, endpoint)
+            return (health.state == CLOSED and health.last_ok_at is not None
+                    and time.time() - health.last_ok_at < AI_HEALTH_TTL_SECONDS)
+
+    def check_ollama(self, endpoint: str, timeout: float = 5) -> None:
+        """
+        Ensure an Ollama endpoint is reachable.
+
+        Uses cached liveness within the TTL, fails fast while the breaker is
+        open, and otherwise probes /api/tags. Raises on failure.
+        """
+        if self.is_fresh("ollama", endpoint):
+            return
+        self.before_call("ollama", endpoint)
+        with self._lock:
+            self._get("ollama", endpoint).probes += 1
+        try:
+            response = ollama_get(endpoint, "/api/tags", timeout=timeout)
+        except Exception as e:
+            self.record_failure("ollama", endpoint, e)
+            raise
+        if response.status_code != 200:
+            error = f"/api/tags returned {response.status_code}"
+            self.record_failure("ollama", endpoint, error)
+            raise ValueError(f"Cannot connect to Ollama at {endpoint}: {error}")
+        self.record_success("ollama", endpoint)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "ttl_seconds": AI_HEALTH_TTL_SECONDS,
+                "failure_threshold": AI_BREAKER_FAILURE_THRESHOLD,
+                "reset_seconds": AI_BREAKER_RESET_SECONDS,
+                "endpoints": [h.as_dict() for h in self._endpoints.values()],
+            }
+
+    def reset(self, provider: Optional[str] = None, endpoint: Optional[str] = None) -> int:
+        """Forget state (all, or one endpoint) so the next call probes again; returns entries cleared."""
+        with self._lock:
+            if provider is None:
+                count = len(self._endpoints)
+                self._endpoints.clear()
+                return count
+            return 1 if self._endpoints.pop((provider, (endpoint or "").rstrip("/")), None) else 0
+
+
+# Global registry instance
+provider_health = ProviderHealthRegistry()
+
+
+def guarded_ollama_post(endpoint: str, path: str, payload: Dict[str, Any], timeout: float,
+                        stream: bool = False, org_id: Any = None) -> requests.Response:
+    """
+    ollama_post that fails fast while the endpoint's breaker is open and reports the outcome.
+
+    Non-streamed calls hold a concurrency slot for their duration and are
+    recorded in llm_metrics; a streamed response is still being read after
+    this returns, so the caller holds the slot and records the call (see
+    llm_cache.stream_ollama_generate).
+    """
+    provider_health.before_call("ollama", endpoint)
+    model = payload.get("model", "")
+    started = time.monotonic()
+    try:
+        if stream:
+            response = ollama_post(endpoint, path, payload, timeout=timeout, stream=True)
+        else:
+            with ai_concurrency.slot("ollama", endpoint) as slot:
+                response = ollama_post(endpoint, path, payload, timeout=timeout)
+                slot.report_status(response.status_code)
+    except requests.exceptions.RequestException as e:
+        provider_health.record_failure("ollama", endpoint, e)
+        if not stream:
+            llm_metrics.record_call("ollama", model, time.monotonic() - started, failure_kind(e), org_id=org_id)
+        raise
+    if not stream:
+        duration = time.monotonic() - started
+        if response.status_code == 200:
+            try:
+                llm_metrics.record_ollama_response(model, duration, response.json(), org_id=org_id)
+            except ValueError:
+                llm_metrics.record_call("ollama", model, duration, "invalid_response", org_id=org_id)
+        else:
+            outcome = "rate_limited" if response.status_code == 429 else "http_error"
+            llm_metrics.record_call("ollama", model, duration, outcome, org_id=org_id)
+    if response.status_code >= 500:
+        provider_health.record_failure("ollama", endpoint, f"{path} returned {response.status_code}")
+    else:
+        # 4xx (e.g. unknown model) still proves the server is up
+        provider_health.record_success("ollama", endpoint)
+    return response
+
+
+def guarded_chat_completion(client, org_id: Any = None, **params):
+    """client.chat.completions.create that fails fast while the endpoint's breaker is open."""
+    import openai
+
+    endpoint = str(getattr(client, "base_url", "") or "")
+    provider_health.before_call("openai", endpoint)
+    started = time.monotonic()
+    try:
+        with ai_concurrency.slot("openai", endpoint):
+            response = client.chat.completions.create(**params)
+    except (openai.APIConnectionError, openai.InternalServerError) as e:
+        # APITimeoutError is an APIConnectionError; auth/quota/4xx errors are not outages
+        provider_health.record_failure("openai", endpoint, e)
+        llm_metrics.record_call("openai", params.get("model"), time.monotonic() - started, failure_kind(e),
+                                org_id=org_id)
+        raise
+    except openai.APIStatusError as e:
+        provider_health.record_success("openai", endpoint)
+        llm_metrics.record_call("openai", params.get("model"), time.monotonic() - started, failure_kind(e),
+                                org_id=org_id)
+        raise
+    provider_health.record_success("openai", endpoint)
+    llm_metrics.record_openai_response(params, time.monotonic() - started, response, org_id=org_id)
+    return response
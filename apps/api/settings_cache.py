@@ -0,0 +1,205 @@
+"""
+Process-local cache of per-organisation AI settings.
+
+AI call paths read settings through settings_cache.get(org_id) instead of
+opening a session and querying the settings table each time. Entries are
+immutable snapshots with the OpenAI key already decrypted, held for
+SETTINGS_CACHE_TTL_SECONDS.
+
+save_ai_settings calls invalidate(org_id), which drops the local entry and
+publishes the org id on a Redis channel. Every API and worker process
+subscribes to that channel and drops its own entry, so changes apply
+everywhere as soon as the message arrives. While the subscription is down,
+entries expire after SETTINGS_CACHE_FALLBACK_TTL_SECONDS instead, which keeps
+changes visible within about a second without Redis.
+"""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, fields
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_CACHE_TTL_SECONDS = float(os.getenv("SETTINGS_CACHE_TTL_SECONDS", "300"))
+SETTINGS_CACHE_FALLBACK_TTL_SECONDS = float(os.getenv("SETTINGS_CACHE_FALLBACK_TTL_SECONDS", "1"))
+SETTINGS_INVALIDATION_CHANNEL = "settings:invalidate"
+
+@dataclass(frozen=True, slots=True, repr=False)
+class OrgSettings:
+    """
+    Read-only snapshot of a Settings row.
+
+    Attribute names match the Settings model so callers can use either;
+    openai_api_key holds the decrypted key (None if it could not be decrypted).
+    Update the Settings row and invalidate the cache to change them.
+    """
+
+    org_id: Any = None
+    ai_provider: Optional[str] = None
+    openai_model: Optional[str] = None
+    openai_endpoint: Optional[str] = None
+    openai_vision_model: Optional[str] = None
+    ollama_endpoint: Optional[str] = None
+    ollama_model: Optional[str] = None
+    ollama_vision_model: Optional[str] = None
+    ollama_context_size: Optional[int] = None
+    min_confidence_threshold: Optional[float] = None
+    use_dual_vision_validation: Optional[bool] = None
+    use_model_cascade: Optional[bool] = None
+    cascade_ollama_model: Optional[str] = None
+    cascade_openai_model: Optional[str] = None
+    cascade_escalate_min: Optional[float] = None
+    cascade_escalate_max: Optional[float] = None
+    updated_at: Optional[datetime] = None
+    openai_api_key: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row: Any, openai_api_key: Optional[str]) -> "OrgSettings":
+        """Copy the snapshot fields from a Settings row; the key is passed already decrypted."""
+        values = {f.name: getattr(row, f.name, None) for f in fields(cls) if f.name != "openai_api_key"}
+        return cls(**values, openai_api_key=openai_api_key)
+
+    def __repr__(self):
+        return f"<OrgSettings org_id={self.org_id} provider={self.ai_provider}>"
+
+
+class SettingsCache:
+    """TTL cache of OrgSettings keyed by org_id, invalidated over Redis pub/sub."""
+
+    def __init__(self, ttl_seconds: float = SETTINGS_CACHE_TTL_SECONDS,
+                 fallback_ttl_seconds: float = SETTINGS_CACHE_FALLBACK_TTL_SECONDS,
+                 redis_url: Optional[str] = None):
+        self.ttl_seconds = ttl_seconds
+        self.fallback_ttl_seconds = fallback_ttl_seconds
+        self.redis_url = redis_url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[float, OrgSettings]] = {}
+        # Bumped on every invalidation so a load racing with one is not cached
+        self._generations: Dict[str, int] = {}
+        self._listener: Optional[threading.Thread] = None
+        self._subscribed = threading.Event()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, org_id) -> OrgSettings:
+        """Settings for an org, loading (and creating from env defaults) on a miss."""
+        self._ensure_listener()
+        key = str(org_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._stats["hits"] += 1
+                return entry[1]
+            self._stats["misses"] += 1
+            generation = self._generations.get(key, 0)
+
+        snapshot = self._load(org_id)
+        ttl = self.ttl_seconds if self._subscribed.is_set() else self.fallback_ttl_seconds
+        with self._lock:
+            if self._generations.get(key, 0) == generation:
+                self._entries[key] = (time.monotonic() + ttl, snapshot)
+        return snapshot
+
+    def _load(self, org_id) -> OrgSettings:
+        # Imported lazily: ai_scanner reads settings through this module
+        from database import SessionLocal
+        from ai_scanner import get_or_create_settings, _resolve_api_key
+
+        db = SessionLocal()
+        try:
+            row = get_or_create_settings(db, org_id)
+            return OrgSettings.from_row(row, _resolve_api_key(row.openai_api_key))
+        finally:
+            db.close()
+
+    def invalidate(self, org_id, publish: bool = True) -> None:
+        """Drop an org's entry here and, when publish is set, in every other process."""
+        self._drop(str(org_id))
+        if not publish:
+            return
+        try:
+            import redis
+            client = redis.Redis.from_url(self.redis_url, socket_timeout=1, socket_connect_timeout=1)
+            try:
+                client.publish(SETTINGS_INVALIDATION_CHANNEL, str(org_id))
+            finally:
+                client.close()
+        except Exception as e:
+            logger.warning(f"Settings cache: failed to publish invalidation for org {org_id}: {e}")
+
+    def _drop(self, key: str) -> None:
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            if self._entries.pop(key, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in self._entries:
+                self._generations[key] = self._generations.get(key, 0) + 1
+            self._entries.clear()
+
+    def _ensure_listener(self) -> None:
+        if self._listener is not None and self._listener.is_alive():
+            return
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, name="settings-cache-invalidation", daemon=True)
+            self._listener.start()
+
+    def _listen(self) -> None:
+        """Subscribe to invalidations, reconnecting with backoff for the life of the process."""
+        import redis
+
+        backoff = 1.0
+        while True:
+            pubsub = None
+            try:
+                client = redis.Redis.from_url(self.redis_url, socket_connect_timeout=2, health_check_interval=30)
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(SETTINGS_INVALIDATION_CHANNEL)
+                # Anything cached before the subscription may have missed a message
+                self.clear()
+                self._subscribed.set()
+                backoff = 1.0
+                for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = message.get("data")
+                    self._drop(data.decode() if isinstance(data, bytes) else str(data))
+            except Exception as e:
+                if self._subscribed.is_set():
+                    logger.warning(f"Settings cache: invalidation subscription lost ({e}); "
+                                   f"using {self.fallback_ttl_seconds}s TTL until it reconnects")
+                self._subscribed.clear()
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "subscribed": self._subscribed.is_set()}
+
+    def _reset_after_fork(self) -> None:
+        # The listener thread does not survive fork; the child starts its own lazily
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._generations = {}
+        self._listener = None
+        self._subscribed = threading.Event()
+
+
+# Global settings cache instance
+settings_cache = SettingsCache()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=settings_cache._reset_after_fork)
@@ -3,9 +3,18 @@ Text extraction pipeline for various document formats.
 Supports PDF, DOCX, TXT, and images with OCR.
 """
 import io
+import mmap
+import multiprocessing
 import os
 import logging
-from typing import List, Dict, Tuple, Optional, Any
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Tuple, Optional, Any, Callable, Generator, Iterable, Iterator
 from pathlib import Path
 import fitz  # PyMuPDF
 import pdfplumber
@@ -15,15 +24,259 @@ import pytesseract
 
 logger = logging.getLogger(__name__)
 
+# Recorded on fully extracted documents; bump when a change alters the extracted text
+# so pages stored by older versions are no longer reused (see extraction_cache)
+EXTRACTOR_VERSION = "4"
+
+# PDFs with at least this many pages are extracted in page ranges across a process pool
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+# Processes in the extraction pool of each worker process (0 = one per CPU)
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", "0")) or os.cpu_count() or 1
+# Pages per task handed to a pool process
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+# PyMuPDF pages with fewer non-space characters than this are retried with pdfplumber
+PDF_MIN_PAGE_CHARS = int(os.getenv("PDF_MIN_PAGE_CHARS", "20"))
+# OCR PDF pages that have no usable text layer but contain images (scans)
+PDF_OCR_ENABLED = os.getenv("PDF_OCR_ENABLED", "true").lower() == "true"
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", "300"))
+PDF_OCR_LANG = os.getenv("PDF_OCR_LANG", "eng")
+# Per-document caps so one long scan can't monopolise the extraction queue
+PDF_OCR_MAX_PAGES = int(os.getenv("PDF_OCR_MAX_PAGES", "50"))
+PDF_OCR_MAX_SECONDS = float(os.getenv("PDF_OCR_MAX_SECONDS", "300"))
+# Where a PDF is written once for the pool processes to memory-map (tmpfs when available)
+PDF_SHARED_DIR = os.getenv("PDF_SHARED_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+IMAGE_MIME_TYPES = ["image/png", "image/jpeg", "image/jpg", "image/gif", "image/bmp", "image/tiff", "image/webp"]
+
+# Extracts pages from file bytes; the int is start_page, below which an engine may skip work
+PageEngine = Callable[[bytes, int], Iterable[Dict[str, Any]]]
+
+_pool_lock = threading.Lock()
+_pools: Dict[int, ProcessPoolExecutor] = {}
+# PyMuPDF is not thread-safe, and threads of one process can extract at once
+# (e.g. the concurrent provider analyses of dual-vision validation), so every
+# in-process use of fitz holds this lock; pool processes are single-threaded
+_fitz_lock = threading.RLock()
+
+
+def _extraction_pool(workers: int) -> ProcessPoolExecutor:
+    """This process's extraction pool of the given size, started on first use."""
+    with _pool_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            # spawn: the Celery/API processes are multi-threaded, which fork doesn't survive reliably
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pools[workers] = pool
+        return pool
+
+
+def _discard_pool(workers: int) -> None:
+    with _pool_lock:
+        pool = _pools.pop(workers, None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _reset_after_fork() -> None:
+    # Pools belong to the parent; a forked child starts its own on demand
+    global _pool_lock, _pools, _fitz_lock
+    _pool_lock = threading.Lock()
+    _pools = {}
+    _fitz_lock = threading.RLock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _fitz_text_ok(text: str) -> bool:
+    """
+    Whether PyMuPDF's text for a page looks usable.
+
+    Rejects near-empty pages, text full of replacement/private-use glyphs
+    (fonts without a usable ToUnicode map) and text that is mostly symbols
+    or has lost its word spacing; those pages are retried with pdfplumber.
+    """
+    chars = [c for c in text if not c.isspace()]
+    if len(chars) < PDF_MIN_PAGE_CHARS:
+        return False
+    garbled = sum(1 for c in chars if c == "\ufffd" or "\ue000" <= c <= "\uf8ff" or ord(c) < 32)
+    if garbled / len(chars) > 0.05:
+        return False
+    if sum(1 for c in chars if c.isalnum()) / len(chars) < 0.5:
+        return False
+    words = text.split()
+    return len(chars) / len(words) <= 25
+
+
+def _alnum_count(text: str) -> int:
+    return sum(1 for c in text if c.isalnum())
+
+
+def _extract_pdf_pages(source, start: int = 0, end: Optional[int] = None,
+                       path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Pages [start, end) of a PDF, numbered from start + 1.
+
+    Every page is read with PyMuPDF; pages whose text fails _fitz_text_ok are
+    read again with pdfplumber and keep whichever result has more content.
+    Each page records the engine that produced it and the seconds spent on it.
+
+    source is the PDF as bytes or as a read-only mmap of it (then path names
+    the file, which PyMuPDF opens itself). pdfplumber reads either in place.
+    """
+    pages: List[Dict[str, Any]] = []
+    with _fitz_lock:
+        try:
+            pdf_doc = fitz.open(path) if path else fitz.open(stream=bytes(source), filetype="pdf")
+        except Exception as e:
+            logger.warning(f"PyMuPDF failed: {e}, extracting every page with pdfplumber")
+            pdf_doc = None
+
+        if pdf_doc is not None:
+            with pdf_doc:
+                for index in range(start, pdf_doc.page_count if end is None else min(end, pdf_doc.page_count)):
+                    started = time.perf_counter()
+                    try:
+                        text = pdf_doc[index].get_text().strip()
+                    except Exception as e:
+                        logger.warning(f"PyMuPDF failed on page {index + 1}: {e}")
+                        text = ""
+                    pages.append({"page_num": index + 1, "text": text, "engine": "pymupdf",
+                                  "seconds": time.perf_counter() - started})
+    if pdf_doc is not None:
+        retry = {page["page_num"]: page for page in pages if not _fitz_text_ok(page["text"])}
+    else:
+        retry = None
+
+    if retry == {}:
+        return pages
+    try:
+        selected = sorted(retry) if retry is not None else (list(range(start + 1, end + 1)) if end is not None else None)
+        # Only the selected pages are parsed, not every page object of the document
+        with pdfplumber.open(io.BytesIO(source) if isinstance(source, bytes) else source, pages=selected) as pdf:
+            for page in pdf.pages[start:] if selected is None else pdf.pages:
+                started = time.perf_counter()
+                text = (page.extract_text() or "").strip()
+                elapsed = time.perf_counter() - started
+                if retry is None:
+                    pages.append({"page_num": page.page_number, "text": text, "engine": "pdfplumber",
+                                  "seconds": elapsed})
+                    continue
+                fitz_page = retry[page.page_number]
+                fitz_page["seconds"] += elapsed
+                if _alnum_count(text) > _alnum_count(fitz_page["text"]):
+                    fitz_page.update(text=text, engine="pdfplumber")
+    except Exception as e:
+        logger.error(f"pdfplumber failed: {e}")
+    return pages
+
+
+def _page_needs_ocr(page: Dict[str, Any]) -> bool:
+    return len("".join(page["text"].split())) < PDF_MIN_PAGE_CHARS
+
+
+def _ocr_pdf_page(pdf_doc, index: int, dpi: int, lang: str) -> Tuple[str, float]:
+    """(text, seconds) for one page, rasterised in greyscale at dpi and read with tesseract."""
+    started = time.perf_counter()
+    try:
+        pixmap = pdf_doc[index].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        image = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+        text = pytesseract.image_to_string(image, lang=lang, timeout=PDF_OCR_MAX_SECONDS).strip()
+    except Exception as e:
+        logger.warning(f"OCR failed on page {index + 1}: {e}")
+        text = ""
+    return text, time.perf_counter() - started
+
+
+def _ocr_shared_pdf_page(path: str, index: int, dpi: int, lang: str) -> Tuple[str, float]:
+    """Pool task: OCR one page of the PDF at path."""
+    with fitz.open(path) as pdf_doc:
+        return _ocr_pdf_page(pdf_doc, index, dpi, lang)
+
+
+@contextmanager
+def _shared_pdf_file(file_content: bytes):
+    """Path of a temporary copy of the PDF in PDF_SHARED_DIR for pool tasks to open; removed on exit."""
+    fd, path = tempfile.mkstemp(prefix="extract-", suffix=".pdf", dir=PDF_SHARED_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(file_content)
+        yield path
+    finally:
+        os.unlink(path)
+
+
+class _OcrBudget:
+    """OCR pages and seconds still available to one document."""
+
+    def __init__(self, pages: int = PDF_OCR_MAX_PAGES, seconds: float = PDF_OCR_MAX_SECONDS):
+        self.pages_left = pages
+        self.seconds_left = seconds
+
+
+def _decode_text(file_content: bytes) -> str:
+    """UTF-8, else the encoding chardet detects, else latin-1."""
+    try:
+        return file_content.decode("utf-8")
+    except UnicodeDecodeError:
+        pass
+    try:
+        import chardet
+        encoding = chardet.detect(file_content[:65536]).get("encoding")
+        if encoding:
+            return file_content.decode(encoding, errors="ignore")
+    except (ImportError, LookupError):
+        pass
+    return file_content.decode("latin-1", errors="ignore")
+
+
+def engine_timings(pages: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """{engine: {"pages": n, "seconds": s}} over extracted pages."""
+    timings: Dict[str, Dict[str, float]] = {}
+    for page in pages:
+        entry = timings.setdefault(page.get("engine") or "unknown", {"pages": 0, "seconds": 0.0})
+        entry["pages"] += 1
+        entry["seconds"] += page.get("seconds", 0.0)
+    for entry in timings.values():
+        entry["seconds"] = round(entry["seconds"], 3)
+    return timings
+
+
+def _extract_shared_pdf_pages(path: str, start: int, end: int) -> List[Dict[str, Any]]:
+    """Pool task: pages [start, end) of the PDF at path, read through a shared read-only memory map."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return _extract_pdf_pages(buffer, start, end, path=path)
+
 class TextExtractor:
     """
     Text extraction pipeline that handles multiple document formats.
     """
     
-    def __init__(self):
+    def __init__(self, parallel_min_pages: int = PDF_PARALLEL_MIN_PAGES, workers: int = PDF_EXTRACTION_WORKERS,
+                 pages_per_task: int = PDF_PAGES_PER_TASK):
         # Set tesseract path if needed (adjust for your system)
         # pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
-        pass
+        self.parallel_min_pages = parallel_min_pages
+        self.workers = workers
+        self.pages_per_task = max(1, pages_per_task)
+
+        self.engines: Dict[str, PageEngine] = {}
+        self.register_engine(["application/pdf"], self._iter_pdf_pages)
+        self.register_engine([DOCX_MIME_TYPE], lambda content, start_page: self._extract_docx_text(content))
+        self.register_engine(["text/plain", "text/csv"], lambda content, start_page: self._extract_txt_text(content))
+        self.register_engine(["text/markdown"], lambda content, start_page: self._extract_markdown_text(content))
+        self.register_engine(["text/html"], lambda content, start_page: self._extract_html_text(content))
+        self.register_engine(IMAGE_MIME_TYPES, lambda content, start_page: self._extract_image_text(content))
+
+    def register_engine(self, mime_types: Iterable[str], engine: PageEngine) -> None:
+        """Use engine for these MIME types, replacing any engine registered for them."""
+        for mime_type in mime_types:
+            self.engines[mime_type] = engine
+
+    def supports(self, mime_type: str) -> bool:
+        return mime_type in self.engines
     
     def extract_text(self, file_content: bytes, filename: str, mime_type: str) -> List[Dict[str, Any]]:
         """
@@ -38,62 +291,182 @@ class TextExtractor:
             List of dicts with page_num and text for each page
         """
         try:
-            if mime_type == "application/pdf":
-                return self._extract_pdf_text(file_content)
-            elif mime_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-                return self._extract_docx_text(file_content)
-            elif mime_type == "text/plain":
-                return self._extract_txt_text(file_content)
-            elif mime_type in ["image/png", "image/jpeg", "image/jpg", "image/gif", "image/bmp", "image/tiff", "image/webp"]:
-                return self._extract_image_text(file_content)
-            else:
-                logger.warning(f"Unsupported file type: {mime_type}")
-                return []
+            return list(self.iter_pages(file_content, filename, mime_type))
         except Exception as e:
             logger.error(f"Error extracting text from {filename}: {str(e)}")
             return []
-    
-    def _extract_pdf_text(self, file_content: bytes) -> List[Dict[str, Any]]:
-        """Extract text from PDF using both PyMuPDF and pdfplumber for best results."""
-        pages = []
-        
+
+    def iter_pages(self, file_content: bytes, filename: str, mime_type: str,
+                   start_page: int = 0) -> Generator[Dict[str, Any], None, None]:
+        """
+        Yield the pages extract_text would return, in page order, as they are extracted.
+
+        The engine registered for mime_type does the work. PDFs are extracted
+        in pages_per_task ranges, so only a range or two of page text is held
+        at a time; other formats are a single page. Pages numbered start_page
+        or lower are skipped (for PDFs, never extracted). Unlike extract_text,
+        extraction errors are raised to the caller.
+        """
+        engine = self.engines.get(mime_type)
+        if engine is None:
+            logger.warning(f"Unsupported file type: {mime_type}")
+            return
+        yield from (page for page in engine(file_content, start_page) if page["page_num"] > start_page)
+
+    def _iter_pdf_pages(self, file_content: bytes, start_page: int = 0) -> Iterator[Dict[str, Any]]:
+        """
+        Extract text from PDF using both PyMuPDF and pdfplumber for best results.
+
+        Pages are read a range at a time, on the process pool for PDFs of
+        parallel_min_pages or more. Pages of each range left without text are
+        then OCRed (see _ocr_textless_pages) before the range is yielded.
+        Per-engine page counts and timings are logged once all pages are out.
+        """
+        timings: List[Dict[str, Any]] = []
+        budget = _OcrBudget() if PDF_OCR_ENABLED else None
+        with ExitStack() as stack:
+            shared: Dict[str, str] = {}
+
+            def shared_path() -> str:
+                # Written to PDF_SHARED_DIR only once something runs on the pool
+                if "path" not in shared:
+                    shared["path"] = stack.enter_context(_shared_pdf_file(file_content))
+                return shared["path"]
+
+            for batch in self._pdf_text_layer_batches(file_content, start_page, shared_path):
+                if budget is not None:
+                    self._ocr_textless_pages(file_content, batch, budget, shared_path)
+                for page in batch:
+                    timings.append({"engine": page["engine"], "seconds": page["seconds"]})
+                    yield page
+        logger.info(f"PDF extracted ({len(timings)} pages), by engine: {engine_timings(timings)}")
+
+    def _pdf_text_layer_batches(self, file_content: bytes, start_page: int,
+                                shared_path: Callable[[], str]) -> Iterator[List[Dict[str, Any]]]:
+        """Text-layer pages after start_page, in consecutive ranges of pages_per_task."""
         try:
-            # First try with pdfplumber for better text extraction
-            with pdfplumber.open(io.BytesIO(file_content)) as pdf:
-                for page_num, page in enumerate(pdf.pages, 1):
-                    text = page.extract_text()
-                    if text:
-                        pages.append({
-                            "page_num": page_num,
-                            "text": text.strip()
-                        })
-                    else:
-                        # If pdfplumber fails, try PyMuPDF
-                        pages.append({
-                            "page_num": page_num,
-                            "text": ""
-                        })
+            with _fitz_lock, fitz.open(stream=file_content, filetype="pdf") as pdf_doc:
+                page_count = pdf_doc.page_count
+        except Exception:
+            # PyMuPDF can't read it; _extract_pdf_pages falls back to pdfplumber for every page
+            yield _extract_pdf_pages(file_content, start_page)
+            return
+        ranges = [(start, min(start + self.pages_per_task, page_count))
+                  for start in range(start_page, page_count, self.pages_per_task)]
+        if self.workers > 1 and page_count >= self.parallel_min_pages and len(ranges) > 1:
+            done = 0
+            try:
+                for batch in self._extract_pdf_parallel(ranges, shared_path):
+                    done += 1
+                    yield batch
+            except Exception as e:
+                logger.warning(f"Parallel PDF extraction failed ({e}), extracting the remaining pages serially")
+            ranges = ranges[done:]
+        for start, end in ranges:
+            yield _extract_pdf_pages(file_content, start, end)
+
+    def _extract_pdf_parallel(self, ranges: List[Tuple[int, int]],
+                              shared_path: Callable[[], str]) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Extract page ranges in the process pool, yielding them in order.
+
+        The PDF is written once to PDF_SHARED_DIR and each task memory-maps it,
+        so the document is neither pickled nor copied per task. At most two
+        ranges per worker are queued ahead of the one being consumed.
+        """
+        started = time.monotonic()
+        path = shared_path()
+        pool = _extraction_pool(self.workers)
+        pending = deque(pool.submit(_extract_shared_pdf_pages, path, start, end)
+                        for start, end in ranges[:self.workers * 2])
+        queued = iter(ranges[self.workers * 2:])
+        try:
+            while pending:
+                pages = pending.popleft().result()
+                following = next(queued, None)
+                if following is not None:
+                    pending.append(pool.submit(_extract_shared_pdf_pages, path, *following))
+                yield pages
+        except BrokenProcessPool:
+            _discard_pool(self.workers)
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+        logger.info(f"Extracted {ranges[-1][1] - ranges[0][0]} PDF pages in {len(ranges)} ranges on "
+                    f"{self.workers} processes in {time.monotonic() - started:.1f}s")
+
+    def _ocr_textless_pages(self, file_content: bytes, pages: List[Dict[str, Any]], budget: _OcrBudget,
+                            shared_path: Callable[[], str]) -> None:
+        """
+        OCR, in place, pages without usable text that contain images.
+
+        Only those pages are rasterised (PyMuPDF, PDF_OCR_DPI) and read with
+        tesseract, in the process pool when there are several. The document's
+        budget (PDF_OCR_MAX_PAGES pages, PDF_OCR_MAX_SECONDS) is shared by all
+        of its ranges; pages past either cap keep their empty text. OCRed
+        pages get engine "tesseract" and ocr=True.
+        """
+        candidates = [page for page in pages if _page_needs_ocr(page)]
+        if not candidates:
+            return
+        try:
+            with _fitz_lock, fitz.open(stream=file_content, filetype="pdf") as pdf_doc:
+                scanned = [page for page in candidates if pdf_doc[page["page_num"] - 1].get_images()]
         except Exception as e:
-            logger.warning(f"pdfplumber failed: {e}, trying PyMuPDF")
-            
-            # Fallback to PyMuPDF
+            logger.warning(f"Could not inspect PDF pages for OCR: {e}")
+            return
+        if not scanned:
+            return
+        targets = scanned[:budget.pages_left] if budget.seconds_left > 0 else []
+        if len(scanned) > len(targets):
+            logger.warning(f"OCR cap reached: {len(scanned) - len(targets)} scanned pages from page "
+                           f"{scanned[len(targets)]['page_num']} left without text")
+        if not targets:
+            return
+        budget.pages_left -= len(targets)
+
+        started = time.monotonic()
+        deadline = started + budget.seconds_left
+        results: Dict[int, Tuple[str, float]] = {}
+        if self.workers > 1 and len(targets) > 1:
             try:
-                pdf_doc = fitz.open(stream=file_content, filetype="pdf")
-                pages = []
-                for page_num in range(pdf_doc.page_count):
-                    page = pdf_doc[page_num]
-                    text = page.get_text()
-                    pages.append({
-                        "page_num": page_num + 1,
-                        "text": text.strip()
-                    })
-                pdf_doc.close()
-            except Exception as e2:
-                logger.error(f"PyMuPDF also failed: {e2}")
-                pages = []
-        
-        return pages
-    
+                path = shared_path()
+                pool = _extraction_pool(self.workers)
+                futures = {pool.submit(_ocr_shared_pdf_page, path, page["page_num"] - 1, PDF_OCR_DPI,
+                                       PDF_OCR_LANG): page["page_num"] for page in targets}
+                try:
+                    for future in as_completed(futures, timeout=budget.seconds_left):
+                        results[futures[future]] = future.result()
+                except FutureTimeoutError:
+                    logger.warning(f"OCR time cap ({PDF_OCR_MAX_SECONDS:.0f}s) reached after "
+                                   f"{len(results)} of {len(targets)} pages")
+                finally:
+                    for future in futures:
+                        future.cancel()
+            except BrokenProcessPool:
+                _discard_pool(self.workers)
+                logger.error("OCR process pool broke; scanned pages left without text")
+        else:
+            with _fitz_lock, fitz.open(stream=file_content, filetype="pdf") as pdf_doc:
+                for page in targets:
+                    if time.monotonic() >= deadline:
+                        logger.warning(f"OCR time cap ({PDF_OCR_MAX_SECONDS:.0f}s) reached after "
+                                       f"{len(results)} of {len(targets)} pages")
+                        break
+                    results[page["page_num"]] = _ocr_pdf_page(pdf_doc, page["page_num"] - 1, PDF_OCR_DPI,
+                                                              PDF_OCR_LANG)
+        budget.seconds_left -= time.monotonic() - started
+
+        by_num = {page["page_num"]: page for page in targets}
+        for page_num, (text, seconds) in results.items():
+            page = by_num[page_num]
+            page["seconds"] = page.get("seconds", 0.0) + seconds
+            if _alnum_count(text) > _alnum_count(page["text"]):
+                page.update(text=text, engine="tesseract", ocr=True)
+        logger.info(f"OCR: {sum(1 for p in targets if p.get('ocr'))} of {len(targets)} scanned pages read "
+                    f"in {time.monotonic() - started:.1f}s")
+
     def _extract_docx_text(self, file_content: bytes) -> List[Dict[str, Any]]:
         """Extract text from DOCX file."""
         try:
@@ -115,7 +488,8 @@ class TextExtractor:
             
             return [{
                 "page_num": 1,
-                "text": full_text
+                "text": full_text,
+                "engine": "python-docx"
             }] if full_text else []
             
         except Exception as e:
@@ -125,21 +499,47 @@ class TextExtractor:
     def _extract_txt_text(self, file_content: bytes) -> List[Dict[str, Any]]:
         """Extract text from plain text file."""
         try:
-            # Try UTF-8 first, fallback to latin-1
-            try:
-                text = file_content.decode('utf-8')
-            except UnicodeDecodeError:
-                text = file_content.decode('latin-1', errors='ignore')
+            text = _decode_text(file_content)
             
             return [{
                 "page_num": 1,
-                "text": text.strip()
+                "text": text.strip(),
+                "engine": "text"
             }] if text.strip() else []
             
         except Exception as e:
             logger.error(f"Error extracting TXT text: {e}")
             return []
     
+    def _extract_markdown_text(self, file_content: bytes) -> List[Dict[str, Any]]:
+        """Extract the text of a Markdown file, without its markup."""
+        try:
+            import markdown
+            return self._extract_html_text(markdown.markdown(_decode_text(file_content)).encode("utf-8"),
+                                           engine="markdown")
+        except Exception as e:
+            logger.error(f"Error extracting Markdown text: {e}")
+            return self._extract_txt_text(file_content)
+
+    def _extract_html_text(self, file_content: bytes, engine: str = "html") -> List[Dict[str, Any]]:
+        """Extract the visible text of an HTML file (scripts and styles dropped)."""
+        try:
+            from bs4 import BeautifulSoup
+            soup = BeautifulSoup(file_content, "html.parser")
+            for element in soup(["script", "style"]):
+                element.decompose()
+            text = soup.get_text().strip()
+
+            return [{
+                "page_num": 1,
+                "text": text,
+                "engine": engine
+            }] if text else []
+
+        except Exception as e:
+            logger.error(f"Error extracting HTML text: {e}")
+            return []
+
     def _extract_image_text(self, file_content: bytes) -> List[Dict[str, Any]]:
         """Extract text from image using OCR."""
         try:
@@ -155,7 +555,9 @@ class TextExtractor:
             
             return [{
                 "page_num": 1,
-                "text": text.strip()
+                "text": text.strip(),
+                "engine": "tesseract",
+                "ocr": True
             }] if text.strip() else []
             
         except Exception as e:
@@ -178,11 +580,28 @@ class TextExtractor:
             List of text chunks with metadata
         """
         pages = self.extract_text(file_content, filename, mime_type)
+        return self.chunk_pages(pages, chunk_size=chunk_size, overlap=overlap)
+
+    def chunk_pages(self, pages: List[Dict[str, Any]], chunk_size: int = 1000,
+                    overlap: int = 200) -> List[Dict[str, Any]]:
+        """
+        Split already-extracted pages into overlapping chunks.
+        
+        Args:
+            pages: List of {"page_num", "text"} dicts as returned by extract_text
+            chunk_size: Target size for text chunks
+            overlap: Overlap between chunks
+            
+        Returns:
+            List of text chunks with metadata
+        """
         chunks = []
         
         for page in pages:
-            text = page["text"]
+            text = page["text"] or ""
             page_num = page["page_num"]
+            if not text.strip():
+                continue
             
             # Simple text chunking
             if len(text) <= chunk_size:
@@ -3,20 +3,58 @@ Celery worker tasks for document processing and AI scanning.
 """
 import json
 import logging
-from typing import List, Dict, Any
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional
 from celery_app import celery_app
 from database import SessionLocal
-from models import Document, DocumentPage, Scan, ScanResult, Gap, Requirement, Control, EvidenceLink, DocumentControlLink
-from text_extraction import text_extractor
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from models import Document, DocumentChunk, DocumentPage, Scan, ScanBatch, ScanResult, Gap, Requirement, Control, EvidenceLink, DocumentControlLink
+from text_extraction import EXTRACTOR_VERSION, engine_timings, text_extractor
 from ai_scanner import compliance_scanner
 from storage import storage
+from ai_clients import pool_stats
+from evidence_index import EvidenceCorpus, evidence_index
+from extraction_cache import extraction_cache
+from settings_cache import settings_cache
 
 logger = logging.getLogger(__name__)
 
+# Extracted pages written (and committed, with their chunks) per batch
+EXTRACTION_BATCH_PAGES = int(os.getenv("EXTRACTION_BATCH_PAGES", "50"))
+EXTRACTION_MAX_RETRIES = 3
+# A running extraction with no commit for this long is presumed lost and can be queued again
+EXTRACTION_STALE_SECONDS = int(os.getenv("EXTRACTION_STALE_SECONDS", "3600"))
+# Controls scanned at once by a framework batch (each may fan out further)
+FRAMEWORK_SCAN_CONCURRENCY = int(os.getenv("FRAMEWORK_SCAN_CONCURRENCY", "2"))
+# A whole framework takes far longer than the default per-task limits. The
+# batch also checks the soft limit itself and stops starting controls
+FRAMEWORK_SCAN_SOFT_TIME_LIMIT = int(os.getenv("FRAMEWORK_SCAN_SOFT_TIME_LIMIT", "3600"))
+FRAMEWORK_SCAN_TIME_LIMIT = int(os.getenv("FRAMEWORK_SCAN_TIME_LIMIT", "3900"))
+
 @celery_app.task(bind=True)
 def extract_document_text(self, document_id: str):
     """
     Extract text from uploaded document and store in document_pages table.
+
+    Pages are streamed from the extractor and written, with their evidence
+    chunks, EXTRACTION_BATCH_PAGES at a time; each batch is committed
+    together with documents.extraction_checkpoint (the last page written).
+    A retry resumes after the checkpoint instead of starting over.
+
+    A first attempt for content that another document has already been
+    extracted from (same sha256 and extractor version) copies that
+    document's pages and chunks instead (see extraction_cache).
+
+    documents.extraction_status moves to running, then done, or failed once
+    the retries are used up; a document that is already done is skipped.
+    Pages are upserted on (document_id, page_num). Queue it through
+    queue_document_extraction.
     """
     db = SessionLocal()
     try:
@@ -24,42 +62,142 @@ def extract_document_text(self, document_id: str):
         document = db.query(Document).filter(Document.id == document_id).first()
         if not document:
             raise ValueError(f"Document {document_id} not found")
-        
-        logger.info(f"Starting text extraction for document {document.filename}")
-        
+        if document.extraction_status == 'done':
+            logger.info(f"Text extraction for document {document.filename} already done, skipping")
+            return {"status": "skipped", "document_id": str(document.id), "reason": "already extracted"}
+
+        checkpoint = (document.extraction_checkpoint or 0) if self.request.retries else 0
+        if checkpoint:
+            logger.info(f"Resuming text extraction for document {document.filename} after page {checkpoint}")
+        else:
+            logger.info(f"Starting text extraction for document {document.filename}")
+        # Drop anything past the checkpoint (everything on a first attempt)
+        for model in (DocumentPage, DocumentChunk):
+            db.query(model).filter(model.document_id == document.id, model.page_num > checkpoint).delete(
+                synchronize_session=False)
+        document.extraction_checkpoint = checkpoint
+        document.extractor_version = None
+        document.extraction_status = 'running'
+        document.updated_at = datetime.utcnow()
+        db.commit()
+
+        source = extraction_cache.find_extracted(db, document) if not checkpoint else None
+        if source is not None:
+            page_count = extraction_cache.copy_pages(db, source, document)
+            document.extraction_checkpoint = page_count
+            document.extractor_version = EXTRACTOR_VERSION
+            document.extraction_status = 'done'
+            db.commit()
+            return {
+                "status": "success",
+                "document_id": str(document.id),
+                "pages_extracted": page_count,
+                "cache_hit": True,
+                "source_document_id": str(source.id)
+            }
+
         # Download file from storage
         file_content = storage.download_file(document.storage_key)
-        
-        # Extract text pages
-        pages = text_extractor.extract_text(
-            file_content, 
-            document.filename, 
-            document.mime_type
-        )
-        
-        # Store extracted text in database
-        for page_data in pages:
-            doc_page = DocumentPage(
-                document_id=document.id,
-                page_num=page_data["page_num"],
-                text=page_data["text"]
-            )
-            db.add(doc_page)
-        
+
+        page_count = chunk_count = ocr_pages = 0
+        timings: List[Dict[str, Any]] = []
+        batch: List[Dict[str, Any]] = []
+
+        def flush():
+            nonlocal chunk_count
+            statement = pg_insert(DocumentPage)
+            db.execute(statement.on_conflict_do_update(
+                index_elements=[DocumentPage.document_id, DocumentPage.page_num],
+                set_={
+                    "text": statement.excluded.text,
+                    "extraction_engine": statement.excluded.extraction_engine,
+                    "ocr": statement.excluded.ocr,
+                },
+            ), [{
+                "document_id": document.id,
+                "page_num": page_data["page_num"],
+                "text": page_data["text"],
+                "extraction_engine": page_data.get("engine"),
+                "ocr": page_data.get("ocr", False),
+            } for page_data in batch])
+            # Keep the evidence retrieval index in step with the extracted pages
+            chunk_count += evidence_index.index_pages(db, document, batch)
+            document.extraction_checkpoint = batch[-1]["page_num"]
+            # Also marks the running extraction as alive for queue_document_extraction
+            document.updated_at = datetime.utcnow()
+            db.commit()
+            batch.clear()
+
+        for page_data in text_extractor.iter_pages(file_content, document.filename, document.mime_type,
+                                                   start_page=checkpoint):
+            batch.append(page_data)
+            page_count += 1
+            ocr_pages += 1 if page_data.get("ocr") else 0
+            timings.append({"engine": page_data.get("engine"), "seconds": page_data.get("seconds", 0.0)})
+            if len(batch) >= EXTRACTION_BATCH_PAGES:
+                flush()
+        if batch:
+            flush()
+        document.extractor_version = EXTRACTOR_VERSION
+        document.extraction_status = 'done'
         db.commit()
-        
-        logger.info(f"Text extraction completed for document {document.filename}. Extracted {len(pages)} pages.")
-        
+
+        logger.info(f"Text extraction completed for document {document.filename}. Extracted {page_count} pages, indexed {chunk_count} chunks.")
+
         return {
             "status": "success",
             "document_id": str(document.id),
-            "pages_extracted": len(pages)
+            "pages_extracted": page_count,
+            "cache_hit": False,
+            "resumed_after_page": checkpoint,
+            "ocr_pages": ocr_pages,
+            "engines": engine_timings(timings)
         }
-        
+
     except Exception as e:
         logger.error(f"Error extracting text for document {document_id}: {str(e)}")
         db.rollback()
-        raise self.retry(exc=e, countdown=60, max_retries=3)
+        if self.request.retries >= EXTRACTION_MAX_RETRIES:
+            db.query(Document).filter(Document.id == document_id).update(
+                {"extraction_status": 'failed'}, synchronize_session=False)
+            db.commit()
+        raise self.retry(exc=e, countdown=60, max_retries=EXTRACTION_MAX_RETRIES)
+    finally:
+        db.close()
+
+
+def queue_document_extraction(document_id: str) -> Optional[str]:
+    """
+    Queue extract_document_text unless the document's extraction is done or running.
+
+    The document is claimed (status running) by a conditional UPDATE, so
+    concurrent callers queue it at most once. A running extraction that has
+    not committed for EXTRACTION_STALE_SECONDS is presumed lost and may be
+    queued again. Returns the task id, or None when nothing was queued.
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        claimed = db.query(Document).filter(
+            Document.id == document_id,
+            or_(
+                Document.extraction_status.is_(None),
+                Document.extraction_status.notin_(('done', 'running')),
+                and_(Document.extraction_status == 'running',
+                     Document.updated_at < now - timedelta(seconds=EXTRACTION_STALE_SECONDS)),
+            ),
+        ).update({"extraction_status": 'running', "updated_at": now}, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            logger.info(f"Text extraction for document {document_id} is done or running, not queued")
+            return None
+        try:
+            return extract_document_text.delay(str(document_id)).id
+        except Exception:
+            db.query(Document).filter(Document.id == document_id).update(
+                {"extraction_status": 'pending'}, synchronize_session=False)
+            db.commit()
+            raise
     finally:
         db.close()
 
@@ -80,6 +218,14 @@ def process_document_ai_analysis(self, document_id: str, org_id: str):
             return {"status": "skipped", "reason": "document not found"}
         filename = document.filename
         storage_key = document.storage_key
+
+        # The same content was already analysed for this org: reuse its control links
+        source = extraction_cache.find_suggested(db, document)
+        if source is not None:
+            links_copied = extraction_cache.copy_control_links(db, source, document)
+            db.commit()
+            return {"status": "success", "document_id": str(document_id), "cache_hit": True,
+                    "source_document_id": str(source.id), "links_copied": links_copied}
     finally:
         db.close()
 
@@ -102,7 +248,146 @@ def process_document_ai_analysis(self, document_id: str, org_id: str):
     asyncio.run(
         process_document_ai_analysis_background(document_id, filename, file_content, org_id)
     )
-    return {"status": "success", "document_id": str(document_id)}
+    pools = pool_stats()
+    logger.info(f"AI connection pools: {pools['hits']} hits / {pools['misses']} misses ({len(pools['pools'])} open)")
+    return {"status": "success", "document_id": str(document_id), "cache_hit": False}
+
+
+def _store_scan_output(db, scan: Scan, scan_output: Dict[str, Any]):
+    """Add ScanResult and Gap rows for a (partial) scan_control result; caller commits."""
+    for result in scan_output["requirements"]:
+        # JSON-encode for SQLAlchemy JSONB adapter
+        rationale_json = json.dumps(result.get("rationale", ""))
+        citations_json = json.dumps(result.get("citations", []))
+        
+        scan_result = ScanResult(
+            scan_id=scan.id,
+            requirement_id=result["requirement_id"],
+            outcome=result["outcome"],
+            confidence=str(result["confidence"]),
+            rationale_json=rationale_json,
+            citations_json=citations_json
+        )
+        db.add(scan_result)
+    
+    # Store gaps
+    for gap in scan_output["gaps"]:
+        # Ensure recommended_actions is properly serialized
+        recommended_actions = gap.get("recommended_actions", [])
+        if isinstance(recommended_actions, (list, dict)):
+            recommended_actions_json = json.dumps(recommended_actions)
+        elif isinstance(recommended_actions, str):
+            # Try to parse and re-serialize to ensure valid JSON
+            try:
+                parsed = json.loads(recommended_actions)
+                recommended_actions_json = json.dumps(parsed)
+            except json.JSONDecodeError:
+                recommended_actions_json = json.dumps([])
+        else:
+            recommended_actions_json = json.dumps([])
+        
+        gap_record = Gap(
+            scan_id=scan.id,
+            requirement_id=gap["requirement_id"],
+            gap_summary=gap["summary"],
+            recommended_actions_json=recommended_actions_json
+        )
+        db.add(gap_record)
+
+def _scan_model_name(settings) -> str:
+    """Model label recorded on a scan, from the org's AI settings."""
+    if settings.ai_provider == 'ollama':
+        return f"{settings.ollama_model} (Ollama)"
+    if settings.ai_provider == 'openai':
+        return settings.openai_model or 'gpt-4o-mini'
+    return 'gpt-4'
+
+
+class ScanCancelled(Exception):
+    """The scan was given up on (e.g. by its batch at the time limit) before it finished."""
+
+
+def _run_scan(db, scan: Scan, control: Control, requirements: List[Requirement],
+              linked_document_ids: List[Any], corpus: Optional[EvidenceCorpus] = None,
+              cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
+    """
+    Select evidence, run the AI scan and store its results on an already-started scan.
+
+    corpus is a prebuilt EvidenceCorpus shared by a framework batch; without it
+    the linked documents' chunks are loaded for this scan alone. Once cancel is
+    set, no further requirements are sent. The scan is only marked completed if
+    it is still processing; otherwise ScanCancelled is raised.
+    """
+    # Update progress: gathering evidence
+    scan.progress_percentage = 10
+    scan.current_step = f'Gathering evidence from {len(linked_document_ids)} documents...'
+    db.commit()
+
+    # Select the most relevant chunks of the linked documents for each
+    # requirement instead of sending every page of every document
+    if corpus is not None:
+        evidence_by_requirement = corpus.select(requirements, document_ids=linked_document_ids)
+    else:
+        evidence_by_requirement = evidence_index.select_evidence(
+            db, scan.org_id, linked_document_ids, requirements
+        )
+
+    # Union of the selections, for single-prompt (non fan-out) scans
+    evidence_texts = []
+    seen_chunks = set()
+    for selected in evidence_by_requirement.values():
+        for evidence in selected:
+            chunk_key = (evidence["document_id"], evidence["page_num"], evidence["text"])
+            if chunk_key not in seen_chunks:
+                seen_chunks.add(chunk_key)
+                evidence_texts.append(evidence)
+
+    # Clear results left behind by a previous (retried) attempt of this scan
+    db.query(ScanResult).filter(ScanResult.scan_id == scan.id).delete(synchronize_session=False)
+    db.query(Gap).filter(Gap.scan_id == scan.id).delete(synchronize_session=False)
+
+    # Update progress: starting AI analysis
+    scan.progress_percentage = 20
+    scan.current_step = f'Analyzing {len(requirements)} requirements with AI...'
+    db.commit()
+
+    total_requirements = len(requirements)
+
+    def store_partial_result(partial: Dict[str, Any], completed: int):
+        # Persist each finished requirement right away so progress is real
+        # and a late failure doesn't discard completed work
+        if cancel is not None and cancel.is_set():
+            return
+        _store_scan_output(db, scan, partial)
+        scan.processed_requirements = completed
+        scan.progress_percentage = 20 + int(75 * completed / max(total_requirements, 1))
+        scan.current_step = f'Analyzed {completed}/{total_requirements} requirements'
+        db.commit()
+
+    # Run AI scan
+    scan_results = compliance_scanner.scan_control(
+        control=control,
+        requirements=requirements,
+        evidence_texts=evidence_texts,
+        org_id=scan.org_id,
+        evidence_by_requirement=evidence_by_requirement,
+        on_result=store_partial_result,
+        cancel=cancel,
+    )
+    if cancel is not None and cancel.is_set():
+        raise ScanCancelled(f"Scan {scan.id} cancelled")
+
+    # Update scan status, unless something else (e.g. its batch) has failed it meanwhile
+    updated = db.query(Scan).filter(Scan.id == scan.id, Scan.status == 'processing').update({
+        Scan.status: 'completed',
+        Scan.progress_percentage: 100,
+        Scan.current_step: 'Scan completed',
+        Scan.processed_requirements: total_requirements,
+    }, synchronize_session=False)
+    db.commit()
+    if not updated:
+        raise ScanCancelled(f"Scan {scan.id} is no longer processing")
+    return scan_results
 
 
 @celery_app.task(bind=True)
@@ -121,14 +406,7 @@ def process_scan(self, scan_id: str):
         logger.info(f"Starting compliance scan {scan_id} for control {scan.control.code}")
 
         # Get AI provider and model from this org's settings
-        from ai_scanner import get_or_create_settings
-        settings = get_or_create_settings(db, scan.org_id)
-        if settings.ai_provider == 'ollama':
-            model_name = f"{settings.ollama_model} (Ollama)"
-        elif settings.ai_provider == 'openai':
-            model_name = settings.openai_model or 'gpt-4o-mini'
-        else:
-            model_name = 'gpt-4'
+        model_name = _scan_model_name(settings_cache.get(scan.org_id))
 
         # Get control and requirements first to set total
         control = scan.control
@@ -174,110 +452,13 @@ def process_scan(self, scan_id: str):
 
         logger.info(f"Found {len(manual_evidence_links)} manual + {len(ai_evidence_links)} AI-linked evidence for control {control.code}")
 
-        # Update progress: gathering evidence
-        scan.progress_percentage = 10
-        scan.current_step = f'Gathering evidence from {total_evidence} documents...'
-        db.commit()
-
-        # Gather evidence text from both sources
-        evidence_texts = []
-
-        # Process manual evidence links
-        for link in manual_evidence_links:
-            document_pages = db.query(DocumentPage).filter(
-                DocumentPage.document_id == link.document_id
-            ).all()
-
-            for page in document_pages:
-                if page.text:
-                    evidence_texts.append({
-                        "document_id": str(link.document_id),
-                        "document_name": link.document.filename,
-                        "page_num": page.page_num,
-                        "text": page.text
-                    })
-
-        # Process AI-linked evidence
-        for link in ai_evidence_links:
-            document_pages = db.query(DocumentPage).filter(
-                DocumentPage.document_id == link.document_id
-            ).all()
-
-            for page in document_pages:
-                if page.text:
-                    evidence_texts.append({
-                        "document_id": str(link.document_id),
-                        "document_name": link.document.filename,
-                        "page_num": page.page_num,
-                        "text": page.text
-                    })
-
-        # Update progress: starting AI analysis
-        scan.progress_percentage = 20
-        scan.current_step = f'Analyzing {len(requirements)} requirements with AI...'
-        db.commit()
-
-        # Run AI scan
-        scan_results = compliance_scanner.scan_control(
-            control=control,
-            requirements=requirements,
-            evidence_texts=evidence_texts,
-            org_id=scan.org_id,
-        )
-
-        # Update progress: AI analysis complete
-        scan.progress_percentage = 80
-        scan.current_step = 'Storing scan results...'
-        db.commit()
-        
-        # Store scan results
-        for result in scan_results["requirements"]:
-            # JSON-encode for SQLAlchemy JSONB adapter
-            rationale_json = json.dumps(result.get("rationale", ""))
-            citations_json = json.dumps(result.get("citations", []))
-            
-            scan_result = ScanResult(
-                scan_id=scan.id,
-                requirement_id=result["requirement_id"],
-                outcome=result["outcome"],
-                confidence=str(result["confidence"]),
-                rationale_json=rationale_json,
-                citations_json=citations_json
-            )
-            db.add(scan_result)
-        
-        # Store gaps
-        for gap in scan_results["gaps"]:
-            # Ensure recommended_actions is properly serialized
-            recommended_actions = gap.get("recommended_actions", [])
-            if isinstance(recommended_actions, (list, dict)):
-                recommended_actions_json = json.dumps(recommended_actions)
-            elif isinstance(recommended_actions, str):
-                # Try to parse and re-serialize to ensure valid JSON
-                try:
-                    parsed = json.loads(recommended_actions)
-                    recommended_actions_json = json.dumps(parsed)
-                except json.JSONDecodeError:
-                    recommended_actions_json = json.dumps([])
-            else:
-                recommended_actions_json = json.dumps([])
-            
-            gap_record = Gap(
-                scan_id=scan.id,
-                requirement_id=gap["requirement_id"],
-                gap_summary=gap["summary"],
-                recommended_actions_json=recommended_actions_json
-            )
-            db.add(gap_record)
-        
-        # Update scan status
-        scan.status = 'completed'
-        scan.progress_percentage = 100
-        scan.current_step = 'Scan completed'
-        scan.processed_requirements = len(requirements)
-        db.commit()
+        linked_document_ids = [link.document_id for link in manual_evidence_links]
+        linked_document_ids += [link.document_id for link in ai_evidence_links]
+        scan_results = _run_scan(db, scan, control, requirements, linked_document_ids)
 
         logger.info(f"Compliance scan {scan_id} completed successfully")
+        pools = pool_stats()
+        logger.info(f"AI connection pools: {pools['hits']} hits / {pools['misses']} misses ({len(pools['pools'])} open)")
         
         return {
             "status": "success",
@@ -285,7 +466,12 @@ def process_scan(self, scan_id: str):
             "requirements_processed": len(scan_results["requirements"]),
             "gaps_found": len(scan_results["gaps"])
         }
-        
+
+    except ScanCancelled as e:
+        # Failed by someone else while it ran; not retried
+        logger.warning(f"Compliance scan {scan_id} stopped: {e}")
+        db.rollback()
+        return {"status": "cancelled", "scan_id": scan_id}
     except Exception as e:
         logger.error(f"Error processing scan {scan_id}: {str(e)}")
         db.rollback()
@@ -303,6 +489,241 @@ def process_scan(self, scan_id: str):
     finally:
         db.close()
 
+
+def _scan_batch_control(scan_id, control_id, document_ids: List[Any], corpus: EvidenceCorpus,
+                        cancel: Optional[threading.Event] = None) -> bool:
+    """Run one child scan of a batch in its own session; returns False if it failed or was cancelled."""
+    db = SessionLocal()
+    scan = None
+    try:
+        scan = db.query(Scan).filter(Scan.id == scan_id).first()
+        if not scan:
+            logger.error(f"Batch scan {scan_id} not found")
+            return False
+        control = db.query(Control).filter(Control.id == control_id).first()
+        if not control:
+            logger.error(f"Control {control_id} of batch scan {scan_id} not found")
+            scan.status = 'failed'
+            scan.current_step = 'Error: control not found'
+            db.commit()
+            return False
+        requirements = db.query(Requirement).filter(Requirement.control_id == control_id).all()
+
+        scan.status = 'processing'
+        scan.current_step = 'Initializing scan...'
+        scan.total_requirements = len(requirements)
+        scan.processed_requirements = 0
+        db.commit()
+
+        _run_scan(db, scan, control, requirements, document_ids, corpus=corpus, cancel=cancel)
+        logger.info(f"Batch scan {scan_id} for control {control.code} completed")
+        return True
+    except ScanCancelled as e:
+        # The batch has already marked it failed and counted it
+        logger.warning(f"Batch scan {scan_id} stopped: {e}")
+        db.rollback()
+        return False
+    except Exception as e:
+        # No per-control retry: the batch records the failure and moves on
+        logger.error(f"Error processing batch scan {scan_id}: {str(e)}")
+        db.rollback()
+        if scan is not None:
+            try:
+                scan.status = 'failed'
+                scan.current_step = f'Error: {str(e)[:100]}'
+                db.commit()
+            except Exception as status_err:
+                logger.error(f"Failed to mark scan {scan_id} as failed: {status_err}")
+                db.rollback()
+        return False
+    finally:
+        db.close()
+
+
+@celery_app.task(bind=True, soft_time_limit=FRAMEWORK_SCAN_SOFT_TIME_LIMIT, time_limit=FRAMEWORK_SCAN_TIME_LIMIT)
+def process_framework_scan(self, batch_id: str):
+    """
+    Scan every control of a framework that has linked evidence.
+
+    Controls, requirements and evidence links are loaded in a few grouped
+    queries and the org's evidence chunks are indexed once, then shared by
+    all child scans, which run FRAMEWORK_SCAN_CONCURRENCY at a time. Controls
+    not finished FRAMEWORK_SCAN_SOFT_TIME_LIMIT seconds after the task started
+    are marked failed, and those still running stop before their next requirement.
+    """
+    deadline = time.monotonic() + FRAMEWORK_SCAN_SOFT_TIME_LIMIT
+    cancel = threading.Event()
+    db = SessionLocal()
+    batch = None
+    try:
+        batch = db.query(ScanBatch).filter(ScanBatch.id == batch_id).first()
+        if not batch:
+            raise ValueError(f"Scan batch {batch_id} not found")
+
+        batch.status = 'processing'
+        batch.current_step = 'Loading controls and evidence...'
+        db.commit()
+
+        model_name = _scan_model_name(settings_cache.get(batch.org_id))
+
+        controls = (
+            db.query(Control)
+            .filter(Control.framework_id == batch.framework_id)
+            .order_by(Control.code)
+            .all()
+        )
+        control_ids = [control.id for control in controls]
+
+        requirement_counts = defaultdict(int)
+        for (control_id,) in db.query(Requirement.control_id).filter(Requirement.control_id.in_(control_ids)):
+            requirement_counts[control_id] += 1
+
+        # Manual and AI-linked evidence for all controls, org-scoped as in process_scan
+        documents_by_control = defaultdict(list)
+        for control_id, document_id in db.query(EvidenceLink.control_id, EvidenceLink.document_id).filter(
+            EvidenceLink.org_id == batch.org_id,
+            EvidenceLink.control_id.in_(control_ids),
+        ):
+            documents_by_control[control_id].append(document_id)
+        for control_id, document_id in (
+            db.query(DocumentControlLink.control_id, DocumentControlLink.document_id)
+            .join(Document, DocumentControlLink.document_id == Document.id)
+            .filter(
+                DocumentControlLink.control_id.in_(control_ids),
+                Document.org_id == batch.org_id,
+            )
+        ):
+            documents_by_control[control_id].append(document_id)
+
+        work = []
+        for control in controls:
+            document_ids = list(dict.fromkeys(documents_by_control.get(control.id, [])))
+            if not document_ids:
+                continue
+            scan = Scan(
+                org_id=batch.org_id,
+                control_id=control.id,
+                batch_id=batch.id,
+                status='pending',
+                model=model_name,
+                prompt_version='v1.0',
+                total_requirements=requirement_counts[control.id],
+            )
+            db.add(scan)
+            work.append((scan, control.id, document_ids))
+
+        batch.total_controls = len(controls)
+        batch.skipped_controls = len(controls) - len(work)
+        batch.completed_controls = 0
+        batch.failed_controls = 0
+        all_document_ids = list(dict.fromkeys(d for _, _, ids in work for d in ids))
+        batch.current_step = f'Indexing evidence from {len(all_document_ids)} documents...'
+        db.commit()
+
+        if not work:
+            batch.status = 'completed'
+            batch.progress_percentage = 100
+            batch.current_step = 'No evidence to scan'
+            db.commit()
+            return {"status": "completed", "message": "No evidence to scan"}
+
+        corpus = evidence_index.build_corpus(db, batch.org_id, all_document_ids)
+        logger.info(f"Scan batch {batch_id}: {len(work)} controls with evidence, "
+                    f"{batch.skipped_controls} skipped, {len(corpus.chunks)} chunks from "
+                    f"{corpus.document_count} documents")
+
+        batch.progress_percentage = 5
+        batch.current_step = f'Scanning {len(work)} controls...'
+        db.commit()
+
+        # Controls are submitted as slots free up, so none start after the deadline
+        concurrency = max(1, FRAMEWORK_SCAN_CONCURRENCY)
+        queued = list(work)
+        running: Dict[Any, Scan] = {}
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            while queued or running:
+                while queued and len(running) < concurrency:
+                    scan, control_id, document_ids = queued.pop(0)
+                    running[executor.submit(_scan_batch_control, scan.id, control_id, document_ids, corpus,
+                                            cancel)] = scan
+                remaining = deadline - time.monotonic()
+                finished = set()
+                if remaining > 0:
+                    finished, _ = wait(running, timeout=remaining, return_when=FIRST_COMPLETED)
+                if not finished:
+                    break
+                for future in finished:
+                    running.pop(future)
+                    if future.result():
+                        batch.completed_controls += 1
+                    else:
+                        batch.failed_controls += 1
+                done = batch.completed_controls + batch.failed_controls
+                batch.progress_percentage = 5 + int(95 * done / len(work))
+                batch.current_step = f'Scanned {done}/{len(work)} controls'
+                db.commit()
+        finally:
+            # Scans still running at the deadline stop before their next requirement;
+            # don't wait for the requests they have in flight
+            cancel.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        unfinished = list(running.values()) + [scan for scan, _, _ in queued]
+        if unfinished:
+            logger.warning(f"Scan batch {batch_id} reached its {FRAMEWORK_SCAN_SOFT_TIME_LIMIT}s limit with "
+                           f"{len(running)} controls running and {len(queued)} not started; marking them failed")
+            db.query(Scan).filter(
+                Scan.id.in_([scan.id for scan in unfinished]),
+                Scan.status.in_(('pending', 'processing')),
+            ).update({Scan.status: 'failed', Scan.current_step: 'Error: batch time limit reached'},
+                     synchronize_session=False)
+            # A running scan may have finished just before it was failed; count what the children say
+            statuses = [status for (status,) in db.query(Scan.status).filter(Scan.batch_id == batch.id)]
+            batch.completed_controls = statuses.count('completed')
+            batch.failed_controls = statuses.count('failed')
+            db.commit()
+
+        batch.status = 'failed' if batch.completed_controls == 0 else 'completed'
+        batch.progress_percentage = 100
+        batch.current_step = (
+            f'Batch completed: {batch.completed_controls} scanned, {batch.failed_controls} failed, '
+            f'{batch.skipped_controls} without evidence'
+        )
+        db.commit()
+
+        logger.info(f"Scan batch {batch_id} finished: {batch.current_step}")
+        return {
+            "status": batch.status,
+            "batch_id": str(batch.id),
+            "completed_controls": batch.completed_controls,
+            "failed_controls": batch.failed_controls,
+            "skipped_controls": batch.skipped_controls,
+        }
+
+    except Exception as e:
+        # Not retried: child scans already created would be duplicated
+        cancel.set()
+        logger.error(f"Error processing scan batch {batch_id}: {str(e)}")
+        db.rollback()
+        if batch is not None:
+            try:
+                batch.status = 'failed'
+                batch.current_step = f'Error: {str(e)[:100]}'
+                # Child scans the batch will no longer run or wait for
+                db.query(Scan).filter(
+                    Scan.batch_id == batch.id,
+                    Scan.status.in_(('pending', 'processing')),
+                ).update({Scan.status: 'failed', Scan.current_step: 'Error: scan batch failed'},
+                         synchronize_session=False)
+                db.commit()
+            except Exception as status_err:
+                logger.error(f"Failed to mark scan batch {batch_id} as failed: {status_err}")
+                db.rollback()
+        raise
+    finally:
+        db.close()
+
 @celery_app.task
 def cleanup_old_scans():
     """
@@ -16,6 +16,11 @@ interface AISettings {
   ollama_context_size?: number;
   min_confidence_threshold?: number;
   use_dual_vision_validation?: boolean;
+  use_model_cascade?: boolean;
+  cascade_ollama_model?: string;
+  cascade_openai_model?: string;
+  cascade_escalate_min?: number;
+  cascade_escalate_max?: number;
 }
 
 export default function SettingsPage() {
@@ -644,6 +649,77 @@ export default function SettingsPage() {
                   </div>
                 </div>
               </div>
+
+              {/* Model Cascade Toggle */}
+              <div className="p-3 bg-white rounded-lg border border-purple-200">
+                <div className="flex items-start gap-3">
+                  <input
+                    type="checkbox"
+                    id="model-cascade"
+                    checked={settings.use_model_cascade || false}
+                    onChange={(e) => setSettings({ ...settings, use_model_cascade: e.target.checked })}
+                    className="mt-1 h-5 w-5 text-purple-600 border-gray-300 rounded focus:ring-purple-500"
+                  />
+                  <div className="flex-1">
+                    <label htmlFor="model-cascade" className="cursor-pointer">
+                      <span className="font-medium text-gray-900">⚡ Small Model First (Cascade)</span>
+                      <p className="text-sm text-gray-600 mt-1">
+                        Analyze uploaded documents with a small, fast model first. Only documents where a suggestion&apos;s confidence falls in the ambiguous band below are re-analyzed with the main model.
+                      </p>
+                    </label>
+                    {settings.use_model_cascade && (
+                      <div className="mt-3 space-y-3">
+                        <div>
+                          <label className="block text-sm font-medium text-gray-700 mb-1">
+                            Small {settings.provider === 'ollama' ? 'Ollama' : 'OpenAI'} Model
+                          </label>
+                          {settings.provider === 'ollama' ? (
+                            <input
+                              type="text"
+                              value={settings.cascade_ollama_model || 'qwen2.5:3b'}
+                              onChange={(e) => setSettings({ ...settings, cascade_ollama_model: e.target.value })}
+                              className="w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-purple-500 focus:border-purple-500"
+                            />
+                          ) : (
+                            <input
+                              type="text"
+                              value={settings.cascade_openai_model || 'gpt-4o-mini'}
+                              onChange={(e) => setSettings({ ...settings, cascade_openai_model: e.target.value })}
+                              className="w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-purple-500 focus:border-purple-500"
+                            />
+                          )}
+                        </div>
+                        <div>
+                          <label className="block text-sm font-medium text-gray-700 mb-1">
+                            Escalate confidence from {Math.round((settings.cascade_escalate_min ?? 0.5) * 100)}% up to {Math.round((settings.cascade_escalate_max ?? 0.95) * 100)}%
+                          </label>
+                          <div className="flex gap-3">
+                            <input
+                              type="range"
+                              min="0"
+                              max="100"
+                              value={(settings.cascade_escalate_min ?? 0.5) * 100}
+                              onChange={(e) => setSettings({ ...settings, cascade_escalate_min: Math.min(parseInt(e.target.value) / 100, settings.cascade_escalate_max ?? 0.95) })}
+                              className="w-full"
+                            />
+                            <input
+                              type="range"
+                              min="0"
+                              max="100"
+                              value={(settings.cascade_escalate_max ?? 0.95) * 100}
+                              onChange={(e) => setSettings({ ...settings, cascade_escalate_max: Math.max(parseInt(e.target.value) / 100, settings.cascade_escalate_min ?? 0.5) })}
+                              className="w-full"
+                            />
+                          </div>
+                          <p className="text-xs text-gray-600 mt-1">
+                            Small-model results with a suggestion in this band (or no suggestions) go to the main model. Keep the band around the minimum confidence threshold.
+                          </p>
+                        </div>
+                      </div>
+                    )}
+                  </div>
+                </div>
+              </div>
             </div>
 
             {/* Test Result */}
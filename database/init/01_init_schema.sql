@@ -70,6 +70,9 @@ CREATE TABLE IF NOT EXISTS documents (
     file_size BIGINT,
     uploaded_by UUID NOT NULL REFERENCES users(id),
     sha256 CHAR(64),
+    extraction_status VARCHAR(20) DEFAULT 'pending',
+    extraction_checkpoint INTEGER DEFAULT 0,
+    extractor_version VARCHAR(20),
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
@@ -80,10 +83,26 @@ CREATE TABLE IF NOT EXISTS document_pages (
     document_id UUID NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
     page_num INTEGER NOT NULL,
     text TEXT,
+    extraction_engine VARCHAR(20),
+    ocr BOOLEAN DEFAULT false,
     created_at TIMESTAMPTZ DEFAULT NOW(),
     UNIQUE(document_id, page_num)
 );
 
+-- Document chunks table (BM25 retrieval index over document_pages)
+CREATE TABLE IF NOT EXISTS document_chunks (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    org_id UUID NOT NULL REFERENCES orgs(id) ON DELETE CASCADE,
+    document_id UUID NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    page_num INTEGER NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    term_counts_json TEXT NOT NULL,
+    token_count INTEGER NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE(document_id, page_num, chunk_index)
+);
+
 -- Evidence links table (manual user-created links)
 CREATE TABLE IF NOT EXISTS evidence_links (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -109,6 +128,21 @@ CREATE TABLE IF NOT EXISTS document_control_links (
 );
 
 -- Scans table
+CREATE TABLE IF NOT EXISTS scan_batches (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    org_id UUID NOT NULL REFERENCES orgs(id) ON DELETE CASCADE,
+    framework_id UUID NOT NULL REFERENCES frameworks(id) ON DELETE CASCADE,
+    status VARCHAR(50) DEFAULT 'pending',
+    progress_percentage INTEGER DEFAULT 0,
+    current_step TEXT DEFAULT 'Initializing...',
+    total_controls INTEGER DEFAULT 0,
+    completed_controls INTEGER DEFAULT 0,
+    failed_controls INTEGER DEFAULT 0,
+    skipped_controls INTEGER DEFAULT 0,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
 CREATE TABLE IF NOT EXISTS scans (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     org_id UUID NOT NULL REFERENCES orgs(id) ON DELETE CASCADE,
@@ -120,6 +154,7 @@ CREATE TABLE IF NOT EXISTS scans (
     current_step TEXT DEFAULT 'Initializing...',
     total_requirements INTEGER DEFAULT 0,
     processed_requirements INTEGER DEFAULT 0,
+    batch_id UUID REFERENCES scan_batches(id) ON DELETE SET NULL,
     started_at TIMESTAMPTZ DEFAULT NOW(),
     completed_at TIMESTAMPTZ,
     created_at TIMESTAMPTZ DEFAULT NOW(),
@@ -175,6 +210,11 @@ CREATE TABLE IF NOT EXISTS settings (
     ollama_context_size INTEGER DEFAULT 131072,
     min_confidence_threshold REAL DEFAULT 0.90,
     use_dual_vision_validation BOOLEAN DEFAULT false,
+    use_model_cascade BOOLEAN DEFAULT false,
+    cascade_ollama_model VARCHAR(100) DEFAULT 'qwen2.5:3b',
+    cascade_openai_model VARCHAR(100) DEFAULT 'gpt-4o-mini',
+    cascade_escalate_min REAL DEFAULT 0.5,
+    cascade_escalate_max REAL DEFAULT 0.95,
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
@@ -182,6 +222,19 @@ CREATE TABLE IF NOT EXISTS settings (
 -- Settings rows are created lazily per organisation by the application
 -- (get_or_create_settings); no global default row is seeded.
 
+-- Document summaries table (step-1 analysis summaries keyed by content hash)
+CREATE TABLE IF NOT EXISTS document_summaries (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    org_id UUID NOT NULL REFERENCES orgs(id) ON DELETE CASCADE,
+    document_id UUID REFERENCES documents(id) ON DELETE SET NULL,
+    sha256 VARCHAR(64) NOT NULL,
+    model VARCHAR(255) NOT NULL,
+    prompt_version VARCHAR(50) NOT NULL,
+    summary_json TEXT NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE(org_id, sha256, model, prompt_version)
+);
+
 -- Indexes for performance (only create if they don't exist)
 CREATE INDEX IF NOT EXISTS idx_users_org_id ON users(org_id);
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
@@ -189,6 +242,9 @@ CREATE INDEX IF NOT EXISTS idx_controls_framework_id ON controls(framework_id);
 CREATE INDEX IF NOT EXISTS idx_requirements_control_id ON requirements(control_id);
 CREATE INDEX IF NOT EXISTS idx_documents_org_id ON documents(org_id);
 CREATE INDEX IF NOT EXISTS idx_document_pages_document_id ON document_pages(document_id);
+CREATE INDEX IF NOT EXISTS idx_document_chunks_org_id ON document_chunks(org_id);
+CREATE INDEX IF NOT EXISTS idx_document_chunks_document_id ON document_chunks(document_id);
+CREATE INDEX IF NOT EXISTS idx_document_summaries_document_id ON document_summaries(document_id);
 CREATE INDEX IF NOT EXISTS idx_evidence_links_org_id ON evidence_links(org_id);
 CREATE INDEX IF NOT EXISTS idx_evidence_links_control_id ON evidence_links(control_id);
 CREATE INDEX IF NOT EXISTS idx_document_control_links_document_id ON document_control_links(document_id);
@@ -197,6 +253,8 @@ CREATE INDEX IF NOT EXISTS idx_document_control_links_confidence ON document_con
 CREATE INDEX IF NOT EXISTS idx_scans_org_id ON scans(org_id);
 CREATE INDEX IF NOT EXISTS idx_scans_control_id ON scans(control_id);
 CREATE INDEX IF NOT EXISTS idx_scans_status ON scans(status);
+CREATE INDEX IF NOT EXISTS idx_scans_batch_id ON scans(batch_id);
+CREATE INDEX IF NOT EXISTS idx_scan_batches_org_id ON scan_batches(org_id);
 CREATE INDEX IF NOT EXISTS idx_scan_results_scan_id ON scan_results(scan_id);
 CREATE INDEX IF NOT EXISTS idx_gaps_scan_id ON gaps(scan_id);
 CREATE INDEX IF NOT EXISTS idx_audit_logs_org_id ON audit_logs(org_id);
@@ -221,6 +279,7 @@ DROP TRIGGER IF EXISTS update_documents_updated_at ON documents;
 DROP TRIGGER IF EXISTS update_evidence_links_updated_at ON evidence_links;
 DROP TRIGGER IF EXISTS update_document_control_links_updated_at ON document_control_links;
 DROP TRIGGER IF EXISTS update_scans_updated_at ON scans;
+DROP TRIGGER IF EXISTS update_scan_batches_updated_at ON scan_batches;
 DROP TRIGGER IF EXISTS update_settings_updated_at ON settings;
 
 CREATE TRIGGER update_orgs_updated_at BEFORE UPDATE ON orgs FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
@@ -232,4 +291,5 @@ CREATE TRIGGER update_documents_updated_at BEFORE UPDATE ON documents FOR EACH R
 CREATE TRIGGER update_evidence_links_updated_at BEFORE UPDATE ON evidence_links FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 CREATE TRIGGER update_document_control_links_updated_at BEFORE UPDATE ON document_control_links FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 CREATE TRIGGER update_scans_updated_at BEFORE UPDATE ON scans FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+CREATE TRIGGER update_scan_batches_updated_at BEFORE UPDATE ON scan_batches FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 CREATE TRIGGER update_settings_updated_at BEFORE UPDATE ON settings FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
\ No newline at end of file
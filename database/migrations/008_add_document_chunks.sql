@@ -0,0 +1,21 @@
+-- Add chunk index for retrieval-based evidence selection
+-- Migration: 008_add_document_chunks.sql
+
+CREATE TABLE IF NOT EXISTS document_chunks (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    org_id UUID NOT NULL REFERENCES orgs(id) ON DELETE CASCADE,
+    document_id UUID NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    page_num INTEGER NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    term_counts_json TEXT NOT NULL,
+    token_count INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW(),
+
+    UNIQUE(document_id, page_num, chunk_index)
+);
+
+CREATE INDEX IF NOT EXISTS idx_document_chunks_org_id ON document_chunks(org_id);
+CREATE INDEX IF NOT EXISTS idx_document_chunks_document_id ON document_chunks(document_id);
+
+COMMENT ON TABLE document_chunks IS 'Overlapping page chunks with term counts, scored with BM25 to pick scan evidence per requirement';
@@ -0,0 +1,29 @@
+-- Add framework-wide scan batches
+-- Migration: 009_add_scan_batches.sql
+
+CREATE TABLE IF NOT EXISTS scan_batches (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    org_id UUID NOT NULL REFERENCES orgs(id) ON DELETE CASCADE,
+    framework_id UUID NOT NULL REFERENCES frameworks(id) ON DELETE CASCADE,
+    status VARCHAR(50) DEFAULT 'pending',
+    progress_percentage INTEGER DEFAULT 0,
+    current_step TEXT DEFAULT 'Initializing...',
+    total_controls INTEGER DEFAULT 0,
+    completed_controls INTEGER DEFAULT 0,
+    failed_controls INTEGER DEFAULT 0,
+    skipped_controls INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_scan_batches_org_id ON scan_batches(org_id);
+
+ALTER TABLE scans
+ADD COLUMN IF NOT EXISTS batch_id UUID REFERENCES scan_batches(id) ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS idx_scans_batch_id ON scans(batch_id);
+
+DROP TRIGGER IF EXISTS update_scan_batches_updated_at ON scan_batches;
+CREATE TRIGGER update_scan_batches_updated_at BEFORE UPDATE ON scan_batches FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+COMMENT ON TABLE scan_batches IS 'Framework-wide scans; each control with evidence gets a child scan with batch_id set';
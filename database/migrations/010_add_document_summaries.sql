@@ -0,0 +1,18 @@
+-- Add persisted document summaries
+-- Migration: 010_add_document_summaries.sql
+
+CREATE TABLE IF NOT EXISTS document_summaries (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    org_id UUID NOT NULL REFERENCES orgs(id) ON DELETE CASCADE,
+    document_id UUID REFERENCES documents(id) ON DELETE SET NULL,
+    sha256 VARCHAR(64) NOT NULL,
+    model VARCHAR(255) NOT NULL,
+    prompt_version VARCHAR(50) NOT NULL,
+    summary_json TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW(),
+    UNIQUE(org_id, sha256, model, prompt_version)
+);
+
+CREATE INDEX IF NOT EXISTS idx_document_summaries_document_id ON document_summaries(document_id);
+
+COMMENT ON TABLE document_summaries IS 'Step-1 document summaries, reused while content hash, model and prompt version match';
@@ -0,0 +1,13 @@
+-- Add small-model-first cascade settings for document analysis
+-- Migration: 011_add_model_cascade.sql
+
+ALTER TABLE settings
+ADD COLUMN IF NOT EXISTS use_model_cascade BOOLEAN DEFAULT false,
+ADD COLUMN IF NOT EXISTS cascade_ollama_model VARCHAR(100) DEFAULT 'qwen2.5:3b',
+ADD COLUMN IF NOT EXISTS cascade_openai_model VARCHAR(100) DEFAULT 'gpt-4o-mini',
+ADD COLUMN IF NOT EXISTS cascade_escalate_min REAL DEFAULT 0.5,
+ADD COLUMN IF NOT EXISTS cascade_escalate_max REAL DEFAULT 0.95;
+
+COMMENT ON COLUMN settings.use_model_cascade IS 'When true, documents are analysed on the cascade model first and only escalated to the main model when a suggestion falls in the ambiguous confidence band';
+COMMENT ON COLUMN settings.cascade_escalate_min IS 'Lower bound (inclusive) of the confidence band escalated to the main model';
+COMMENT ON COLUMN settings.cascade_escalate_max IS 'Upper bound (exclusive) of the confidence band escalated to the main model';
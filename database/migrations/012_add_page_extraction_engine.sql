@@ -0,0 +1,7 @@
+-- Record which extraction engine produced each document page
+-- Migration: 012_add_page_extraction_engine.sql
+
+ALTER TABLE document_pages
+ADD COLUMN IF NOT EXISTS extraction_engine VARCHAR(20);
+
+COMMENT ON COLUMN document_pages.extraction_engine IS 'Engine that produced the page text: pymupdf, pdfplumber, python-docx, text or tesseract';
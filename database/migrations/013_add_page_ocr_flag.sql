@@ -0,0 +1,7 @@
+-- Record whether a document page's text came from OCR
+-- Migration: 013_add_page_ocr_flag.sql
+
+ALTER TABLE document_pages
+ADD COLUMN IF NOT EXISTS ocr BOOLEAN DEFAULT false;
+
+COMMENT ON COLUMN document_pages.ocr IS 'True when the page text was read by tesseract from the rendered page (scans, image uploads)';
@@ -0,0 +1,7 @@
+-- Let a retried text extraction resume after the last committed page
+-- Migration: 014_add_extraction_checkpoint.sql
+
+ALTER TABLE documents
+ADD COLUMN IF NOT EXISTS extraction_checkpoint INTEGER DEFAULT 0;
+
+COMMENT ON COLUMN documents.extraction_checkpoint IS 'Last page_num committed by extract_document_text; a retry resumes after it';
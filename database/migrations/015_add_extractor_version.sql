@@ -0,0 +1,7 @@
+-- Record the extractor version of fully extracted documents so identical uploads can reuse their pages
+-- Migration: 015_add_extractor_version.sql
+
+ALTER TABLE documents
+ADD COLUMN IF NOT EXISTS extractor_version VARCHAR(20);
+
+COMMENT ON COLUMN documents.extractor_version IS 'TextExtractor version that extracted every page; NULL until extraction completes';
@@ -0,0 +1,24 @@
+-- Track text extraction per document so it is queued once, and make pages unique per document
+-- Migration: 016_add_extraction_status.sql
+
+ALTER TABLE documents
+ADD COLUMN IF NOT EXISTS extraction_status VARCHAR(20) DEFAULT 'pending';
+
+COMMENT ON COLUMN documents.extraction_status IS 'Text extraction state: pending, running, done or failed';
+
+-- Documents that already have pages were extracted before the state was tracked
+UPDATE documents d
+SET extraction_status = 'done'
+WHERE extraction_status = 'pending'
+  AND EXISTS (SELECT 1 FROM document_pages p WHERE p.document_id = d.id);
+
+-- Drop pages duplicated by repeated extraction, keeping the first row of each page
+DELETE FROM document_pages a
+USING document_pages b
+WHERE a.document_id = b.document_id
+  AND a.page_num = b.page_num
+  AND (a.created_at, a.id) > (b.created_at, b.id);
+
+-- Page writes upsert on (document_id, page_num)
+DROP INDEX IF EXISTS idx_document_page_num;
+CREATE UNIQUE INDEX idx_document_page_num ON document_pages(document_id, page_num);